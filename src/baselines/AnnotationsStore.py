@@ -0,0 +1,74 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import re
+import numpy as np
+from ..scoring.scoring_utils import DIMENSIONS
+from ..storage import read_columns_cached
+
+
+class AnnotationsStore:
+    """Annotation files of one split (train or test) of competition data, every file read once into one concatenated array.
+    Rows of file i are `values[offsets[i]:offsets[i+1]]`. Every file has integer scenario, fold (-1 if scenario has no folds),
+    subject and video ids in `keys`, so any grouping of files (e.g. by fold and subject) is a grouped reduction over key columns."""
+
+    KEYS = ("scenario", "fold", "subject", "video")
+    NO_FOLD = -1
+    path_re = re.compile(r"scenario_(?P<scenario>\d+)(?:/fold_(?P<fold>\d+))?/(?P<split>\w+)/annotations/sub_(?P<subject>\d+)_vid_(?P<video>\d+)\.csv")
+
+    def __init__(self, data_dir, relative_paths, columns, values, offsets) -> None:
+        self.data_dir = Path(data_dir)
+        self.relative_paths = list(relative_paths)
+        self.columns = tuple(columns)
+        self.values = values
+        self.offsets = offsets
+        self.keys = np.array([self.parse_path(relative_path) for relative_path in self.relative_paths], dtype=np.int64).reshape(-1, len(self.KEYS))
+
+    @classmethod
+    def parse_path(cls, relative_path):
+        "Integer (scenario, fold, subject, video) of relative path like `scenario_2/fold_0/train/annotations/sub_0_vid_2.csv`."
+        path_search = cls.path_re.fullmatch(Path(relative_path).as_posix())
+        if path_search is None:
+            raise ValueError(f"Not an annotations file path: {relative_path}")
+        fold = path_search["fold"]
+        return int(path_search["scenario"]), int(fold) if fold is not None else cls.NO_FOLD, int(path_search["subject"]), int(path_search["video"])
+
+    @classmethod
+    def from_dir(cls, data_dir, split="train", columns=DIMENSIONS, workers=1, store=None):
+        """Read `columns` of every `<scenario>/[<fold>/]<split>/annotations/*.csv` file in `data_dir` (through binary `store` if given).
+        Files are read in parallel by `workers` processes."""
+        data_dir = Path(data_dir)
+        file_paths = sorted(data_dir.glob(f"**/{split}/annotations/*.csv"))
+        read_args = (file_paths, [columns] * len(file_paths), [store] * len(file_paths))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                arrays = list(executor.map(read_columns_cached, *read_args, chunksize=16))
+        else:
+            arrays = list(map(read_columns_cached, *read_args))
+        offsets = np.zeros(len(arrays) + 1, dtype=np.intp)
+        offsets[1:] = np.cumsum([len(array) for array in arrays])
+        values = np.concatenate(arrays) if arrays else np.empty((0, len(columns)))
+        return cls(data_dir, [file_path.relative_to(data_dir) for file_path in file_paths], columns, values, offsets)
+
+    def __len__(self):
+        return len(self.relative_paths)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def get_file_values(self, file_num):
+        return self.values[self.offsets[file_num]:self.offsets[file_num + 1]]
+
+    def file_means(self):
+        "Mean of every column of every file, shape (files, columns). NaN values are left out (as in DataFrame.mean)."
+        values = self.values.astype(np.float64)
+        finite = ~np.isnan(values)
+        file_ids = np.repeat(np.arange(len(self)), self.lengths)
+        sums = np.stack([np.bincount(file_ids, weights=np.where(finite[:, column_num], values[:, column_num], 0.0), minlength=len(self)) for column_num in range(values.shape[1])], axis=-1)
+        counts = np.stack([np.bincount(file_ids, weights=finite[:, column_num], minlength=len(self)) for column_num in range(values.shape[1])], axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return sums / counts
+
+    def select_keys(self, keys):
+        "Key columns (files, len(keys)) of given key names."
+        return self.keys[:, [self.KEYS.index(key) for key in keys]]
@@ -0,0 +1,18 @@
+from importlib import import_module
+
+
+# submodules (and numpy, pandas) are imported on first use, so `python -m src.baselines --help` starts fast
+_exports = {
+    "AnnotationsStore": ".AnnotationsStore",
+    "BASELINES": ".mean_baselines",
+    "compute_baseline": ".mean_baselines",
+    "compute_baselines": ".mean_baselines",
+    "save_predictions": ".mean_baselines",
+    "to_arrays": ".mean_baselines",
+}
+
+
+def __getattr__(name):
+    if name in _exports:
+        return getattr(import_module(_exports[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,78 @@
+from pathlib import Path
+import argparse
+import ast
+import time
+
+
+"""
+Make mean baselines (fold-wise, subject-wise, video-wise and subject-video-wise, as in make_baselines.ipynb) for all scenarios and folds.
+Every train and test annotation file is read once, baselines are grouped reductions over per-file means of train files.
+Predictions are saved to predictions/<name>/<baseline>/results (in parallel with `--workers`), with `--score True` they are
+also scored in memory, straight from arrays, and scores are saved as by score_predictions.py (scores/<name>[-finite]/<baseline>/scores.json).
+Example:
+    python -m src.baselines --workers 8 --score True
+"""
+
+root_dir = Path(__file__).parent.parent.parent
+competition_data_path = root_dir / "data" / "competition" / "competition_data"
+test_path = root_dir / "data" / "competition" / "test_annotations"
+predictions_dir = root_dir / "predictions"
+scores_dir = root_dir / "scores"
+baseline_names = ("fold-wise_mean", "subject-wise_mean", "video-wise_mean", "subvid-wise_mean")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Make mean baselines for all scenarios and folds.')
+    parser.add_argument(
+        "--name", type=str, default="competition_baselines", help="Predictions directory of baselines (every baseline is saved as one team)."
+    )
+    parser.add_argument(
+        "--baselines", type=str, nargs="+", choices=baseline_names, default=baseline_names
+    )
+    parser.add_argument(
+        "--data-dir", type=Path, default=competition_data_path, help="Competition data directory with train and test annotations."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of processes reading annotations and saving predictions."
+    )
+    parser.add_argument(
+        "--save", type=ast.literal_eval, default=True, help="Save predictions as .csv files."
+    )
+    parser.add_argument(
+        "--score", type=ast.literal_eval, default=False, help=f"Score predictions in memory against {test_path}."
+    )
+    parser.add_argument(
+        "--finite", type=ast.literal_eval, default=True
+    )
+    args = parser.parse_args()
+    from ..storage import BinaryStore
+    from ..scoring.scoring_utils import DIMENSIONS
+    from .AnnotationsStore import AnnotationsStore
+    from .mean_baselines import compute_baselines, save_predictions, to_arrays
+
+    assert args.data_dir.is_dir(), f"{args.data_dir} does not exist"
+    assert args.workers >= 1, "Number of workers has to be positive"
+    start_time = time.perf_counter()
+    # read through binary store if it was created (see src/convert_to_binary.py)
+    store = BinaryStore(args.data_dir)
+    store = store if store.exists() else None
+    train_store = AnnotationsStore.from_dir(args.data_dir, "train", DIMENSIONS, args.workers, store)
+    test_store = AnnotationsStore.from_dir(args.data_dir, "test", ("time",), args.workers, store)
+    print(f"Read {len(train_store)} train and {len(test_store)} test files in {time.perf_counter() - start_time:.2f} s")
+    baselines = compute_baselines(train_store, test_store, args.baselines)
+
+    scorer = None
+    if args.score:
+        from ..scoring.Scorer import Scorer
+        scorer = Scorer(test_path, args.finite)
+    for baseline_name, (test_file_nums, predictions) in baselines.items():
+        if args.save:
+            results_dir = predictions_dir / args.name / baseline_name / "results"
+            num_saved = save_predictions(test_store, test_file_nums, predictions, train_store.columns, results_dir, args.workers)
+            print(f"Saved {num_saved} files of {baseline_name} to {results_dir}")
+        if scorer is not None:
+            results_table = scorer.score_arrays(to_arrays(test_store, test_file_nums, predictions), baseline_name)
+            scores_path = scores_dir / (args.name + ("-finite" if args.finite else "")) / baseline_name / "scores.json"
+            results_table.save_json(scores_path)
+            print(f"Saved scores of {baseline_name} to {scores_path}")
+    print(f"Done in {time.perf_counter() - start_time:.2f} s")
@@ -0,0 +1,89 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from ..scoring.scoring_utils import compute_grouped_mean_std
+
+
+"""
+Mean baselines of make_baselines.ipynb, computed for all scenarios and folds at once.
+Every baseline predicts, for each test file, the mean of per-file means of train files in the same group. Groups are always
+within one scenario and fold, baselines differ by further keys (e.g. subject), so one grouped reduction over per-file means
+of the whole train split gives a baseline for every scenario and fold.
+"""
+
+# baseline name -> (keys grouping files within scenario and fold, scenarios the baseline is made for, as in make_baselines.ipynb)
+BASELINES = {
+    "fold-wise_mean": ((), (1, 2, 3, 4)),
+    "subject-wise_mean": (("subject",), (1, 3, 4)),
+    "video-wise_mean": (("video",), (1, 2)),
+    "subvid-wise_mean": (("subject", "video"), (1,)),
+}
+# predictions are saved (and scored) with this precision
+DECIMALS = 3
+# column order of competition annotation files, kept in saved predictions
+ANNOTATION_COLUMNS = ("time", "valence", "arousal")
+
+
+def compute_baseline(train_store, test_store, baseline_name, train_means=None):
+    """Predictions of one baseline for test files of its scenarios.
+    Returns (test file numbers, predictions array of shape (files, columns of train_store)).
+    Test files without any train file in their group are left out."""
+    group_keys, scenarios = BASELINES[baseline_name]
+    keys = ("scenario", "fold") + group_keys
+    if train_means is None:
+        train_means = train_store.file_means()
+    train_keys, test_keys = train_store.select_keys(keys), test_store.select_keys(keys)
+    # one group id for every distinct key row of train and test files
+    _, group_ids = np.unique(np.concatenate([train_keys, test_keys]), axis=0, return_inverse=True)
+    group_ids = group_ids.reshape(-1)
+    num_groups = group_ids.max() + 1 if len(group_ids) else 0
+    train_group_ids, test_group_ids = group_ids[:len(train_keys)], group_ids[len(train_keys):]
+    train_counts = np.bincount(train_group_ids, minlength=num_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        group_means, _ = compute_grouped_mean_std(train_means, train_group_ids, num_groups)
+    test_file_nums = np.flatnonzero(np.isin(test_store.select_keys(("scenario",))[:, 0], scenarios) & (train_counts[test_group_ids] > 0))
+    return test_file_nums, np.round(group_means[test_group_ids[test_file_nums]], DECIMALS)
+
+
+def compute_baselines(train_store, test_store, baseline_names=tuple(BASELINES)):
+    "Predictions of every baseline: baseline name -> (test file numbers, predictions). Train files are reduced to their means once."
+    train_means = train_store.file_means()
+    return {baseline_name: compute_baseline(train_store, test_store, baseline_name, train_means) for baseline_name in baseline_names}
+
+
+def to_arrays(test_store, test_file_nums, predictions):
+    "Predictions as `Scorer.score_arrays` input: relative path -> array (samples, columns), without writing any file."
+    return {
+        Path(test_store.relative_paths[file_num]).as_posix(): np.broadcast_to(file_predictions, (test_store.lengths[file_num], len(file_predictions)))
+        for file_num, file_predictions in zip(test_file_nums, predictions)
+    }
+
+
+def _save_file(save_filepath, file_values, test_columns, columns, file_predictions):
+    "Save test file columns (e.g. time) with constant predictions of `columns`."
+    prediction_df = pd.DataFrame(file_values, columns=test_columns)
+    for column, value in zip(columns, file_predictions):
+        prediction_df[column] = value
+    ordered_columns = [column for column in ANNOTATION_COLUMNS if column in prediction_df.columns]
+    prediction_df = prediction_df[ordered_columns + [column for column in prediction_df.columns if column not in ordered_columns]]
+    save_filepath.parent.mkdir(parents=True, exist_ok=True)
+    prediction_df.to_csv(save_filepath, index=False)
+
+
+def save_predictions(test_store, test_file_nums, predictions, columns, results_dir, workers=1):
+    "Save predictions of one baseline as .csv files in `results_dir` (the same layout as test data), with `workers` processes."
+    results_dir = Path(results_dir)
+    save_args = (
+        [results_dir / test_store.relative_paths[file_num] for file_num in test_file_nums],
+        [test_store.get_file_values(file_num) for file_num in test_file_nums],
+        [test_store.columns] * len(test_file_nums),
+        [columns] * len(test_file_nums),
+        list(predictions),
+    )
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_save_file, *save_args, chunksize=16))
+    else:
+        list(map(_save_file, *save_args))
+    return len(test_file_nums)
@@ -0,0 +1,17 @@
+from importlib import import_module
+
+
+# submodules (and numpy, pandas, scoring code) are imported on first use, so `python -m src.benchmarks --help` starts fast
+_exports = {
+    "BenchmarkSuite": ".suite",
+    "compare_results": ".suite",
+    "environment_info": ".suite",
+    "generate_dataset": ".synthetic_data",
+    "load_parameters": ".synthetic_data",
+}
+
+
+def __getattr__(name):
+    if name in _exports:
+        return getattr(import_module(_exports[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,103 @@
+from pathlib import Path
+import argparse
+import json
+import shutil
+import time
+
+
+"""
+Benchmark suite run on a synthetic dataset with the layout of EPiC 2023 data (see synthetic_data.py), so no download is needed.
+Dataset is generated in `--data-dir` on first run and reused while its scale arguments do not change.
+Results (seconds of every run of every benchmark, with environment and dataset parameters) are saved as JSON,
+with `--compare` median times are compared with an earlier run:
+    python -m src.benchmarks --subjects 10 --videos 8 --seconds 30 --teams 5
+    python -m src.benchmarks --compare benchmarks/results/<earlier run>.json
+"""
+
+root_dir = Path(__file__).parent.parent.parent
+benchmarks_dir = root_dir / "benchmarks"
+benchmark_names = (
+    "load_test_annotations", "read_physiology", "score_kernel", "score_teams", "aggregate_levels", "save_scores_json",
+    "save_scores_npz", "load_scores", "load_scores_cached", "load_scores_summary", "generate_noise", "download_extract",
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run benchmarks on synthetic EPiC-shaped dataset.')
+    parser.add_argument(
+        "--data-dir", type=Path, default=benchmarks_dir / "data", help="Directory of synthetic dataset (generated if missing or of other scale)."
+    )
+    parser.add_argument(
+        "--output", type=Path, default=None, help="Results file, defaults to benchmarks/results/<date>-<time>.json"
+    )
+    parser.add_argument(
+        "--benchmarks", type=str, nargs="+", choices=benchmark_names, default=benchmark_names
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of timed runs of every benchmark."
+    )
+    parser.add_argument(
+        "--subjects", type=int, default=5, help="Subjects of every scenario (at least 5, the number of subject folds)."
+    )
+    parser.add_argument(
+        "--videos", type=int, default=4, help="Videos of every scenario (at least 4, the number of video folds)."
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=5.0, help="Mean length of recordings."
+    )
+    parser.add_argument(
+        "--physiology-rate", type=int, default=1000, help="Sampling rate of physiology (Hz)."
+    )
+    parser.add_argument(
+        "--teams", type=int, default=3, help="Number of fake teams with predictions."
+    )
+    parser.add_argument(
+        "--seed", type=int, default=42
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of processes generating dataset (benchmarks always run in one process)."
+    )
+    parser.add_argument(
+        "--generate-only", action="store_true", help="Only generate dataset."
+    )
+    parser.add_argument(
+        "--compare", type=Path, default=None, help="Earlier results file to compare median times with."
+    )
+    args = parser.parse_args()
+    from .suite import BenchmarkSuite, compare_results, environment_info
+    from .synthetic_data import PARAMETERS_FILENAME, generate_dataset, get_parameters, load_parameters
+
+    assert args.repeat >= 1, "Number of runs has to be positive"
+    parameters = get_parameters(args.subjects, args.videos, args.seconds, args.physiology_rate, args.teams, seed=args.seed)
+    existing_parameters = load_parameters(args.data_dir)
+    if existing_parameters is None or any(existing_parameters.get(name) != value for name, value in parameters.items()):
+        if args.data_dir.exists() and any(args.data_dir.iterdir()):
+            # never remove a directory which does not hold a synthetic dataset
+            assert (args.data_dir / PARAMETERS_FILENAME).exists(), f"{args.data_dir} is not empty and holds no synthetic dataset"
+            shutil.rmtree(args.data_dir)
+        print(f"Generating synthetic dataset in {args.data_dir}")
+        start_time = time.perf_counter()
+        existing_parameters = generate_dataset(args.data_dir, **parameters, workers=args.workers)
+        print(f"Generated {existing_parameters['num_files']} files ({existing_parameters['num_bytes'] / 2 ** 20:.1f} MB) in {time.perf_counter() - start_time:.2f} s")
+    if args.generate_only:
+        exit()
+
+    work_dir = args.data_dir.parent / (args.data_dir.name + "-work")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    suite = BenchmarkSuite(args.data_dir, work_dir, args.repeat)
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment_info(root_dir),
+        "dataset": existing_parameters,
+        "repeat": args.repeat,
+        "benchmarks": suite.run(args.benchmarks, progress=lambda name, result: print(f"{name:<24} median {result['median']:.4f} s, min {result['min']:.4f} s")),
+    }
+    shutil.rmtree(work_dir, ignore_errors=True)
+    output_path = args.output if args.output is not None else benchmarks_dir / "results" / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w") as fp:
+        json.dump(results, fp, indent=2)
+    print(f"Saved results to {output_path}")
+    if args.compare is not None:
+        with open(args.compare, "r") as fp:
+            print(compare_results(json.load(fp), results).to_string(index=False, float_format=lambda value: f"{value:.4f}"))
@@ -0,0 +1,250 @@
+from pathlib import Path
+from contextlib import redirect_stdout
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import io
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import threading
+import time
+import zipfile
+import numpy as np
+import pandas as pd
+from .. import generate_additional_testing_exp as noise_generation
+from .. import io_utils
+from ..downloaders import Downloader
+from ..scoring.EPICReader import EPICReader
+from ..scoring.ResultsTable import ResultsTable
+from ..scoring.Scorer import Scorer
+from ..scoring.scoring_utils import DIMENSIONS, compute_scores_from_statistics, compute_sufficient_statistics, concatenate_series
+from .synthetic_data import load_parameters
+
+
+"""
+Benchmarks of loading, scoring, aggregation, scores saving and loading, noise generation and downloading, run on a synthetic dataset
+(see synthetic_data.py). Every benchmark runs `repeat` times, its untimed preparation (e.g. scoring teams before scores are loaded)
+is done once. Results are plain dicts (seconds of every run, min, median and sizes of processed data), saved as JSON by __main__.py.
+"""
+
+SUMMARY_LEVELS = ["folds_level", "scenarios_level"]
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def environment_info(root_dir) -> dict:
+    "Versions and hardware the benchmarks ran on, with git commit of `root_dir` (None if it is not a git repository)."
+    try:
+        git_commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_commit = None
+    return {
+        "git_commit": git_commit, "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+        "numpy": np.__version__, "pandas": pd.__version__,
+    }
+
+
+def compare_results(old_results, new_results) -> pd.DataFrame:
+    "Median seconds of benchmarks found in both results, with ratio new / old (above 1 - slower)."
+    rows = list()
+    for name, new_result in new_results["benchmarks"].items():
+        old_result = old_results["benchmarks"].get(name)
+        if old_result is not None:
+            rows.append({"benchmark": name, "old": old_result["median"], "new": new_result["median"], "ratio": new_result["median"] / old_result["median"]})
+    return pd.DataFrame(rows, columns=["benchmark", "old", "new", "ratio"])
+
+
+class BenchmarkSuite:
+    """Benchmarks on synthetic dataset in `dataset_dir`, writing their outputs (scores, noise data, downloads) to `work_dir`.
+    Every benchmark is a `bench_<name>` method returning its timings."""
+
+    BENCHMARKS = (
+        "load_test_annotations", "read_physiology", "score_kernel", "score_teams", "aggregate_levels", "save_scores_json",
+        "save_scores_npz", "load_scores", "load_scores_cached", "load_scores_summary", "generate_noise", "download_extract",
+    )
+
+    def __init__(self, dataset_dir, work_dir, repeat=3) -> None:
+        self.dataset_dir = Path(dataset_dir)
+        self.work_dir = Path(work_dir)
+        self.repeat = repeat
+        self.parameters = load_parameters(self.dataset_dir)
+        assert self.parameters is not None, f"No synthetic dataset in {self.dataset_dir}"
+        self.competition_dir = self.dataset_dir / "data" / "competition" / "competition_data"
+        self.test_dir = self.dataset_dir / "data" / "competition" / "test_annotations"
+        self.predictions_dir = self.dataset_dir / "predictions" / self.parameters["predictions_name"]
+        self.teams = sorted(team_dir.name for team_dir in self.predictions_dir.iterdir() if team_dir.is_dir())
+        self.scores_dirs = {"json": self.work_dir / "scores" / "json", "npz": self.work_dir / "scores" / "npz"}
+        self._scorer = None
+        self._results_tables = None
+
+    def measure(self, func, setup=None, **info) -> dict:
+        "Time `repeat` runs of `func` (`setup` is run before every run, untimed)."
+        seconds = list()
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            start_time = time.perf_counter()
+            func()
+            seconds.append(time.perf_counter() - start_time)
+        return {"seconds": seconds, "min": min(seconds), "median": statistics.median(seconds), **info}
+
+    def run(self, names=BENCHMARKS, progress=None) -> dict:
+        "Run benchmarks in given order. Returns name -> result."
+        results = dict()
+        for name in names:
+            results[name] = getattr(self, f"bench_{name}")()
+            if progress is not None:
+                progress(name, results[name])
+        return results
+
+    @property
+    def scorer(self):
+        if self._scorer is None:
+            self._scorer = Scorer(self.test_dir, force_finite=True)
+        return self._scorer
+
+    @property
+    def results_tables(self):
+        "Scores of every team (computed once if score_teams benchmark was not run)."
+        if self._results_tables is None:
+            self._score_teams()
+        return self._results_tables
+
+    def _score_teams(self):
+        # file indices of prediction directories are built again in every run
+        self.scorer.epic_reader.clear_index()
+        self._results_tables = {team: self.scorer.score_results_dir(self.predictions_dir / team / "results", team) for team in self.teams}
+
+    def _save_scores(self, scores_format):
+        for team, results_table in self.results_tables.items():
+            if scores_format == "json":
+                results_table.save_json(self.scores_dirs["json"] / team / "scores.json")
+            else:
+                results_table.save_npz(self.scores_dirs["npz"] / team / "scores.npz")
+
+    def _files_info(self, pattern, root_dir=None):
+        paths = sorted((root_dir or self.competition_dir).glob(pattern))
+        return paths, {"files": len(paths), "bytes": sum(path.stat().st_size for path in paths)}
+
+    def bench_load_test_annotations(self) -> dict:
+        _, info = self._files_info("**/*.csv", self.test_dir)
+        return self.measure(lambda: EPICReader(self.test_dir, use_binary_store=False), **info)
+
+    def bench_read_physiology(self) -> dict:
+        paths, info = self._files_info("**/physiology/*.csv")
+        return self.measure(lambda: [pd.read_csv(path) for path in paths], **info)
+
+    def bench_score_kernel(self) -> dict:
+        "Sufficient statistics and scores of all test files of one team in one batch (no file reading)."
+        test_index = self.scorer.epic_reader.index_dir(self.test_dir, relative_to=self.test_dir)
+        team_dir = self.predictions_dir / self.teams[-1] / "results"
+        y_test, offsets = concatenate_series([self.scorer.epic_reader.get_corresponding_test_data(path)[list(DIMENSIONS)].to_numpy() for path in test_index])
+        y_submission, _ = concatenate_series([pd.read_csv(team_dir / path)[list(DIMENSIONS)].to_numpy() for path in test_index])
+
+        def compute_scores():
+            compute_scores_from_statistics(compute_sufficient_statistics(y_test, y_submission, offsets), force_finite=True)
+        return self.measure(compute_scores, files=len(test_index), samples=len(y_test))
+
+    def bench_score_teams(self) -> dict:
+        "Scoring of prediction directories of all teams, reading prediction files (test annotations are already loaded)."
+        _, info = self._files_info("**/*.csv", self.predictions_dir)
+        # test annotations are loaded before timing
+        self.scorer
+        return self.measure(self._score_teams, teams=len(self.teams), **info)
+
+    def bench_aggregate_levels(self) -> dict:
+        "Subjects, videos, folds and scenarios levels of all teams from already computed files level results."
+        scenarios_files = list()
+        for team in self.teams:
+            for scenario_dir in sorted((self.predictions_dir / team / "results").iterdir()):
+                scenario_index = self.scorer.epic_reader.index_dir(scenario_dir)
+                subvid_paths, files_statistics, files_scores = self.scorer.score_files(scenario_dir)
+                scenarios_files.append((team, scenario_dir.name, [scenario_index[path] for path in subvid_paths], files_statistics, files_scores))
+
+        def aggregate():
+            results_tables = {team: ResultsTable(team=team) for team in self.teams}
+            for team, scenario, files_info, files_statistics, files_scores in scenarios_files:
+                self.scorer.add_scenario_scores(results_tables[team], scenario, files_info, files_statistics, files_scores)
+        return self.measure(aggregate, teams=len(self.teams), scenarios=len(scenarios_files))
+
+    def bench_save_scores_json(self) -> dict:
+        return self.measure(partial(self._save_scores, "json"), rows=sum(len(table) for table in self.results_tables.values()))
+
+    def bench_save_scores_npz(self) -> dict:
+        return self.measure(partial(self._save_scores, "npz"), rows=sum(len(table) for table in self.results_tables.values()))
+
+    def _ensure_scores(self, scores_format):
+        if not self.scores_dirs[scores_format].exists():
+            self._save_scores(scores_format)
+
+    def bench_load_scores(self) -> dict:
+        "Parsing all scores.json files of a run, without cache."
+        self._ensure_scores("json")
+        return self.measure(lambda: io_utils.load_scores(self.scores_dirs["json"], use_cache=False), teams=len(self.teams))
+
+    def bench_load_scores_cached(self) -> dict:
+        "Loading all scores.json files of a run from the up-to-date cache."
+        self._ensure_scores("json")
+        io_utils.load_scores(self.scores_dirs["json"])
+        return self.measure(lambda: io_utils.load_scores(self.scores_dirs["json"]), teams=len(self.teams))
+
+    def bench_load_scores_summary(self) -> dict:
+        "Loading folds and scenarios levels from summary blocks of scores.npz files."
+        self._ensure_scores("npz")
+        return self.measure(lambda: io_utils.load_scores(self.scores_dirs["npz"], load_levels_list=SUMMARY_LEVELS), teams=len(self.teams))
+
+    def bench_generate_noise(self) -> dict:
+        "Simulated random physiology (generate_additional_testing_exp.py) of the whole dataset, by one process."
+        paths, info = self._files_info("**/*.csv")
+        noise_generation.competition_data_path = self.competition_dir
+        noise_generation.noise_data_path = self.work_dir / "noise_data"
+        noise_generation.noise_test_path = self.work_dir / "noise_test"
+        noise_generation.competition_store = None
+        # synthetic recordings are too short for noise mean and std tolerances
+        noise_generation.validate_generated_noise = False
+
+        def clean():
+            shutil.rmtree(noise_generation.noise_data_path, ignore_errors=True)
+            shutil.rmtree(noise_generation.noise_test_path, ignore_errors=True)
+        return self.measure(lambda: [noise_generation.generate_noise_file(path) for path in paths], setup=clean, **info)
+
+    def _make_archives(self):
+        "Zip every scenario of competition data (as released), returns download records with their size and checksum."
+        archives_dir = self.work_dir / "archives"
+        archives_dir.mkdir(parents=True, exist_ok=True)
+        records = list()
+        for scenario_dir in sorted(self.competition_dir.iterdir()):
+            archive_path = archives_dir / f"{scenario_dir.name}.zip"
+            with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+                for file_path in sorted(scenario_dir.glob("**/*.csv")):
+                    zip_file.write(file_path, file_path.relative_to(self.competition_dir).as_posix())
+            with open(archive_path, "rb") as fp:
+                sha256 = hashlib.sha256(fp.read()).hexdigest()
+            records.append({"name": archive_path.name, "type": "competition_data", "size": archive_path.stat().st_size, "sha256": sha256, "extract_dir": "competition_data"})
+        return archives_dir, records
+
+    def bench_download_extract(self) -> dict:
+        "Concurrent download (from local HTTP server), verification and extraction of zipped scenarios."
+        archives_dir, records = self._make_archives()
+        download_dir = self.work_dir / "download"
+        server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=str(archives_dir)))
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        for record in records:
+            record["get_url"] = f"http://127.0.0.1:{server.server_address[1]}/{record['name']}"
+
+        def download():
+            with redirect_stdout(io.StringIO()):
+                failed_records = Downloader(download_dir).download_concurrent(records, extract_archives=True)
+            assert not failed_records, f"Failed to download {failed_records}"
+        try:
+            return self.measure(download, setup=partial(shutil.rmtree, download_dir, ignore_errors=True), archives=len(records), bytes=sum(record["size"] for record in records))
+        finally:
+            server.shutdown()
+            server.server_close()
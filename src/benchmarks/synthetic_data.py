@@ -0,0 +1,160 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import json
+import numpy as np
+import pandas as pd
+from ..perturbations import file_rng, link_or_copy
+from ..scoring.EPICReader import EPICReader
+
+
+"""
+Synthetic dataset with the layout of EPiC 2023 data, made offline at configurable scale (e.g. for benchmarks):
+    <output dir>/data/competition/competition_data/<scenario>/[fold_<n>/]{train,test}/{annotations,physiology}/sub_<s>_vid_<v>.csv
+    <output dir>/data/competition/test_annotations/<scenario>/[fold_<n>/]test/annotations/sub_<s>_vid_<v>.csv
+    <output dir>/predictions/<predictions name>/team_<k>/results/<scenario>/[fold_<n>/]test/annotations/sub_<s>_vid_<v>.csv
+Folds are taken from EPICReader.scenarios_num_folds, subject and video ids from the ids map, so synthetic files go through
+ids swaps like real ones. Scenario 1 test files continue train recordings, in other scenarios every recording is in test split
+of one fold (by subject in scenario 2, by video in scenarios 3 and 4) and in train split of the others.
+Test annotations of competition data keep only time column, as in real data. Every recording draws from its own random stream
+(see perturbations.file_rng), so data does not depend on number of workers.
+"""
+
+ANNOTATIONS_SAMPLING_RATE = 20
+PHYSIOLOGY_CHANNELS = ("ecg", "bvp", "gsr", "rsp", "skt", "emg_zygo", "emg_coru", "emg_trap")
+# key splitting recordings into folds
+FOLD_KEYS = {"scenario_2": "subject", "scenario_3": "video", "scenario_4": "video"}
+# annotation and physiology time starts at this many ms (as in real files, which do not start at 0)
+START_MS = 10000
+PARAMETERS_FILENAME = "synthetic_dataset.json"
+
+
+def make_annotations(rng, num_samples, start_ms):
+    "Slowly drifting valence and arousal in [0.5, 9.5], sampled every 50 ms."
+    values = np.clip(rng.uniform(3, 7, size=2) + np.cumsum(rng.normal(0, 0.05, size=(num_samples, 2)), axis=0), 0.5, 9.5)
+    return pd.DataFrame({
+        "time": start_ms + np.arange(num_samples) * 1000 // ANNOTATIONS_SAMPLING_RATE,
+        "valence": values[:, 0].round(3),
+        "arousal": values[:, 1].round(3),
+    })
+
+
+def make_physiology(rng, num_samples, start_ms, sampling_rate):
+    "Every channel is a sine wave of its own frequency with gaussian noise."
+    time_s = np.arange(num_samples) / sampling_rate
+    frequencies = rng.uniform(0.1, 2.0, size=len(PHYSIOLOGY_CHANNELS))
+    values = np.sin(2 * np.pi * time_s[:, None] * frequencies) + rng.normal(0, 0.2, size=(num_samples, len(PHYSIOLOGY_CHANNELS)))
+    physiology = pd.DataFrame(values.round(3), columns=list(PHYSIOLOGY_CHANNELS))
+    physiology.insert(0, "time", start_ms + np.arange(num_samples) * 1000 // sampling_rate)
+    return physiology
+
+
+def make_predictions(rng, annotations, team_num):
+    "Predictions of fake team: team 0 predicts the middle of the scale, other teams add noise growing with team number."
+    predictions = annotations.copy()
+    if team_num == 0:
+        predictions[["valence", "arousal"]] = 5.0
+    else:
+        noisy = annotations[["valence", "arousal"]].to_numpy() + rng.normal(0, 0.5 * team_num, size=(len(annotations), 2))
+        predictions[["valence", "arousal"]] = np.clip(noisy, 0.5, 9.5).round(3)
+    return predictions
+
+
+def _write_csv(df, file_path):
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(file_path, index=False)
+
+
+def generate_recording(output_dir, scenario, subject, video, parts, seconds, physiology_rate, num_teams, predictions_name, seed):
+    """Write all files of one recording. parts : list of (relative directory, split), e.g. train split in every fold but one.
+    Train files are written once and linked to other folds (a recording is in test split of one fold only). Returns number of bytes of all files."""
+    output_dir = Path(output_dir)
+    competition_dir = output_dir / "data" / "competition" / "competition_data"
+    test_annotations_dir = output_dir / "data" / "competition" / "test_annotations"
+    filename = f"sub_{subject}_vid_{video}.csv"
+    rng = file_rng(f"{scenario}/{filename}", seed)
+    num_samples = max(int(round(seconds * rng.uniform(0.8, 1.2) * ANNOTATIONS_SAMPLING_RATE)), 2)
+    # scenario 1 test recording continues the train one, in other scenarios the whole recording is in both splits
+    split_starts = {"train": START_MS, "test": START_MS + (num_samples * 1000 // ANNOTATIONS_SAMPLING_RATE if scenario == "scenario_1" else 0)}
+    written_paths, num_bytes = dict(), 0
+    for relative_dir, split in parts:
+        split_dir = competition_dir / relative_dir / split
+        if split in written_paths:
+            # the same recording in train split of another fold
+            for data_type in ("annotations", "physiology"):
+                link_or_copy(written_paths[split][data_type], split_dir / data_type / filename)
+                num_bytes += written_paths[split][data_type].stat().st_size
+            continue
+        split_rng = file_rng(f"{scenario}/{split}/{filename}", seed)
+        annotations = make_annotations(split_rng, num_samples, split_starts[split])
+        physiology = make_physiology(split_rng, num_samples * physiology_rate // ANNOTATIONS_SAMPLING_RATE, split_starts[split], physiology_rate)
+        paths = {"annotations": split_dir / "annotations" / filename, "physiology": split_dir / "physiology" / filename}
+        _write_csv(annotations if split == "train" else annotations[["time"]], paths["annotations"])
+        _write_csv(physiology, paths["physiology"])
+        if split == "test":
+            paths["test_annotations"] = test_annotations_dir / relative_dir / split / "annotations" / filename
+            _write_csv(annotations, paths["test_annotations"])
+            for team_num in range(num_teams):
+                paths[f"team_{team_num}"] = output_dir / "predictions" / predictions_name / f"team_{team_num}" / "results" / relative_dir / split / "annotations" / filename
+                _write_csv(make_predictions(file_rng(f"team_{team_num}/{scenario}/{filename}", seed), annotations, team_num), paths[f"team_{team_num}"])
+        written_paths[split] = paths
+        num_bytes += sum(path.stat().st_size for path in paths.values())
+    return num_bytes
+
+
+def get_parameters(num_subjects=5, num_videos=4, seconds=5.0, physiology_rate=1000, num_teams=3, predictions_name="synthetic", seed=42):
+    "Parameters of synthetic dataset (saved with it, a dataset with the same parameters is not generated again)."
+    return {
+        "num_subjects": num_subjects, "num_videos": num_videos, "seconds": seconds, "physiology_rate": physiology_rate,
+        "num_teams": num_teams, "predictions_name": predictions_name, "seed": seed,
+    }
+
+
+def load_parameters(output_dir):
+    "Parameters of dataset generated in `output_dir`, None if there is no (complete) dataset."
+    parameters_path = Path(output_dir) / PARAMETERS_FILENAME
+    if not parameters_path.exists():
+        return None
+    with open(parameters_path, "r") as fp:
+        return json.load(fp)
+
+
+def generate_dataset(output_dir, num_subjects=5, num_videos=4, seconds=5.0, physiology_rate=1000, num_teams=3, predictions_name="synthetic", seed=42, workers=1) -> dict:
+    """Generate synthetic dataset in `output_dir` (see module docstring). Every scenario has `num_subjects` subjects and `num_videos` videos
+    (their ids are the first ones of the ids map), recordings last `seconds` (+-20%). Returns parameters with number of files and bytes."""
+    output_dir = Path(output_dir)
+    parameters = get_parameters(num_subjects, num_videos, seconds, physiology_rate, num_teams, predictions_name, seed)
+    # reader of (not yet generated) test annotations, only its folds and ids maps are used
+    epic_reader = EPICReader(output_dir / "data" / "competition" / "test_annotations", use_binary_store=False)
+    recordings = list()
+    for scenario, num_folds in epic_reader.scenarios_num_folds.items():
+        subjects = sorted(int(subject) for subject in epic_reader.OLD_NEW_IDS[scenario, "subjects"].values())
+        videos = sorted(int(video) for video in epic_reader.OLD_NEW_IDS[scenario, "videos"].values())
+        assert num_subjects <= len(subjects) and num_videos <= len(videos), f"{scenario} has {len(subjects)} subjects and {len(videos)} videos"
+        subjects, videos = subjects[:num_subjects], videos[:num_videos]
+        if num_folds is not None:
+            num_keys = num_subjects if FOLD_KEYS[scenario] == "subject" else num_videos
+            assert num_keys >= num_folds, f"{scenario} needs at least {num_folds} {FOLD_KEYS[scenario]}s, one for every fold"
+        for subject_num, subject in enumerate(subjects):
+            for video_num, video in enumerate(videos):
+                if num_folds is None:
+                    parts = [(Path(scenario), "train"), (Path(scenario), "test")]
+                else:
+                    test_fold = (subject_num if FOLD_KEYS[scenario] == "subject" else video_num) % num_folds
+                    parts = [(Path(scenario) / f"fold_{fold}", "test" if fold == test_fold else "train") for fold in range(num_folds)]
+                recordings.append((scenario, subject, video, parts))
+    generate_args = [
+        [output_dir] * len(recordings), *zip(*recordings), [seconds] * len(recordings), [physiology_rate] * len(recordings),
+        [num_teams] * len(recordings), [predictions_name] * len(recordings), [seed] * len(recordings),
+    ]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            num_bytes = sum(executor.map(generate_recording, *generate_args, chunksize=4))
+    else:
+        num_bytes = sum(map(generate_recording, *generate_args))
+    parameters["num_recordings"] = len(recordings)
+    parameters["num_files"] = sum(1 for _ in output_dir.glob("**/*.csv"))
+    parameters["num_bytes"] = num_bytes
+    # parameters are saved last, so an interrupted generation is not taken for a complete dataset
+    with open(output_dir / PARAMETERS_FILENAME, "w") as fp:
+        json.dump(parameters, fp)
+    return parameters
@@ -0,0 +1,69 @@
+from pathlib import Path
+import subprocess
+import argparse
+import sys
+
+
+"""
+Check startup cost of command line entry points (and io_utils, imported by notebooks).
+Every entry point is run with `--help` under `python -X importtime` and the check fails if any heavy module
+is imported before arguments are parsed, or if imports take longer than the budget (on top of bare interpreter startup).
+generate_additional_testing_exp.py is deliberately not checked: it takes no arguments (settings are module variables),
+so running it always generates data, and the benchmark suite imports it as a module for its settings and competition store.
+Run it after changing imports of entry points:
+    python -m src.check_startup
+"""
+
+root_dir = Path(__file__).parent.parent
+# (name, python arguments, working directory)
+entry_points = [
+    ("score_predictions", ["-m", "src.score_predictions", "--help"], root_dir),
+    ("serve_scoring", ["-m", "src.serve_scoring", "--help"], root_dir),
+    ("compare_teams", ["-m", "src.compare_teams", "--help"], root_dir),
+    ("convert_to_binary", ["-m", "src.convert_to_binary", "--help"], root_dir),
+    ("baselines", ["-m", "src.baselines", "--help"], root_dir),
+    ("screen_signal_quality", ["-m", "src.screen_signal_quality", "--help"], root_dir),
+    ("benchmarks", ["-m", "src.benchmarks", "--help"], root_dir),
+    ("download_data", ["-m", "src.download_data", "--help"], root_dir),
+    ("generate_perturbation_tests", ["-m", "src.generate_perturbation_tests", "--help"], root_dir),
+    ("io_utils", ["-c", "import io_utils"], root_dir / "src"),
+]
+# modules which have to be imported only on first use
+heavy_modules = ("numpy", "pandas", "benedict", "sklearn", "scipy", "tqdm", "requests")
+import_time_budget_ms = 150
+
+
+def measure_imports(python_args, cwd):
+    "Run python with `-X importtime`. Returns (top-level imports time in ms, set of imported top-level packages)."
+    process = subprocess.run([sys.executable, "-X", "importtime"] + python_args, cwd=cwd, capture_output=True, text=True)
+    assert process.returncode == 0, f"'python {' '.join(python_args)}' failed:\n{process.stderr}"
+    total_us, imported = 0, set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative_us, package = line[len("import time:"):].split("|")
+        imported.add(package.strip().split(".")[0])
+        # nested imports are indented, their time is already included in cumulative time of top-level import
+        if not package.startswith("  "):
+            total_us += int(cumulative_us)
+    return total_us / 1000, imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check import time of command line entry points.')
+    parser.add_argument(
+        "--budget-ms", type=float, default=import_time_budget_ms, help="Allowed import time on top of bare interpreter startup."
+    )
+    args = parser.parse_args()
+    baseline_ms, _ = measure_imports(["-c", "pass"], root_dir)
+    failed = list()
+    for name, python_args, cwd in entry_points:
+        total_ms, imported = measure_imports(python_args, cwd)
+        import_ms = total_ms - baseline_ms
+        imported_heavy = sorted(set(heavy_modules) & imported)
+        ok = import_ms <= args.budget_ms and not imported_heavy
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: {import_ms:.1f} ms" + (f", imports {', '.join(imported_heavy)}" if imported_heavy else ""))
+        if not ok:
+            failed.append(name)
+    if failed:
+        sys.exit(f"Startup budget ({args.budget_ms:.0f} ms, no {', '.join(heavy_modules)}) exceeded by: {', '.join(failed)}")
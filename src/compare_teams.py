@@ -0,0 +1,154 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import score_predictions
+from .score_predictions import iter_teams, predictions_dir, scores_dir, score_cache_dir, setup_scoring, test_path
+import argparse
+import ast
+
+
+"""
+Test whether scores of teams differ from scores of reference predictions, e.g. of the same teams on random physiology
+(`--reference-name noise_submissions`) or of one baseline (`--reference-team`, of `--name` directory unless `--reference-name` is given).
+At least one of them is required, teams are never compared with themselves.
+For every scenario, unit (subjects, videos, folds), dimension and metric it saves mean scores with bootstrap confidence intervals,
+difference to the reference with its interval and p-value of paired permutation test, to scores/significance/<name>-vs-<reference>.csv
+Teams are compared in parallel, per-file results are taken from the scores cache when possible.
+"""
+
+
+def score_units(team_results_dir):
+    "Unit scores of every scenario (see scoring/significance.py) of one results directory."
+    from .scoring.significance import compute_unit_scores
+    scorer = score_predictions.scorer
+    scenarios_unit_scores = dict()
+    for scenario_dir in sorted(team_results_dir.iterdir()):
+        scenario_index = scorer.epic_reader.index_dir(scenario_dir)
+        subvid_paths, files_statistics, files_scores = scorer.score_files(scenario_dir)
+        if not subvid_paths:
+            continue
+        files_info = [scenario_index[subvid_path_str] for subvid_path_str in subvid_paths]
+        scenarios_unit_scores[scenario_dir.name] = compute_unit_scores(files_info, files_statistics, files_scores, scorer.force_finite)
+    return scenarios_unit_scores
+
+
+def compare_team(team_num, team_name, team_results_dir, reference_results_dir, num_resamples, num_permutations, confidence, seed):
+    "Compare one team with its reference. Returns (rows of results table, new score cache entries)."
+    import numpy as np
+    from .scoring.scoring_utils import DIMENSIONS, METRICS
+    from .scoring.significance import compare_unit_scores
+    # every team has its own random stream, so results do not depend on number of workers
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(team_num,)))
+    team_units, reference_units = score_units(team_results_dir), score_units(reference_results_dir)
+    rows = list()
+    for scenario in sorted(set(team_units) & set(reference_units)):
+        for kind in sorted(set(team_units[scenario]) & set(reference_units[scenario])):
+            labels, scores = team_units[scenario][kind]
+            reference_labels, reference_scores = reference_units[scenario][kind]
+            # pair units present in both results
+            common_labels = [label for label in labels if label in set(reference_labels)]
+            scores = scores[[labels.index(label) for label in common_labels]]
+            reference_scores = reference_scores[[reference_labels.index(label) for label in common_labels]]
+            comparison = compare_unit_scores(scores, reference_scores, num_resamples, num_permutations, rng, confidence)
+            for dim_num, dimension in enumerate(DIMENSIONS):
+                for metric_num, metric_name in enumerate(METRICS):
+                    row = {"team": team_name, "scenario": scenario, "unit": kind, "num_units": len(common_labels), "dimension": dimension, "metric": metric_name}
+                    row.update({column: values[dim_num, metric_num].item() for column, values in comparison.items()})
+                    rows.append(row)
+    return rows, score_predictions.scorer.score_cache.take_updates() if score_predictions.scorer.score_cache is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Test significance of differences between scores of teams and reference predictions.')
+    parser.add_argument(
+        "--name", type=str, required=True, help="Predictions directory of compared teams."
+    )
+    parser.add_argument(
+        "--reference-name", type=str, default=None, help="Predictions directory of reference (teams are paired by name), defaults to --name if --reference-team is given."
+    )
+    parser.add_argument(
+        "--reference-team", type=str, default=None, help="Compare every team with this team of reference directory instead of pairing by name."
+    )
+    parser.add_argument(
+        "--finite", type=ast.literal_eval, default=True
+    )
+    parser.add_argument(
+        "--resamples", type=int, default=10000, help="Number of bootstrap resamples."
+    )
+    parser.add_argument(
+        "--permutations", type=int, default=10000, help="Number of sign-flip permutations."
+    )
+    parser.add_argument(
+        "--confidence", type=float, default=0.95, help="Confidence level of bootstrap intervals."
+    )
+    parser.add_argument(
+        "--seed", type=int, default=42
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of processes comparing teams in parallel (1 - compare in this process)."
+    )
+    parser.add_argument(
+        "--cache", type=ast.literal_eval, default=True, help=f"Reuse per-file results of unchanged prediction and test files (cached in {score_cache_dir})."
+    )
+    args = parser.parse_args()
+    if args.reference_name is None and args.reference_team is None:
+        parser.error("--reference-name or --reference-team is required (otherwise every team would be compared with itself)")
+    import pandas as pd
+    from tqdm import tqdm
+    from .scoring.ScoreCache import ScoreCache
+    from .scoring.scoring_utils import METRICS
+
+    reference_name = args.reference_name if args.reference_name is not None else args.name
+    submissions_path, reference_path = predictions_dir / args.name, predictions_dir / reference_name
+    assert submissions_path.is_dir(), f"'{args.name}' not found in {predictions_dir}"
+    assert reference_path.is_dir(), f"'{reference_name}' not found in {predictions_dir}"
+    assert args.workers >= 1, "Number of workers has to be positive"
+    reference_teams = dict(iter_teams(reference_path))
+    if args.reference_team is not None:
+        assert args.reference_team in reference_teams, f"'{args.reference_team}' not found in {reference_path}"
+    comparisons = list()
+    for team_num, (team_name, team_results_dir) in enumerate(iter_teams(submissions_path)):
+        reference_team = args.reference_team if args.reference_team is not None else team_name
+        if reference_teams.get(reference_team) == team_results_dir:
+            print(f"Skipping {team_name}, it is the reference")
+            continue
+        if reference_team not in reference_teams:
+            print(f"Skipping {team_name}, no reference predictions in {reference_path}")
+            continue
+        comparisons.append((team_num, team_name, team_results_dir, reference_teams[reference_team], args.resamples, args.permutations, args.confidence, args.seed))
+
+    cache_dir = score_cache_dir if args.cache else None
+    rows = list()
+    if args.workers == 1:
+        setup_scoring(test_path, args.finite, cache_dir)
+        try:
+            for comparison in tqdm(comparisons):
+                rows.extend(compare_team(*comparison)[0])
+        finally:
+            if score_predictions.scorer.score_cache is not None:
+                score_predictions.scorer.score_cache.save()
+    else:
+        main_score_cache = ScoreCache(cache_dir, METRICS, args.finite) if cache_dir is not None else None
+        try:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=setup_scoring, initargs=(test_path, args.finite, cache_dir)) as executor:
+                futures = [executor.submit(compare_team, *comparison) for comparison in comparisons]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    team_rows, cache_updates = future.result()
+                    rows.extend(team_rows)
+                    if main_score_cache is not None:
+                        main_score_cache.apply_updates(cache_updates)
+        finally:
+            if main_score_cache is not None:
+                main_score_cache.save()
+
+    reference_str = reference_name if args.reference_team is None else f"{reference_name}-{args.reference_team}"
+    results_path = scores_dir / "significance" / f"{args.name}-vs-{reference_str}{'-finite' if args.finite else ''}.csv"
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    results_df = pd.DataFrame(rows)
+    if len(results_df):
+        # the same order regardless of workers
+        results_df = results_df.sort_values(["team", "scenario", "unit", "dimension"], kind="stable").reset_index(drop=True)
+    results_df.to_csv(results_path, index=False)
+    print(f"Saved {len(results_df)} comparisons to {results_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+from pathlib import Path
+import argparse
+
+
+"""
+Convert competition data .csv files to binary store (one .npy file per column), read by EPICReader and data generators.
+Stores are created next to converted directories (e.g. data/competition/competition_data.npystore),
+files changed after conversion are read from .csv until converted again.
+"""
+
+root_dir = Path(__file__).parent.parent
+default_data_dirs = [
+    root_dir / "data" / "competition" / "competition_data",
+    root_dir / "data" / "competition" / "test_annotations",
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert .csv data files to binary store.')
+    parser.add_argument(
+        "--data-dirs", type=Path, nargs="+", default=default_data_dirs, help="Directories with .csv files to convert."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of processes converting files."
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Convert all files, not only new or changed ones."
+    )
+    args = parser.parse_args()
+    from .storage import BinaryStore
+    for data_dir in args.data_dirs:
+        if not data_dir.is_dir():
+            print(f"Skipping {data_dir}, directory does not exist")
+            continue
+        store = BinaryStore(data_dir)
+        num_converted = store.convert(workers=args.workers, force=args.force)
+        print(f"Converted {num_converted} files from {data_dir} to {store.store_dir}")
@@ -1,6 +1,7 @@
 from pathlib import Path
-from .downloaders import Downloader
+import argparse
 import json
+from . import profiling
 
 
 def read_jsonl(fpath):
@@ -16,9 +17,36 @@ skip_urls = []
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Download data.')
+    parser.add_argument(
+        "--concurrent", action="store_true", help="Stream several records at once, resume partial downloads and verify recorded sizes/checksums."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Maximum number of concurrent downloads (with --concurrent)."
+    )
+    parser.add_argument(
+        "--extract-workers", type=int, default=1, help="Number of threads extracting members of one archive."
+    )
+    parser.add_argument(
+        "--extract-filter", type=str, nargs="+", default=None, help="Extract only archive members matching any of these patterns, e.g. '*test/annotations/*' or 'scenario_2/*'."
+    )
+    parser.add_argument(
+        "--records", type=Path, default=download_records_path, help="Path to .jsonl file with download records."
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="Record time and bytes of downloads, checksums and extraction, print summary table at the end."
+    )
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable()
+    from .downloaders import Downloader
     # load records
-    download_records = read_jsonl(download_records_path)
+    download_records = read_jsonl(args.records)
     # setup data downloader
-    data_downloader = Downloader(root_dir, skip_urls, tmp_dir_relative="tmp")
+    data_downloader = Downloader(root_dir, skip_urls, tmp_dir_relative="tmp", max_workers=args.workers, extract_workers=args.extract_workers, members_patterns=args.extract_filter)
     # download data
-    data_downloader.download(download_records, extract_archives=True, clean_tmp=True)
+    if args.concurrent:
+        data_downloader.download_concurrent(download_records, extract_archives=True, clean_tmp=True)
+    else:
+        data_downloader.download(download_records, extract_archives=True, clean_tmp=True)
+    profiling.report()
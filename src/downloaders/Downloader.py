@@ -1,14 +1,27 @@
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fnmatch import fnmatch
+from requests.adapters import HTTPAdapter
+import hashlib
+import json
+import os
 import shutil
 import zipfile
 import requests
+from .. import profiling
 
 
 class Downloader:
-    def __init__(self, root_dir, skip_urls = None, tmp_dir_relative="tmp") -> None:
+    def __init__(self, root_dir, skip_urls = None, tmp_dir_relative="tmp", max_workers=4, chunk_size=1 << 20, timeout=60, extract_workers=1, members_patterns=None) -> None:
         self.root_dir = root_dir
         self.tmp_dir = root_dir / tmp_dir_relative
         self.skip_urls = skip_urls or [""]
+        self.max_workers = max_workers
+        self.extract_workers = extract_workers
+        # extract only archive members matching any of these patterns (fnmatch style), all if None
+        self.members_patterns = members_patterns
+        self.chunk_size = chunk_size
+        self.timeout = timeout
 
     def download(self, download_records, extract_archives=False, clean_tmp=False) -> None:
         for download_dict in download_records:
@@ -20,20 +33,245 @@ class Downloader:
             # download data from gdrive
             download_path = self.download_url(download_dict["get_url"], output_dir, download_dict["name"])
             if extract_archives and download_dict.get("extract_dir"):
-                self.unzip(download_path, self.root_dir / download_dict.get("extract_dir"))
+                self.unzip(download_path, self.root_dir / download_dict.get("extract_dir"), self.members_patterns, self.extract_workers)
             if clean_tmp:
                 self.remove_from_drive(download_path)
         if clean_tmp:
             self._clean_tmp_dir()
 
-    def unzip(self, zip_path, unzip_path) -> None:
+    def download_concurrent(self, download_records, extract_archives=False, clean_tmp=False) -> list:
+        """Download records concurrently (at most `max_workers` at once) over one pooled session.
+        Files are streamed to disk in chunks, partial downloads are resumed with HTTP Range requests and,
+        if a record has "size" or "sha256" fields, downloaded files are verified against them.
+        Records whose verified artifact already exists (downloaded archive or extraction marker) are skipped.
+        Archives are extracted (one at a time) as soon as they are downloaded, so extraction overlaps with the remaining downloads.
+        Returns list of records that could not be downloaded."""
+        records_to_download = list()
+        for download_dict in download_records:
+            if download_dict["get_url"] in self.skip_urls:
+                print(f"""Skipping {download_dict["get_url"]} ({download_dict["type"]} {download_dict["name"]})""")
+                continue
+            if extract_archives and download_dict.get("extract_dir") and self.is_extracted(download_dict):
+                print(f"""Skipping {download_dict["name"]}, already extracted to {download_dict["extract_dir"]}""")
+                continue
+            records_to_download.append(download_dict)
+        failed_records = list()
+        with self.make_session() as session, ThreadPoolExecutor(max_workers=self.max_workers) as download_executor, ThreadPoolExecutor(max_workers=1) as extract_executor:
+            download_futures = {download_executor.submit(self.download_record, session, download_dict): download_dict for download_dict in records_to_download}
+            extract_futures = list()
+            for download_future in as_completed(download_futures):
+                download_dict, download_path = download_futures[download_future], download_future.result()
+                if download_path is None:
+                    failed_records.append(download_dict)
+                    continue
+                extract_futures.append(extract_executor.submit(self._finish_record, download_dict, download_path, extract_archives, clean_tmp))
+            for extract_future in extract_futures:
+                extract_future.result()
+        if clean_tmp:
+            self._clean_tmp_dir()
+        for download_dict in failed_records:
+            print(f"""Failed to download {download_dict["get_url"]} ({download_dict["type"]} {download_dict["name"]})""")
+        return failed_records
+
+    def _finish_record(self, download_dict, download_path, extract_archives, clean_tmp) -> None:
+        if extract_archives and download_dict.get("extract_dir"):
+            self.unzip(download_path, self.root_dir / download_dict.get("extract_dir"), self.members_patterns, self.extract_workers)
+            self.mark_extracted(download_dict, download_path)
+        if clean_tmp:
+            self.remove_from_drive(download_path)
+
+    def make_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers, max_retries=3)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def download_record(self, session, download_dict):
+        "Download one record to tmp directory, skipping it if verified file already exists. Returns path or None if failed."
+        fpath = self.tmp_dir / download_dict["type"] / download_dict["name"]
+        if fpath.exists():
+            expected_size = download_dict.get("size")
+            if expected_size is None and download_dict.get("sha256") is None:
+                # nothing recorded, compare with size reported by server
+                expected_size = self.remote_size(session, download_dict["get_url"], self.timeout)
+            if (expected_size is not None or download_dict.get("sha256") is not None) and self.verify_file(fpath, expected_size, download_dict.get("sha256")):
+                print(f"Skipping download of {fpath}, verified file already exists")
+                return fpath
+        return self.stream_url(session, download_dict["get_url"], fpath, download_dict.get("size"), download_dict.get("sha256"), self.chunk_size, self.timeout)
+
+    @staticmethod
+    @profiling.profiled()
+    def stream_url(session, url, fpath, expected_size=None, expected_sha256=None, chunk_size=1 << 20, timeout=60):
+        """Stream `url` to `fpath` in chunks, resuming `fpath`.part left by an interrupted download.
+        Returns path to verified file or None if download or verification failed."""
+        fpath = Path(fpath)
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        part_path = fpath.with_name(fpath.name + ".part")
+        file_hash = hashlib.sha256()
+        downloaded_size = 0
+        if part_path.exists():
+            downloaded_size = part_path.stat().st_size
+            # hash already downloaded bytes, so the whole file is hashed once
+            with open(part_path, "rb") as fp:
+                for chunk in iter(lambda: fp.read(chunk_size), b""):
+                    file_hash.update(chunk)
+        headers = {"Range": f"bytes={downloaded_size}-"} if downloaded_size else dict()
+        restart = False
+        try:
+            print(f"Downloading {url} to {fpath}" + (f" (resuming at {downloaded_size} bytes)" if downloaded_size else ""))
+            with session.get(url, headers=headers, stream=True, allow_redirects=True, timeout=timeout) as r:
+                if r.status_code == 416 and downloaded_size:
+                    # nothing left to download, unless .part is longer than remote file (its size is checked below if it is recorded)
+                    if expected_size is None:
+                        remote_size = Downloader.content_range_total(r.headers.get("Content-Range"))
+                        if remote_size is None:
+                            remote_size = Downloader.remote_size(session, url, timeout)
+                        restart = remote_size != downloaded_size
+                else:
+                    r.raise_for_status()
+                    if downloaded_size and r.status_code != 206:
+                        # server ignored range request, start from scratch
+                        downloaded_size = 0
+                        file_hash = hashlib.sha256()
+                    with open(part_path, "ab" if downloaded_size else "wb") as f:
+                        for chunk in r.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            file_hash.update(chunk)
+                            profiling.add_bytes(len(chunk))
+        except (requests.RequestException, OSError) as e:
+            print(f"Could not download {url}: {e}")
+            return None
+        if restart:
+            print(f"Size of {part_path} does not match remote file, downloading it again")
+            Downloader.remove_from_drive(part_path)
+            return Downloader.stream_url(session, url, fpath, expected_size, expected_sha256, chunk_size, timeout)
+        size = part_path.stat().st_size
+        if expected_size is not None and size != expected_size:
+            print(f"Wrong size of {fpath}: {size} (expected {expected_size})")
+            Downloader.remove_from_drive(part_path)
+            return None
+        if expected_sha256 is not None and file_hash.hexdigest() != expected_sha256:
+            print(f"Wrong sha256 checksum of {fpath}")
+            Downloader.remove_from_drive(part_path)
+            return None
+        part_path.replace(fpath)
+        return fpath
+
+    @staticmethod
+    @profiling.profiled()
+    def file_checksum(fpath, chunk_size=1 << 20) -> str:
+        profiling.add_file_bytes(fpath)
+        file_hash = hashlib.sha256()
+        with open(fpath, "rb") as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), b""):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def verify_file(fpath, expected_size=None, expected_sha256=None) -> bool:
+        "Check file size and checksum (only the ones that are given)."
+        fpath = Path(fpath)
+        if expected_size is not None and fpath.stat().st_size != expected_size:
+            return False
+        if expected_sha256 is not None and Downloader.file_checksum(fpath) != expected_sha256:
+            return False
+        return True
+
+    @staticmethod
+    def content_range_total(content_range):
+        "Total size from Content-Range header (e.g. `bytes */1234` of 416 response), None if unknown."
+        if content_range is None or "/" not in content_range:
+            return None
+        total = content_range.rsplit("/", 1)[1].strip()
+        return int(total) if total.isdigit() else None
+
+    @staticmethod
+    def remote_size(session, url, timeout=60):
+        "Get size of remote file from Content-Length header, None if unknown."
+        try:
+            r = session.head(url, allow_redirects=True, timeout=timeout)
+            r.raise_for_status()
+        except requests.RequestException:
+            return None
+        content_length = r.headers.get("Content-Length")
+        return int(content_length) if content_length is not None else None
+
+    def _extraction_marker_path(self, download_dict) -> Path:
+        return self.root_dir / download_dict["extract_dir"] / ".downloads" / (download_dict["name"] + ".json")
+
+    def is_extracted(self, download_dict) -> bool:
+        "Check if record was extracted from archive matching recorded size and checksum."
+        marker_path = self._extraction_marker_path(download_dict)
+        if not marker_path.exists():
+            return False
+        with open(marker_path, "r") as fp:
+            marker = json.load(fp)
+        if marker.get("members_patterns") is not None and marker.get("members_patterns") != self.members_patterns:
+            # only part of the archive was extracted before
+            return False
+        return all(download_dict.get(key) in (None, marker.get(key)) for key in ("get_url", "size", "sha256"))
+
+    def mark_extracted(self, download_dict, download_path) -> None:
+        marker_path = self._extraction_marker_path(download_dict)
+        marker_path.parent.mkdir(parents=True, exist_ok=True)
+        marker = {
+            "get_url": download_dict["get_url"],
+            "size": Path(download_path).stat().st_size,
+            "sha256": self.file_checksum(download_path),
+            "members_patterns": self.members_patterns,
+        }
+        with open(marker_path, "w") as fp:
+            json.dump(marker, fp)
+
+    @profiling.profiled()
+    def unzip(self, zip_path, unzip_path, members_patterns=None, max_workers=1) -> None:
+        """Extract archive members matching any of `members_patterns` (all if None).
+        With `max_workers` > 1 members are extracted by parallel threads, each reading its own archive handle."""
         print(f"Extracting {zip_path} to {unzip_path}")
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            # make unzip path (remove .zip extension)
-            # extract .zip file
-            zip_ref.extractall(unzip_path)
+            members = [member for member in zip_ref.infolist() if self.match_member(member.filename, members_patterns)]
+            if profiling.is_enabled():
+                profiling.add_bytes(sum(member.compress_size for member in members))
+            if max_workers <= 1:
+                # extract .zip file
+                zip_ref.extractall(unzip_path, members=members)
+            else:
+                # create directories up front, so threads do not race creating them
+                for member in members:
+                    target_path = self._member_target_path(unzip_path, member)
+                    (target_path if member.is_dir() else target_path.parent).mkdir(parents=True, exist_ok=True)
+                file_members = [member for member in members if not member.is_dir()]
+                # balance uncompressed bytes between threads, largest members first
+                members_chunks = [list() for _ in range(max_workers)]
+                chunks_sizes = [0] * max_workers
+                for member in sorted(file_members, key=lambda member: member.file_size, reverse=True):
+                    chunk_num = chunks_sizes.index(min(chunks_sizes))
+                    members_chunks[chunk_num].append(member)
+                    chunks_sizes[chunk_num] += member.file_size
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    list(executor.map(lambda members_chunk: self._extract_members(zip_path, members_chunk, unzip_path), members_chunks))
             # print message
-            print(f"Extracted {zip_path} to {unzip_path}")
+            print(f"Extracted {len(members)} members of {zip_path} to {unzip_path}")
+
+    @staticmethod
+    def _extract_members(zip_path, members, unzip_path) -> None:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            for member in members:
+                zip_ref.extract(member, unzip_path)
+
+    @staticmethod
+    def _member_target_path(unzip_path, member) -> Path:
+        "Path the member is extracted to, sanitized the same way as in zipfile."
+        arcname = os.path.splitdrive(member.filename.replace('/', os.path.sep))[1]
+        parts = [part for part in arcname.split(os.path.sep) if part not in ('', os.path.curdir, os.path.pardir)]
+        return Path(unzip_path).joinpath(*parts)
+
+    @staticmethod
+    def match_member(member_name, members_patterns=None) -> bool:
+        if members_patterns is None:
+            return True
+        return any(fnmatch(member_name, pattern) for pattern in members_patterns)
 
     def _clean_tmp_dir(self) -> None:
         # iterate over content of tmp directory
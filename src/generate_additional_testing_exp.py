@@ -1,74 +1,98 @@
 import numpy as np
-import pandas as pd
 from pathlib import Path
-from shutil import copy, make_archive
+from shutil import make_archive
+from concurrent.futures import ProcessPoolExecutor
+from filecmp import cmp
 from tqdm import tqdm
+from .storage import BinaryStore, read_csv_cached
+from .perturbations import file_rng, link_or_copy
+from . import profiling
+import os
 
 
 """
 This code was used to generate data for simulated random physiology experiments.
+Files are processed in parallel, every file draws noise from its own random stream derived from seed and file's relative path,
+so generated data does not depend on number of workers or processing order.
+For other perturbations (and many of them in one pass) see src/generate_perturbation_tests.py.
+Set `profile` (or EPIC_PROFILE=1) to record time, bytes read and peak memory of reading, generating and writing files (see src/profiling.py).
 """
 
 root_path = Path(__file__).parent.parent
 cut_data_to_3_digits = False
 zip_data = False
 extract_noise_test = True
+# check mean and std of generated noise (tolerances assume recordings of real length, see validate_noise)
+validate_generated_noise = True
+profile = False
 seed = 42
-rng = np.random.default_rng(seed=seed)
+num_workers = os.cpu_count()
 competition_data_path = root_path / Path("data/competition/competition_data")
 noise_data_path = root_path / Path("data/additional_testing/noise_data")
 noise_test_path = root_path / Path("data/additional_testing/noise_test")
+# read competition data from binary store if it was created (see src/convert_to_binary.py)
+competition_store = BinaryStore(competition_data_path)
+competition_store = competition_store if competition_store.exists() else None
 
 
-if __name__ == "__main__":
-    print("Generating noise data")
-    for original_data_path in tqdm(sorted(competition_data_path.glob("**/*.csv"))):
-        # make target paths
-        relative_path = original_data_path.relative_to(competition_data_path)
-        noise_data_target_path = noise_data_path / relative_path
-        # make dirs if they do not exist
-        noise_data_target_path.parent.mkdir(parents=True, exist_ok=True)
-        if "physiology" in str(original_data_path):
-            # read data file to get a placeholder
-            test_data = pd.read_csv(original_data_path)
-            # get columns
-            cols = test_data.columns.drop("time")
-            # generate noise and zero-value flat lines for every physio signal
-            noise = rng.normal(loc=0.0, scale=1.0, size=(len(test_data), len(cols)))
-            # make and save data
-            # replace original data with generated one
-            test_data.loc[:, cols] = noise
-            # save replaced data
+def validate_noise(noise):
+    "Check generated physiology (the same checks that were done on saved files)."
+    assert all(abs(noise.mean(axis=0)) < 0.02), "Wrong mean"
+    assert all(abs(noise.std(axis=0, ddof=1) - 1.) < 0.02), "Wrong std"
+
+
+@profiling.profiled()
+def generate_noise_file(original_data_path):
+    # make target paths
+    relative_path = original_data_path.relative_to(competition_data_path)
+    noise_data_target_path = noise_data_path / relative_path
+    # make dirs if they do not exist
+    noise_data_target_path.parent.mkdir(parents=True, exist_ok=True)
+    if "physiology" in relative_path.parts:
+        # read data file to get a placeholder
+        with profiling.stage("generate_noise.read_csv"):
+            profiling.add_file_bytes(original_data_path)
+            test_data = read_csv_cached(original_data_path, store=competition_store)
+        # get columns
+        cols = test_data.columns.drop("time")
+        # generate noise for every physio signal
+        with profiling.stage("generate_noise.generate"):
+            noise = file_rng(relative_path, seed).normal(loc=0.0, scale=1.0, size=(len(test_data), len(cols)))
+        # assert newly generated physiology (as it is saved) before saving, no need to read it again
+        if validate_generated_noise:
+            validate_noise(noise.round(3) if cut_data_to_3_digits else noise)
+        # replace original data with generated one
+        test_data.loc[:, cols] = noise
+        # save replaced data
+        with profiling.stage("generate_noise.to_csv"):
             if cut_data_to_3_digits:
                 test_data.to_csv(noise_data_target_path, index=False, float_format='%.3f')
             else:
                 test_data.to_csv(noise_data_target_path, index=False)
-        else:
-            copy(original_data_path, noise_data_target_path)
-    # Assert newly generated physiology
-    print("Examining simulated random physiology data")
-    for file_path in tqdm(noise_data_path.glob("**/physiology/*.csv")):
-        data = pd.read_csv(file_path)
-        assert all(abs(data.drop(columns=["time"]).mean()) < 0.02), "Wrong mean"
-        assert all(abs(data.drop(columns=["time"]).std() - 1.) < 0.02), "Wrong std"
-    # assert that annotations did not change
-    print("Examining annotations")
-    for original_data_path in tqdm(sorted(competition_data_path.glob("**/annotations/*.csv"))):
-        # make target paths
-        relative_path = original_data_path.relative_to(competition_data_path)
-        noise_target_path = noise_data_path / relative_path
-        original_annot = pd.read_csv(original_data_path)
-        noise_annot = pd.read_csv(noise_target_path)
-        assert(all(noise_annot == original_annot)), "Simulated random physiology annotations do not match original ones"
-    print("Extracting simulated random physiology test")
-    for file_path in tqdm(noise_data_path.glob("**/test/**/*.csv")):
-        relative_path = file_path.relative_to(noise_data_path)
-        noise_target_path = noise_test_path / relative_path
-        noise_target_path.parent.mkdir(parents=True, exist_ok=True)
-        copy(file_path, noise_target_path)
+    else:
+        # annotations are not changed - link them, or assert that copy did not change them
+        if not link_or_copy(original_data_path, noise_data_target_path):
+            assert cmp(original_data_path, noise_data_target_path, shallow=False), "Simulated random physiology annotations do not match original ones"
+    # extract simulated random physiology test by linking generated file
+    if extract_noise_test and "test" in relative_path.parts:
+        link_or_copy(noise_data_target_path, noise_test_path / relative_path)
+    return relative_path
+
+
+if __name__ == "__main__":
+    if profile:
+        profiling.enable()
+    print("Generating, examining and extracting noise data")
+    with profiling.stage("generate_noise.glob"):
+        original_data_paths = sorted(competition_data_path.glob("**/*.csv"))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for _ in tqdm(executor.map(generate_noise_file, original_data_paths, chunksize=8), total=len(original_data_paths)):
+            pass
     # zip files
     if zip_data:
         print("Compressing data")
         for scenario_dir in tqdm(noise_data_path.iterdir()):
-            make_archive(scenario_dir, 'zip', scenario_dir)
+            with profiling.stage("generate_noise.make_archive"):
+                make_archive(scenario_dir, 'zip', scenario_dir)
             print("Zipped", scenario_dir.stem)
+    profiling.report()
@@ -0,0 +1,27 @@
+from pathlib import Path
+import argparse
+import os
+
+
+"""
+Generate data for perturbation (stress) tests, e.g. noise, flat lines, channel dropout, time shifts, downsampling,
+additive noise at given SNR or shuffled subjects. All scenarios listed in config file are generated in a single pass
+over competition data (see config/perturbations.json and src/perturbations/transforms.py for available perturbations).
+"""
+
+root_dir = Path(__file__).parent.parent
+default_config_path = root_dir / "config" / "perturbations.json"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate perturbed test data.')
+    parser.add_argument(
+        "--config", type=Path, default=default_config_path, help="Path to .json config with perturbation scenarios."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Number of processes generating data."
+    )
+    args = parser.parse_args()
+    from .perturbations import PerturbationEngine
+    engine = PerturbationEngine.from_config_file(args.config, root_dir)
+    engine.run(workers=args.workers)
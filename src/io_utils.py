@@ -1,46 +1,107 @@
 from pathlib import Path
-from benedict import benedict
-import pandas as pd
+from functools import lru_cache
+import hashlib
+import os
 import re
 import json
+try:
+    from . import profiling
+except ImportError:
+    import profiling
 
 
 def load_maps(path):
-    def recurrent_dict_swap(ids_dict):
-        _, v = next(iter(ids_dict.items()))
-        if isinstance(v, int):
-            return {str(v): k for k, v in ids_dict.items()}
-        return {k: recurrent_dict_swap(v) for k, v in ids_dict.items()}
-    with open(path, "r") as fp:
-        old_to_new_ids_map = json.load(fp)
-    new_to_old_ids_map = recurrent_dict_swap(old_to_new_ids_map)
+    from benedict import benedict
+    old_to_new_ids_map, new_to_old_ids_map = _import_ids_map_class().from_json(path).as_dicts()
     return benedict(old_to_new_ids_map), benedict(new_to_old_ids_map)
 
 
+def _import_ids_map_class():
+    # io_utils is imported both as src.io_utils and as top level module (from notebooks run in src directory)
+    try:
+        from .scoring.IdsMap import IdsMap
+    except ImportError:
+        from scoring.IdsMap import IdsMap
+    return IdsMap
+
+
+def _import_results_table_class():
+    try:
+        from .scoring.ResultsTable import ResultsTable
+    except ImportError:
+        from scoring.ResultsTable import ResultsTable
+    return ResultsTable
+
+
+def _import_scores_writer_class():
+    try:
+        from .scoring.ScoresWriter import ScoresWriter
+    except ImportError:
+        from scoring.ScoresWriter import ScoresWriter
+    return ScoresWriter
+
+
 subvid_search_re = re.compile(r"sub\_\d+\_vid\_\d+")
 scenario_search_re = re.compile(r"scenario_\d")
 root_path = Path(__file__).parent.parent
-OLD_TO_NEW_IDS_MAP, NEW_TO_OLD_IDS_MAP = load_maps(root_path / "data" / "original_to_changed_ids_map.json")
-with open(root_path / "data" / "original_stimuli_labels.json", "r") as fp:
-    VIDEOS_LABELS = json.load(fp)
-LABEL_TO_VIDNUM = {vid_dict["label"]: vid_num for vid_num, vid_dict in VIDEOS_LABELS.items()}
+SCORES_CACHE_DIRNAME = ".scores_cache"
+SCORES_CACHE_VERSION = 1
+
+
+def get_ids_map():
+    "Ids map compiled to lookup arrays (see scoring/IdsMap.py), shared with EPICReader."
+    return _import_ids_map_class().from_json(root_path / "data" / "original_to_changed_ids_map.json")
+
 
+@lru_cache(maxsize=None)
+def get_ids_maps():
+    "Load (OLD_TO_NEW_IDS_MAP, NEW_TO_OLD_IDS_MAP) on first use."
+    return load_maps(root_path / "data" / "original_to_changed_ids_map.json")
 
-def recurrent_subvid_ids_swap(results_dict, new_to_old_ids_map=NEW_TO_OLD_IDS_MAP, prev_keys=''):
+
+@lru_cache(maxsize=None)
+def get_videos_labels():
+    with open(root_path / "data" / "original_stimuli_labels.json", "r") as fp:
+        return json.load(fp)
+
+
+def __getattr__(name):
+    # data files are read only when module constants are accessed for the first time, not at import
+    if name == "OLD_TO_NEW_IDS_MAP":
+        return get_ids_maps()[0]
+    if name == "NEW_TO_OLD_IDS_MAP":
+        return get_ids_maps()[1]
+    if name == "VIDEOS_LABELS":
+        return get_videos_labels()
+    if name == "LABEL_TO_VIDNUM":
+        return {vid_dict["label"]: vid_num for vid_num, vid_dict in get_videos_labels().items()}
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def recurrent_subvid_ids_swap(results_dict, new_to_old_ids_map=None, prev_keys=''):
     k, v = next(iter(results_dict.items()))
     if isinstance(v, float):
         return results_dict
     if subvid_search_re.search(k):
-        ret_dict = dict()
         scenario = scenario_search_re.search(prev_keys).group()
-        for sample_num, sample_dict in results_dict.items():
-            _, subject_id, _, video_id = subvid_search_re.search(sample_num).group().split('_')
-            subject_id, video_id = new_to_old_ids_map[scenario, 'subjects', subject_id], new_to_old_ids_map[scenario, 'videos', video_id]
-            ret_dict.setdefault(f"sub_{subject_id}_vid_{video_id}", sample_dict)
+        subvids = [subvid_search_re.search(sample_num).group() for sample_num in results_dict]
+        if new_to_old_ids_map is None:
+            # all subjects and videos of this level are translated at once
+            old_subvids = [keypath[len(scenario) + 1:] for keypath in get_ids_map().swap_keypaths([f"{scenario}/{subvid}" for subvid in subvids])]
+        else:
+            old_subvids = list()
+            for subvid in subvids:
+                _, subject_id, _, video_id = subvid.split('_')
+                subject_id, video_id = new_to_old_ids_map[scenario, 'subjects', subject_id], new_to_old_ids_map[scenario, 'videos', video_id]
+                old_subvids.append(f"sub_{subject_id}_vid_{video_id}")
+        ret_dict = dict()
+        for old_subvid, sample_dict in zip(old_subvids, results_dict.values()):
+            ret_dict.setdefault(old_subvid, sample_dict)
         return ret_dict
     return {k: recurrent_subvid_ids_swap(v, new_to_old_ids_map, prev_keys + '/' + k) for k, v in results_dict.items()}
 
 
+@profiling.profiled()
 def load_scores_file(scores_path):
     with open(scores_path) as fp:
         scores = json.load(fp)
@@ -48,20 +109,215 @@ def load_scores_file(scores_path):
     return scores
 
 
-def load_scores(scoring_path, team_name_first=False, load_levels_list=['folds_level', 'scenarios_level', 'files_level'], exclude_teams=None, benedict_keypath_sep='>'):
+def swap_keypath_subvid_ids(keypath, new_to_old_ids_map=None, separator="/"):
+    "Swap new subject and video ids to original ones in flattened keypath (same as recurrent_subvid_ids_swap, for one key)."
+    if new_to_old_ids_map is None:
+        return get_ids_map().swap_keypaths([keypath])[0]
+    keys = keypath.split(separator)
+    for key_num, key in enumerate(keys):
+        subvid_search = subvid_search_re.search(key)
+        if subvid_search is None:
+            continue
+        scenario = scenario_search_re.search(separator.join(keys[:key_num])).group()
+        _, subject_id, _, video_id = subvid_search.group().split('_')
+        subject_id, video_id = new_to_old_ids_map[scenario, 'subjects', subject_id], new_to_old_ids_map[scenario, 'videos', video_id]
+        keys[key_num] = f"sub_{subject_id}_vid_{video_id}"
+    return separator.join(keys)
+
+
+def flatten_scores(scores_dict, separator="/", prev_keypath=""):
+    "Yield (keypath, value) for every leaf of nested scores dict, in dict order."
+    for k, v in scores_dict.items():
+        keypath = f"{prev_keypath}{separator}{k}" if prev_keypath else k
+        if isinstance(v, dict):
+            yield from flatten_scores(v, separator, keypath)
+        else:
+            yield keypath, v
+
+
+def iter_scores_file(scores_path, summary=False):
+    """Yield (level, keypath, value) of every score in scores.json or compressed columnar scores.npz (see scoring/ScoresWriter.py),
+    with keypath flattened with '/' separator. With `summary`, only folds and scenarios levels of scores.npz are read."""
+    scores_path = Path(scores_path)
+    if scores_path.suffix == ".npz":
+        results_table = _import_results_table_class().load_npz(scores_path, summary)
+        columns = results_table.get_columns()
+        for *row_keys, value in zip(*(columns[column] for column in results_table.KEY_COLUMNS[1:]), columns["value"].tolist()):
+            level_str, *keys = results_table._row_keypath(*row_keys)
+            yield level_str, "/".join(keys), value
+        return
+    with open(scores_path) as fp:
+        scores_dict = json.load(fp)
+    for level_str, level_dict in scores_dict.items():
+        for keypath, value in flatten_scores(level_dict):
+            yield level_str, keypath, value
+
+
+def find_scores_files(scoring_path):
+    """Scores files of `scoring_path`: every .json file and every scores.npz, which is taken instead of scores.json next to it.
+    Hidden directories (cache, download markers, notebook checkpoints) are skipped."""
+    scoring_path = Path(scoring_path)
+    scores_files = [
+        path for path in sorted(list(scoring_path.glob("**/*.json")) + list(scoring_path.glob("**/scores.npz")))
+        if not any(part.startswith(".") for part in path.relative_to(scoring_path).parts)
+    ]
+    return [path for path in scores_files if not (path.name == "scores.json" and (path.parent / "scores.npz").exists())]
+
+
+def _file_sha256(path):
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _read_scores_cache(cache_dir):
+    "Read cache manifest and memory-map cached columns. Returns (None, None) if cache is missing or broken."
+    import numpy as np
+    manifest_path = cache_dir / "manifest.json"
+    if not manifest_path.exists():
+        return None, None
+    with open(manifest_path, "r") as fp:
+        manifest = json.load(fp)
+    if manifest.get("version") != SCORES_CACHE_VERSION:
+        return None, None
+    try:
+        columns = {column: np.load(cache_dir / f"{column}.npy", mmap_mode="r") for column in ("file", "level", "keypath", "value")}
+    except (OSError, ValueError):
+        return None, None
+    if any(len(column_values) != manifest["num_rows"] for column_values in columns.values()):
+        return None, None
+    return manifest, columns
+
+
+def _write_scores_cache(cache_dir, manifest, columns):
+    import numpy as np
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # write to temporary files first, so readers never see half-written cache
+    for column, column_values in columns.items():
+        tmp_path = cache_dir / f"{column}.tmp.npy"
+        np.save(tmp_path, column_values)
+        os.replace(tmp_path, cache_dir / f"{column}.npy")
+    tmp_path = cache_dir / "manifest.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(manifest, fp)
+    os.replace(tmp_path, cache_dir / "manifest.json")
+
+
+@profiling.profiled()
+def load_scores_table(scoring_path, load_levels_list=None, exclude_teams=None, use_cache=True):
+    """Load all scores.json (or scores.npz) files from `scoring_path` to long DataFrame with columns team, level, keypath, value.
+    Keypaths are flattened with '/' separator and file-level subject and video ids are swapped to original ones.
+    Parsed scores are cached in columnar .npy files in `scoring_path/.scores_cache`, keyed on every file's mtime, size and hash,
+    so only new or changed files are parsed again. If only folds and scenarios levels are loaded and all files are scores.npz,
+    just their summary blocks are read (without cache)."""
+    import numpy as np
+    import pandas as pd
     scoring_path = Path(scoring_path)
+    scores_files = find_scores_files(scoring_path)
+    summary_only = (
+        load_levels_list is not None and len(scores_files) > 0 and all(path.suffix == ".npz" for path in scores_files)
+        and all(_import_scores_writer_class().is_summary_level(level_str) for level_str in load_levels_list)
+    )
+    use_cache = use_cache and not summary_only
+    cache_dir = scoring_path / SCORES_CACHE_DIRNAME
+    manifest, cached_columns = _read_scores_cache(cache_dir) if use_cache else (None, None)
+    cached_files = {file_dict["path"]: file_dict for file_dict in manifest["files"]} if manifest is not None else dict()
+    levels = list(manifest["levels"]) if manifest is not None else list()
+    keypaths = list(manifest["keypaths"]) if manifest is not None else list()
+    level_to_code = {level_str: code for code, level_str in enumerate(levels)}
+    keypath_to_code = {keypath: code for code, keypath in enumerate(keypaths)}
+    # keypaths of parsed files are swapped to original ids all at once, after parsing
+    raw_keypath_to_code, raw_keypaths, parsed_chunks = dict(), list(), list()
+    files, file_chunks = list(), list()
+    cache_changed = manifest is None
+    for file_num, scores_file_path in enumerate(scores_files):
+        relative_path_str = str(scores_file_path.relative_to(scoring_path))
+        stat = scores_file_path.stat()
+        file_dict = {"path": relative_path_str, "team": scores_file_path.parent.name, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+        cached_file = cached_files.get(relative_path_str)
+        if cached_file is not None and (cached_file["mtime_ns"], cached_file["size"]) != (stat.st_mtime_ns, stat.st_size):
+            # touched file - reuse cached rows only if content did not change
+            file_dict["sha256"] = _file_sha256(scores_file_path)
+            cache_changed = True
+            if cached_file["sha256"] != file_dict["sha256"]:
+                cached_file = None
+        if cached_file is not None:
+            file_dict["sha256"] = cached_file["sha256"]
+            rows = slice(cached_file["start"], cached_file["stop"])
+            file_chunks.append((np.asarray(cached_columns["level"][rows]), np.asarray(cached_columns["keypath"][rows]), np.asarray(cached_columns["value"][rows])))
+        else:
+            cache_changed = True
+            file_dict.setdefault("sha256", _file_sha256(scores_file_path))
+            level_codes, keypath_codes, values = list(), list(), list()
+            with profiling.stage("io_utils.parse_scores_file"):
+                profiling.add_file_bytes(scores_file_path)
+                for level_str, raw_keypath, value in iter_scores_file(scores_file_path, summary_only):
+                    if level_str not in level_to_code:
+                        level_to_code[level_str] = len(levels)
+                        levels.append(level_str)
+                    code = raw_keypath_to_code.get(raw_keypath)
+                    if code is None:
+                        code = raw_keypath_to_code[raw_keypath] = len(raw_keypaths)
+                        raw_keypaths.append(raw_keypath)
+                    level_codes.append(level_to_code[level_str])
+                    keypath_codes.append(code)
+                    values.append(value)
+            parsed_chunks.append(len(file_chunks))
+            file_chunks.append((np.array(level_codes, dtype=np.int16), np.array(keypath_codes, dtype=np.int32), np.array(values, dtype=np.float64)))
+        files.append(file_dict)
+    cache_changed |= len(files) != len(cached_files)
+    if raw_keypaths:
+        raw_to_code = np.empty(len(raw_keypaths), dtype=np.int32)
+        for raw_code, keypath in enumerate(get_ids_map().swap_keypaths(raw_keypaths)):
+            if keypath not in keypath_to_code:
+                keypath_to_code[keypath] = len(keypaths)
+                keypaths.append(keypath)
+            raw_to_code[raw_code] = keypath_to_code[keypath]
+        for chunk_num in parsed_chunks:
+            level_codes, raw_codes, values = file_chunks[chunk_num]
+            file_chunks[chunk_num] = (level_codes, raw_to_code[raw_codes], values)
+    # assemble columns
+    num_rows_list = [len(chunk[2]) for chunk in file_chunks]
+    stops = np.cumsum(num_rows_list, dtype=np.int64)
+    for file_dict, start, stop in zip(files, stops - num_rows_list, stops):
+        file_dict["start"], file_dict["stop"] = int(start), int(stop)
+    columns = {
+        "file": np.repeat(np.arange(len(files), dtype=np.int32), num_rows_list),
+        "level": np.concatenate([chunk[0] for chunk in file_chunks]) if file_chunks else np.empty(0, dtype=np.int16),
+        "keypath": np.concatenate([chunk[1] for chunk in file_chunks]) if file_chunks else np.empty(0, dtype=np.int32),
+        "value": np.concatenate([chunk[2] for chunk in file_chunks]) if file_chunks else np.empty(0, dtype=np.float64),
+    }
+    if use_cache and cache_changed:
+        new_manifest = {"version": SCORES_CACHE_VERSION, "num_rows": int(stops[-1]) if len(stops) else 0, "files": files, "levels": levels, "keypaths": keypaths}
+        _write_scores_cache(cache_dir, new_manifest, columns)
+    # build DataFrame with categorical key columns
+    teams = list(dict.fromkeys(file_dict["team"] for file_dict in files))
+    file_team_codes = np.array([teams.index(file_dict["team"]) for file_dict in files], dtype=np.int32)
+    scores_df = pd.DataFrame({
+        "team": pd.Categorical.from_codes(file_team_codes[columns["file"]], categories=teams),
+        "level": pd.Categorical.from_codes(columns["level"], categories=levels),
+        "keypath": pd.Categorical.from_codes(columns["keypath"], categories=keypaths),
+        "value": columns["value"],
+    })
+    if exclude_teams:
+        scores_df = scores_df[~scores_df["team"].isin(set(exclude_teams))]
+    if load_levels_list is not None:
+        scores_df = scores_df[scores_df["level"].isin(set(load_levels_list))]
+    return scores_df.reset_index(drop=True)
+
+
+@profiling.profiled()
+def load_scores(scoring_path, team_name_first=False, load_levels_list=['folds_level', 'scenarios_level', 'files_level'], exclude_teams=None, benedict_keypath_sep='>', use_cache=True):
+    "Load scores to benedict of flattened score dicts, [level, team] (or [team, level] if `team_name_first`) -> {keypath: value}."
+    from benedict import benedict
+    scores_df = load_scores_table(scoring_path, load_levels_list=load_levels_list, exclude_teams=exclude_teams, use_cache=use_cache)
     all_scores_benedict = benedict(keypath_separator=benedict_keypath_sep)
-    exclude_teams_set = set(exclude_teams) if exclude_teams is not None else set()
-    for scores_file_path in scoring_path.glob("**/*.json"):
-        scores_dict = load_scores_file(scores_file_path)
-        team_name_str = scores_file_path.parent.name
-        if team_name_str in exclude_teams_set:
-            continue
-        for level_str in load_levels_list:
-            scores_benedict = benedict(scores_dict[level_str], keypath_separator=benedict_keypath_sep)
-            # bottleneck here (flatten method)
-            if team_name_first:
-                all_scores_benedict[team_name_str, level_str] = scores_benedict.flatten(separator='/')
-            else:
-                all_scores_benedict[level_str, team_name_str] = scores_benedict.flatten(separator='/')
+    for (team_name_str, level_str), level_df in scores_df.groupby(["team", "level"], observed=True, sort=False):
+        flat_scores_dict = dict(zip(level_df["keypath"].astype(str), level_df["value"].tolist()))
+        if team_name_first:
+            all_scores_benedict[team_name_str, level_str] = flat_scores_dict
+        else:
+            all_scores_benedict[level_str, team_name_str] = flat_scores_dict
     return all_scores_benedict
@@ -0,0 +1,97 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import json
+import re
+import numpy as np
+from tqdm import tqdm
+from ..storage import BinaryStore, read_csv_cached
+from .transforms import make_perturbation
+from .utils import file_rng, link_or_copy
+
+
+class PerturbationEngine:
+    """Generate many perturbed copies (scenarios) of competition data in a single pass.
+    Every physiology file is read once and emitted to all scenario output trees (`<output_dir>/<name>_data`),
+    test splits are hardlinked to `<output_dir>/<name>_test`, annotations and other files are hardlinked.
+    Files are processed in groups (same directory and video), so group perturbations see all their inputs at once."""
+
+    video_search_re = re.compile(r"vid_(\d+)")
+
+    def __init__(self, config: dict, root_dir) -> None:
+        self.root_dir = Path(root_dir)
+        self.config = config
+        self.source_dir = self.root_dir / config.get("source_dir", "data/competition/competition_data")
+        self.output_dir = self.root_dir / config.get("output_dir", "data/additional_testing")
+        self.sampling_rate = config.get("sampling_rate", 1000)
+        self.float_format = config.get("float_format")
+        self.extract_test = config.get("extract_test", True)
+        self.scenarios = list()
+        for scenario_dict in config["scenarios"]:
+            self.scenarios.append({
+                "name": scenario_dict["name"],
+                "seed": scenario_dict.get("seed", config.get("seed", 42)),
+                "perturbation": make_perturbation(scenario_dict["perturbation"], **scenario_dict.get("params", dict())),
+            })
+        store = BinaryStore(self.source_dir)
+        self.store = store if store.exists() else None
+
+    @classmethod
+    def from_config_file(cls, config_path, root_dir):
+        with open(config_path, "r") as fp:
+            return cls(json.load(fp), root_dir)
+
+    def data_dir(self, scenario):
+        return self.output_dir / f"""{scenario["name"]}_data"""
+
+    def test_dir(self, scenario):
+        return self.output_dir / f"""{scenario["name"]}_test"""
+
+    def plan_groups(self):
+        "Split source files into processing groups: physiology files by directory and video, every other file on its own."
+        groups = dict()
+        for file_path in sorted(self.source_dir.glob("**/*.csv")):
+            relative_path = file_path.relative_to(self.source_dir)
+            video_search = self.video_search_re.search(relative_path.stem)
+            if "physiology" in relative_path.parts and video_search is not None:
+                group_key = (relative_path.parent.as_posix(), video_search.group(1))
+            else:
+                group_key = (relative_path.as_posix(), None)
+            groups.setdefault(group_key, list()).append(relative_path)
+        return list(groups.values())
+
+    def _emit(self, scenario, relative_path):
+        if self.extract_test and "test" in relative_path.parts:
+            link_or_copy(self.data_dir(scenario) / relative_path, self.test_dir(scenario) / relative_path)
+
+    def process_group(self, relative_paths):
+        "Read group files once and write them to every scenario tree. Returns number of processed files."
+        if "physiology" not in relative_paths[0].parts:
+            for relative_path in relative_paths:
+                for scenario in self.scenarios:
+                    link_or_copy(self.source_dir / relative_path, self.data_dir(scenario) / relative_path)
+                    self._emit(scenario, relative_path)
+            return len(relative_paths)
+        frames = {relative_path: read_csv_cached(self.source_dir / relative_path, store=self.store) for relative_path in relative_paths}
+        signal_columns = {relative_path: df.columns.drop("time") for relative_path, df in frames.items()}
+        group_data = {relative_path: df[signal_columns[relative_path]].to_numpy(dtype=np.float64) for relative_path, df in frames.items()}
+        for scenario in self.scenarios:
+            rngs = {relative_path: file_rng(relative_path, scenario["seed"]) for relative_path in relative_paths}
+            # perturbations validate their output in-stream
+            perturbed_data = scenario["perturbation"].apply_group(group_data, rngs, self.sampling_rate)
+            for relative_path, df in frames.items():
+                perturbed_df = df.copy()
+                perturbed_df.loc[:, signal_columns[relative_path]] = perturbed_data[relative_path]
+                target_path = self.data_dir(scenario) / relative_path
+                target_path.parent.mkdir(parents=True, exist_ok=True)
+                perturbed_df.to_csv(target_path, index=False, float_format=self.float_format)
+                self._emit(scenario, relative_path)
+        return len(relative_paths)
+
+    def run(self, workers=1) -> int:
+        groups = self.plan_groups()
+        num_files = sum(len(group) for group in groups)
+        print(f"Generating {len(self.scenarios)} scenarios ({', '.join(scenario['name'] for scenario in self.scenarios)}) from {num_files} files")
+        with ProcessPoolExecutor(max_workers=workers) as executor, tqdm(total=num_files) as progress_bar:
+            for num_processed in executor.map(self.process_group, groups, chunksize=4):
+                progress_bar.update(num_processed)
+        return num_files
@@ -0,0 +1,3 @@
+from .transforms import PERTURBATIONS, Perturbation, register_perturbation, make_perturbation
+from .utils import file_rng, link_or_copy
+from .PerturbationEngine import PerturbationEngine
@@ -0,0 +1,187 @@
+from abc import ABC, abstractmethod
+import numpy as np
+
+
+"""
+Perturbations of physiology signals. Every perturbation gets array of shape (n_samples, n_channels) of one file
+and returns perturbed array of the same shape, and checks its own output in `validate` (given the same sampling rate, no state is kept between calls).
+Group perturbations (e.g. shuffled subjects) get all files of one video in one directory at once.
+"""
+
+PERTURBATIONS = dict()
+
+
+def register_perturbation(name):
+    "Class decorator adding perturbation to PERTURBATIONS registry under given name."
+    def _register(perturbation_class):
+        perturbation_class.name = name
+        PERTURBATIONS[name] = perturbation_class
+        return perturbation_class
+    return _register
+
+
+def make_perturbation(name, **params):
+    if name not in PERTURBATIONS:
+        raise KeyError(f"Unknown perturbation '{name}', available: {sorted(PERTURBATIONS)}")
+    return PERTURBATIONS[name](**params)
+
+
+class Perturbation(ABC):
+    name = None
+
+    def __init__(self, tolerance=0.02) -> None:
+        self.tolerance = tolerance
+
+    @abstractmethod
+    def apply(self, data, rng, sampling_rate):
+        pass
+
+    def validate(self, original, perturbed, sampling_rate) -> None:
+        pass
+
+    def apply_group(self, group_data: dict, rngs: dict, sampling_rate) -> dict:
+        "Perturb every file of a group (relative path -> array), validating outputs."
+        perturbed_data = dict()
+        for relative_path, data in group_data.items():
+            perturbed_data[relative_path] = self.apply(data, rngs[relative_path], sampling_rate)
+            self.validate(data, perturbed_data[relative_path], sampling_rate)
+        return perturbed_data
+
+
+@register_perturbation("noise")
+class Noise(Perturbation):
+    "Replace signals with i.i.d. N(loc, scale) noise (the original simulated random physiology). Tolerance is relative to scale."
+    def __init__(self, loc=0.0, scale=1.0, tolerance=0.02) -> None:
+        super().__init__(tolerance)
+        self.loc = loc
+        self.scale = scale
+
+    def apply(self, data, rng, sampling_rate):
+        return rng.normal(loc=self.loc, scale=self.scale, size=data.shape)
+
+    def validate(self, original, perturbed, sampling_rate) -> None:
+        assert all(abs(perturbed.mean(axis=0) - self.loc) < self.tolerance * self.scale), "Wrong mean"
+        assert all(abs(perturbed.std(axis=0, ddof=1) - self.scale) < self.tolerance * self.scale), "Wrong std"
+
+
+@register_perturbation("flat_line")
+class FlatLine(Perturbation):
+    "Replace signals with constant value."
+    def __init__(self, value=0.0, tolerance=0.02) -> None:
+        super().__init__(tolerance)
+        self.value = value
+
+    def apply(self, data, rng, sampling_rate):
+        return np.full(data.shape, self.value, dtype=np.float64)
+
+    def validate(self, original, perturbed, sampling_rate) -> None:
+        assert np.all(perturbed == self.value), "Signal is not flat"
+
+
+@register_perturbation("channel_dropout")
+class ChannelDropout(Perturbation):
+    "Replace given channels (column numbers), or every channel with given probability, with constant value."
+    def __init__(self, probability=0.5, channels=None, value=0.0, tolerance=0.02) -> None:
+        super().__init__(tolerance)
+        self.probability = probability
+        self.channels = channels
+        self.value = value
+
+    def apply(self, data, rng, sampling_rate):
+        if self.channels is not None:
+            dropped = np.zeros(data.shape[1], dtype=bool)
+            dropped[self.channels] = True
+        else:
+            dropped = rng.random(data.shape[1]) < self.probability
+        perturbed = data.astype(np.float64, copy=True)
+        perturbed[:, dropped] = self.value
+        return perturbed
+
+    def validate(self, original, perturbed, sampling_rate) -> None:
+        kept = np.all(perturbed == original, axis=0)
+        dropped = np.all(perturbed == self.value, axis=0)
+        assert np.all(kept | dropped), "Channels are neither kept nor dropped"
+
+
+@register_perturbation("time_shift")
+class TimeShift(Perturbation):
+    "Circularly shift signals by given number of seconds (time column is not shifted)."
+    def __init__(self, shift_seconds=1.0, tolerance=0.02) -> None:
+        super().__init__(tolerance)
+        self.shift_seconds = shift_seconds
+
+    def shift_samples(self, sampling_rate) -> int:
+        return int(round(self.shift_seconds * sampling_rate))
+
+    def apply(self, data, rng, sampling_rate):
+        return np.roll(data, self.shift_samples(sampling_rate), axis=0)
+
+    def validate(self, original, perturbed, sampling_rate) -> None:
+        assert np.array_equal(np.roll(original, self.shift_samples(sampling_rate), axis=0), perturbed), "Wrong shift"
+
+
+@register_perturbation("downsample")
+class Downsample(Perturbation):
+    "Keep every `factor`-th sample and hold it until the next one, so signals keep their length."
+    def __init__(self, factor=10, tolerance=0.02) -> None:
+        super().__init__(tolerance)
+        self.factor = factor
+
+    def apply(self, data, rng, sampling_rate):
+        return np.repeat(data[::self.factor], self.factor, axis=0)[:len(data)]
+
+    def validate(self, original, perturbed, sampling_rate) -> None:
+        assert perturbed.shape == original.shape, "Wrong shape"
+        assert np.array_equal(perturbed[::self.factor], original[::self.factor]), "Wrong kept samples"
+
+
+@register_perturbation("snr_noise")
+class SNRNoise(Perturbation):
+    "Add gaussian noise at given signal-to-noise ratio (dB), computed per channel from signal variance. Tolerance is in dB."
+    def __init__(self, snr_db=10.0, tolerance=0.5) -> None:
+        super().__init__(tolerance)
+        self.snr_db = snr_db
+
+    def apply(self, data, rng, sampling_rate):
+        noise_std = np.sqrt(data.var(axis=0) / 10 ** (self.snr_db / 10))
+        return data + rng.normal(size=data.shape) * noise_std
+
+    def validate(self, original, perturbed, sampling_rate) -> None:
+        signal_power = original.var(axis=0)
+        noise_power = (perturbed - original).var(axis=0)
+        # SNR is undefined for constant signals (no noise is added)
+        non_constant = signal_power > 0
+        measured_snr_db = 10 * np.log10(signal_power[non_constant] / noise_power[non_constant])
+        assert all(abs(measured_snr_db - self.snr_db) < self.tolerance), "Wrong SNR"
+
+
+@register_perturbation("shuffle_subjects")
+class ShuffleSubjects(Perturbation):
+    """Swap physiology between subjects watching the same video (files of one group), every subject gets signals of another one.
+    Signals are cut or padded (with last sample) to the length of the file they replace, time column is kept.
+    Every group needs at least 2 files (a single subject of a video has nobody to swap with)."""
+    def apply(self, data, rng, sampling_rate):
+        # a single file is a group of one, which cannot be shuffled
+        return self.apply_group({None: data}, {None: rng}, sampling_rate)[None]
+
+    def apply_group(self, group_data: dict, rngs: dict, sampling_rate) -> dict:
+        relative_paths = sorted(group_data)
+        if len(relative_paths) < 2:
+            raise ValueError(f"Cannot shuffle subjects of a group with {len(relative_paths)} file(s): {[str(relative_path) for relative_path in relative_paths]}")
+        # random cycle over group files (drawn from the first file's stream), so no file keeps its own signals
+        order = rngs[relative_paths[0]].permutation(len(relative_paths))
+        source_nums = dict(zip(order, np.roll(order, -1)))
+        perturbed_data = dict()
+        for file_num, relative_path in enumerate(relative_paths):
+            source = group_data[relative_paths[source_nums[file_num]]]
+            target_length = len(group_data[relative_path])
+            perturbed = self.fit_length(source, target_length)
+            assert not np.array_equal(perturbed, group_data[relative_path]), f"{relative_path} kept its own signals"
+            perturbed_data[relative_path] = perturbed
+        return perturbed_data
+
+    @staticmethod
+    def fit_length(data, length):
+        if len(data) >= length:
+            return data[:length]
+        return np.concatenate([data, np.repeat(data[-1:], length - len(data), axis=0)])
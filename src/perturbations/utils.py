@@ -0,0 +1,26 @@
+from pathlib import Path
+from shutil import copy
+import hashlib
+import os
+import numpy as np
+
+
+def file_rng(relative_path, seed):
+    "Random generator of one file, spawned from `seed` with a spawn key derived from file's relative path."
+    path_digest = hashlib.sha256(Path(relative_path).as_posix().encode()).digest()
+    spawn_key = tuple(int.from_bytes(path_digest[i:i + 4], "little") for i in range(0, 16, 4))
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=spawn_key))
+
+
+def link_or_copy(source_path, target_path):
+    "Hardlink file (no data is written), copy it if linking is not possible (e.g. different file systems). Returns True if linked."
+    target_path = Path(target_path)
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    if target_path.exists():
+        target_path.unlink()
+    try:
+        os.link(source_path, target_path)
+        return True
+    except OSError:
+        copy(source_path, target_path)
+        return False
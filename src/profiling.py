@@ -0,0 +1,256 @@
+from pathlib import Path
+from contextlib import nullcontext
+from functools import wraps
+import json
+import os
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak memory is not recorded there
+    resource = None
+
+
+"""
+Lightweight per-stage instrumentation of scoring and data pipelines: wall time, call counts, bytes read and peak memory of every stage.
+Switched on by `--profile True` of scripts or by EPIC_PROFILE environment variable (1, or directory of trace files), e.g.
+    EPIC_PROFILE=profiles/noise python -m src.generate_additional_testing_exp
+When it is off, `profiled` functions cost one flag check per call and `stage` returns a shared no-op context.
+Every process (also pool workers, which inherit the setting) writes its finished stages to <trace dir>/events-<pid>.jsonl,
+`report` at the end of a run merges them into trace.json (Chrome trace event format, e.g. for https://ui.perfetto.dev),
+summary.json and a summary table. Peak memory is the peak resident set size of the process (ru_maxrss), recorded when stage ends,
+its growth during the stage shows stages which raised the peak.
+"""
+
+ENV_VARIABLE = "EPIC_PROFILE"
+root_dir = Path(__file__).parent.parent
+profiles_dir = root_dir / "profiles"
+# finished stages are written to process' events file in batches of this size
+FLUSH_EVENTS = 1000
+SUMMARY_FIELDS = ("calls", "total_s", "self_s", "mean_s", "max_s", "bytes", "peak_rss_mb", "peak_growth_mb")
+
+_enabled = False
+_trace_dir = None
+_events = list()
+_events_pid = None
+_local = threading.local()
+_flush_lock = threading.Lock()
+_NO_STAGE = nullcontext()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable(trace_dir=None) -> Path:
+    """Switch instrumentation on in this process and in processes started by it (through environment variable).
+    Trace files are written to `trace_dir`, by default to profiles/<script>-<date>-<time>. Returns trace directory."""
+    global _enabled, _trace_dir
+    if trace_dir is None:
+        script_name = Path(sys.argv[0]).stem if sys.argv and sys.argv[0] not in ("", "-c") else "python"
+        trace_dir = profiles_dir / f"{script_name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    _trace_dir = Path(trace_dir).resolve()
+    _trace_dir.mkdir(parents=True, exist_ok=True)
+    os.environ[ENV_VARIABLE] = str(_trace_dir)
+    _enabled = True
+    return _trace_dir
+
+
+def _enable_from_env():
+    value = os.environ.get(ENV_VARIABLE, "").strip()
+    if value.lower() in ("", "0", "false", "no", "off"):
+        return
+    enable(None if value.lower() in ("1", "true", "yes", "on") else value)
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+class _Stage:
+    "Stage being timed, nested stages are kept on a per-thread stack (to compute self time and attribute bytes)."
+
+    __slots__ = ("name", "nbytes", "start", "child_seconds", "start_peak")
+
+    def __init__(self, name, nbytes=0) -> None:
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = list()
+        stack.append(self)
+        self.child_seconds = 0.0
+        self.start_peak = _peak_rss_bytes()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        seconds = end - self.start
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            stack[-1].child_seconds += seconds
+        peak = _peak_rss_bytes()
+        _record({
+            "name": self.name, "pid": os.getpid(), "tid": threading.get_ident(), "depth": len(stack),
+            # wall clock start, comparable between processes
+            "start": time.time() - (time.perf_counter() - self.start), "seconds": seconds, "self_seconds": seconds - self.child_seconds,
+            "bytes": self.nbytes, "peak_rss": peak, "peak_growth": peak - self.start_peak if peak is not None else None,
+        })
+        return False
+
+
+def stage(name, nbytes=0):
+    "Context manager timing a stage (no-op when instrumentation is off). `nbytes` - bytes read by the stage, if known up front."
+    if not _enabled:
+        return _NO_STAGE
+    return _Stage(name, nbytes)
+
+
+def add_bytes(nbytes) -> None:
+    "Add bytes read to the innermost running stage of this thread."
+    if not _enabled:
+        return
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].nbytes += int(nbytes)
+
+
+def add_file_bytes(*file_paths) -> None:
+    "Add sizes of read files to the innermost running stage (files are not stat-ed when instrumentation is off)."
+    if not _enabled:
+        return
+    add_bytes(sum(os.path.getsize(file_path) for file_path in file_paths))
+
+
+def profiled(name=None):
+    "Decorator timing every call of function as stage `name` (Class.method or module.function by default)."
+    def decorator(func):
+        stage_name = name
+        if stage_name is None and "." in func.__qualname__:
+            stage_name = func.__qualname__
+        elif stage_name is None:
+            module_file = getattr(sys.modules.get(func.__module__), "__file__", None)
+            # functions of scripts run with `python -m` are named after the script, not __main__
+            module_name = Path(module_file).stem if func.__module__ == "__main__" and module_file else func.__module__.split(".")[-1]
+            stage_name = f"{module_name}.{func.__qualname__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _record(event):
+    global _events, _events_pid
+    with _flush_lock:
+        if _events_pid != os.getpid():
+            # forked worker inherited events of its parent, they are written by the parent
+            _events, _events_pid = list(), os.getpid()
+            _register_flush()
+        _events.append(event)
+        if len(_events) >= FLUSH_EVENTS:
+            _flush_locked()
+
+
+def _register_flush():
+    # pool workers do not run atexit handlers, but they run multiprocessing finalizers when they exit
+    import atexit
+    from multiprocessing import util
+    atexit.register(flush)
+    util.Finalize(None, flush, exitpriority=10)
+
+
+def _flush_locked():
+    global _events
+    if not _events or _trace_dir is None:
+        return
+    with open(_trace_dir / f"events-{os.getpid()}.jsonl", "a") as fp:
+        fp.writelines(json.dumps(event) + "\n" for event in _events)
+    _events = list()
+
+
+def flush() -> None:
+    "Write finished stages of this process to its events file."
+    with _flush_lock:
+        if _events_pid == os.getpid():
+            _flush_locked()
+
+
+def read_events(trace_dir=None) -> list:
+    "Finished stages of all processes which wrote to `trace_dir` (this run's directory by default)."
+    trace_dir = Path(trace_dir) if trace_dir is not None else _trace_dir
+    events = list()
+    for events_path in sorted(trace_dir.glob("events-*.jsonl")):
+        with open(events_path, "r") as fp:
+            events.extend(json.loads(line) for line in fp if line.strip())
+    return events
+
+
+def summarize(events) -> dict:
+    "Summary of every stage name: calls, total, self (without nested stages), mean and max seconds, bytes, peak memory and its growth."
+    summary = dict()
+    for event in events:
+        stats = summary.setdefault(event["name"], {field: 0 for field in SUMMARY_FIELDS})
+        stats["calls"] += 1
+        stats["total_s"] += event["seconds"]
+        stats["self_s"] += event["self_seconds"]
+        stats["max_s"] = max(stats["max_s"], event["seconds"])
+        stats["bytes"] += event["bytes"]
+        if event["peak_rss"] is not None:
+            stats["peak_rss_mb"] = max(stats["peak_rss_mb"], event["peak_rss"] / 2 ** 20)
+            stats["peak_growth_mb"] = max(stats["peak_growth_mb"], event["peak_growth"] / 2 ** 20)
+    for stats in summary.values():
+        stats["mean_s"] = stats["total_s"] / stats["calls"]
+    return dict(sorted(summary.items(), key=lambda item: item[1]["total_s"], reverse=True))
+
+
+def format_summary(summary) -> str:
+    name_width = max([len("stage")] + [len(name) for name in summary])
+    lines = [f"{'stage':<{name_width}} " + " ".join(f"{field:>14}" for field in SUMMARY_FIELDS)]
+    for name, stats in summary.items():
+        lines.append(f"{name:<{name_width}} {stats['calls']:>14d} " + " ".join(
+            f"{stats[field]:>14d}" if field == "bytes" else f"{stats[field]:>14.4f}" for field in SUMMARY_FIELDS[1:]
+        ))
+    return "\n".join(lines)
+
+
+def report(file=sys.stderr):
+    """Merge stages of all processes of the run into trace.json (Chrome trace events) and summary.json in trace directory,
+    and print summary table. Does nothing when instrumentation is off. Returns summary."""
+    if not _enabled:
+        return None
+    flush()
+    events = read_events()
+    start = min((event["start"] for event in events), default=0.0)
+    trace_events = [
+        {
+            "name": event["name"], "ph": "X", "pid": event["pid"], "tid": event["tid"],
+            "ts": (event["start"] - start) * 1e6, "dur": event["seconds"] * 1e6,
+            "args": {"bytes": event["bytes"], "peak_rss": event["peak_rss"], "depth": event["depth"]},
+        }
+        for event in events
+    ]
+    with open(_trace_dir / "trace.json", "w") as fp:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, fp)
+    summary = summarize(events)
+    with open(_trace_dir / "summary.json", "w") as fp:
+        json.dump(summary, fp, indent=2)
+    print(format_summary(summary), file=file)
+    print(f"Saved trace and summary to {_trace_dir}", file=file)
+    return summary
+
+
+_enable_from_env()
@@ -0,0 +1,177 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from .signal_quality import FIELDS, FLAT_SECONDS, SAMPLING_RATE, WINDOW_SECONDS, compute_quality, neurokit_version
+
+
+def compute_file_quality(file_path, sampling_rate=SAMPLING_RATE, window_seconds=WINDOW_SECONDS, flat_seconds=FLAT_SECONDS, store=None):
+    "Quality entry of one physiology file (see signal_quality.compute_quality), with its `channels`."
+    arrays = store.read_arrays(file_path) if store is not None else None
+    if arrays is None:
+        df = pd.read_csv(file_path)
+        arrays = {column: df[column].to_numpy() for column in df.columns}
+    channels = [column for column in arrays if column != "time"]
+    # channels are stacked straight from memory-mapped store columns
+    data = np.column_stack([arrays[channel] for channel in channels]).astype(np.float64, copy=False)
+    entry = compute_quality(data, channels, sampling_rate, window_seconds, flat_seconds)
+    entry["channels"] = np.array(channels)
+    return entry
+
+
+class QualityIndex:
+    """Persistent index of signal quality summaries of physiology files (see signal_quality.py).
+    Entry key is a hash of (file content, window and flatline settings, NeuroKit2 version), so a file is screened again only if
+    any of them changed, no matter where the file lives (e.g. test data extracted to another directory).
+    Every entry is one .npz file in `index_dir`, file hashes are memoized by (path, mtime, size)."""
+
+    VERSION = 1
+    HASHES_FILENAME = "file_hashes.json"
+    ENTRIES_DIRNAME = "entries"
+
+    def __init__(self, index_dir, sampling_rate=SAMPLING_RATE, window_seconds=WINDOW_SECONDS, flat_seconds=FLAT_SECONDS) -> None:
+        self.index_dir = Path(index_dir)
+        self.sampling_rate = sampling_rate
+        self.window_seconds = window_seconds
+        self.flat_seconds = flat_seconds
+        # numbers are hashed as floats, so e.g. sampling rate 1000 (notebooks) and 1000.0 (command line) share entries
+        self.settings_hash = hashlib.sha256(json.dumps({
+            "version": self.VERSION, "fields": FIELDS, "sampling_rate": float(sampling_rate), "window_seconds": float(window_seconds),
+            "flat_seconds": float(flat_seconds), "neurokit": neurokit_version(),
+        }).encode()).hexdigest()
+        self.file_hashes = dict()
+        self.changed = False
+        hashes_path = self.index_dir / self.HASHES_FILENAME
+        if hashes_path.exists():
+            try:
+                with open(hashes_path, "r") as fp:
+                    self.file_hashes = json.load(fp)
+            except (OSError, ValueError):
+                self.file_hashes = dict()
+
+    def save(self) -> None:
+        "Write memoized file hashes (entries are written as soon as they are computed)."
+        if not self.changed:
+            return
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_dir / (self.HASHES_FILENAME + ".tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(self.file_hashes, fp)
+        os.replace(tmp_path, self.index_dir / self.HASHES_FILENAME)
+        self.changed = False
+
+    def file_hash(self, file_path) -> str:
+        "sha256 of file content, recomputed only if file's mtime or size changed."
+        file_path = Path(file_path).resolve()
+        stat = file_path.stat()
+        memo = self.file_hashes.get(str(file_path))
+        if memo is not None and memo[:2] == [stat.st_mtime_ns, stat.st_size]:
+            return memo[2]
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b""):
+                file_hash.update(chunk)
+        self.file_hashes[str(file_path)] = [stat.st_mtime_ns, stat.st_size, file_hash.hexdigest()]
+        self.changed = True
+        return file_hash.hexdigest()
+
+    def make_key(self, file_path) -> str:
+        return hashlib.sha256(f"{self.file_hash(file_path)}:{self.settings_hash}".encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return self.index_dir / self.ENTRIES_DIRNAME / key[:2] / f"{key}.npz"
+
+    def get(self, key):
+        "Entry of `key`, None if it is not in the index."
+        entry_path = self._entry_path(key)
+        if not entry_path.exists():
+            return None
+        try:
+            with np.load(entry_path) as npz:
+                return {name: npz[name] for name in npz.files}
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, entry) -> None:
+        entry_path = self._entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = entry_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as fp:
+            np.savez(fp, **entry)
+        os.replace(tmp_path, entry_path)
+
+    def compute(self, file_paths, workers=1, store=None, progress_bar=None) -> dict:
+        """Quality entries of `file_paths` (path -> entry). Files found in the index are not read at all,
+        the rest is screened by `workers` processes and added to the index."""
+        entries, missing = dict(), dict()
+        for file_path in file_paths:
+            key = self.make_key(file_path)
+            entry = self.get(key)
+            if entry is not None:
+                entries[file_path] = entry
+            else:
+                missing[file_path] = key
+        if progress_bar is not None:
+            progress_bar.update(len(entries))
+        compute_args = (
+            list(missing), [self.sampling_rate] * len(missing), [self.window_seconds] * len(missing),
+            [self.flat_seconds] * len(missing), [store] * len(missing),
+        )
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for file_path, entry in zip(missing, executor.map(compute_file_quality, *compute_args, chunksize=4)):
+                self.put(missing[file_path], entry)
+                entries[file_path] = entry
+                if progress_bar is not None:
+                    progress_bar.update(1)
+        self.save()
+        return {file_path: entries[file_path] for file_path in file_paths}
+
+    @staticmethod
+    def summary_frame(entries: dict, relative_to=None) -> pd.DataFrame:
+        "Per-file summaries as table with one row per file and channel."
+        frames = list()
+        for file_path, entry in entries.items():
+            frame = pd.DataFrame(entry["summary"], columns=list(FIELDS))
+            frame.insert(0, "channel", entry["channels"])
+            frame.insert(0, "file", str(Path(file_path).relative_to(relative_to)) if relative_to is not None else str(file_path))
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["file", "channel"] + list(FIELDS))
+
+    @staticmethod
+    def best_windows(entries: dict, num_windows, channel, field, relative_to=None) -> pd.DataFrame:
+        """`num_windows` windows of `channel` with the highest `field` (e.g. ecg_quality) across all files,
+        as table with file, window start and end samples and all fields of the window.
+        Windows where `field` is NaN (e.g. ecg_quality without NeuroKit2) are not ranked, so the table is empty if all of them are."""
+        field_num = FIELDS.index(field)
+        file_paths, window_nums, values = list(), list(), list()
+        for file_path, entry in entries.items():
+            channels = entry["channels"].tolist()
+            if channel not in channels or not len(entry["windows"]):
+                continue
+            file_paths.append(file_path)
+            window_nums.append(np.arange(len(entry["windows"])))
+            values.append(entry["windows"][:, channels.index(channel), field_num])
+        if not file_paths:
+            return pd.DataFrame(columns=["file", "start", "end"] + list(FIELDS))
+        file_ids = np.repeat(np.arange(len(file_paths)), [len(file_window_nums) for file_window_nums in window_nums])
+        window_nums, values = np.concatenate(window_nums), np.concatenate(values)
+        ranked = ~np.isnan(values)
+        file_ids, window_nums, values = file_ids[ranked], window_nums[ranked], values[ranked]
+        # ties are broken by file and window order
+        order = np.lexsort((window_nums, file_ids, -values))[:num_windows]
+        rows = list()
+        for file_id, window_num in zip(file_ids[order], window_nums[order]):
+            entry = entries[file_paths[file_id]]
+            window_starts = entry["window_starts"]
+            row = {
+                "file": str(Path(file_paths[file_id]).relative_to(relative_to)) if relative_to is not None else str(file_paths[file_id]),
+                "start": int(window_starts[window_num]),
+                "end": int(window_starts[window_num + 1]) if window_num + 1 < len(window_starts) else int(entry["num_samples"]),
+            }
+            row.update(zip(FIELDS, entry["windows"][window_num, entry["channels"].tolist().index(channel)].tolist()))
+            rows.append(row)
+        return pd.DataFrame(rows, columns=["file", "start", "end"] + list(FIELDS))
+
@@ -0,0 +1,2 @@
+from .signal_quality import FIELDS, compute_ecg_quality, compute_quality, flat_mask, get_neurokit
+from .QualityIndex import QualityIndex, compute_file_quality
@@ -0,0 +1,123 @@
+from functools import lru_cache
+import numpy as np
+
+
+"""
+Signal quality summaries of physiology recordings, per window and per file, for every channel at once.
+Generic measures are computed with NumPy for all channels: fraction of missing samples, of samples in flat runs
+(constant value for at least `flat_seconds`) and of clipped samples (at file minimum or maximum, if it is reached for at least
+`flat_seconds` in total), and std.
+`quality` combines them into one number in [0, 1]. ECG channel additionally gets `ecg_quality`, the mean of NeuroKit2
+per-sample quality of cleaned ECG (as in make_physiology_examples.ipynb), NaN if neurokit2 is not installed.
+"""
+
+SAMPLING_RATE = 1000
+WINDOW_SECONDS = 10.0
+FLAT_SECONDS = 1.0
+ECG_CHANNEL = "ecg"
+# fields of window and file summaries (last axis of summary arrays)
+FIELDS = ("missing", "flat", "clipped", "std", "quality", "ecg_quality")
+
+
+@lru_cache(maxsize=None)
+def get_neurokit():
+    "neurokit2 module, None if it is not installed."
+    try:
+        import neurokit2
+    except ImportError:
+        return None
+    return neurokit2
+
+
+def neurokit_version():
+    neurokit = get_neurokit()
+    return neurokit.__version__ if neurokit is not None else None
+
+
+def compute_ecg_quality(ecg, sampling_rate=SAMPLING_RATE):
+    "Per-sample quality of cleaned ECG (NeuroKit2 `ecg_clean` and `ecg_quality`). NaN if neurokit2 is not installed or ECG has no usable beats."
+    neurokit = get_neurokit()
+    ecg = np.asarray(ecg, dtype=np.float64)
+    if neurokit is None or not np.isfinite(ecg).all():
+        return np.full(len(ecg), np.nan)
+    try:
+        return np.asarray(neurokit.ecg_quality(neurokit.ecg_clean(ecg, sampling_rate=sampling_rate), sampling_rate=sampling_rate), dtype=np.float64)
+    except (ValueError, IndexError, ZeroDivisionError):
+        # too few R peaks to build average QRS, e.g. flat or very short recording
+        return np.full(len(ecg), np.nan)
+
+
+def flat_mask(values, min_run):
+    "Mask of samples (of every column) lying in runs of at least `min_run` equal consecutive values."
+    values = np.asarray(values)
+    mask = np.zeros(values.shape, dtype=bool)
+    if len(values) == 0:
+        return mask
+    changed = np.ones(values.shape, dtype=bool)
+    changed[1:] = values[1:] != values[:-1]
+    run_ids = np.cumsum(changed, axis=0) - 1
+    for column_num in range(values.shape[1]):
+        run_lengths = np.bincount(run_ids[:, column_num])
+        mask[:, column_num] = run_lengths[run_ids[:, column_num]] >= min_run
+    return mask
+
+
+def _window_sums(values, window_starts):
+    return np.add.reduceat(values, window_starts, axis=0)
+
+
+def summarize_windows(values, window_starts, flat, clipped, ecg_quality=None, ecg_column=None):
+    """Summary fields of every window of `values` (samples, channels). Window i spans samples `window_starts[i]:window_starts[i+1]`
+    (last one to the end). Returns array of shape (windows, channels, len(FIELDS))."""
+    values = np.asarray(values, dtype=np.float64)
+    window_lengths = np.diff(np.append(window_starts, len(values)))[:, None].astype(np.float64)
+    finite = np.isfinite(values)
+    num_finite = _window_sums(finite.astype(np.float64), window_starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # std around file mean, so sums of squares do not lose precision for signals with large offset
+        file_means = np.nan_to_num(np.where(finite, values, 0.0).sum(axis=0) / finite.sum(axis=0))
+        centered = np.where(finite, values - file_means, 0.0)
+        means = _window_sums(centered, window_starts) / num_finite
+        stds = np.sqrt(np.maximum(_window_sums(centered ** 2, window_starts) / num_finite - means ** 2, 0.0))
+    summary = np.full((len(window_starts), values.shape[1], len(FIELDS)), np.nan)
+    summary[..., FIELDS.index("missing")] = 1 - num_finite / window_lengths
+    summary[..., FIELDS.index("flat")] = _window_sums(flat.astype(np.float64), window_starts) / window_lengths
+    summary[..., FIELDS.index("clipped")] = _window_sums(clipped.astype(np.float64), window_starts) / window_lengths
+    summary[..., FIELDS.index("std")] = stds
+    summary[..., FIELDS.index("quality")] = (
+        (1 - summary[..., FIELDS.index("missing")]) * (1 - summary[..., FIELDS.index("flat")]) * (1 - summary[..., FIELDS.index("clipped")])
+    )
+    if ecg_quality is not None and ecg_column is not None:
+        with np.errstate(invalid="ignore"):
+            summary[:, ecg_column, FIELDS.index("ecg_quality")] = _window_sums(ecg_quality, window_starts) / window_lengths[:, 0]
+    return summary
+
+
+def compute_quality(values, channels, sampling_rate=SAMPLING_RATE, window_seconds=WINDOW_SECONDS, flat_seconds=FLAT_SECONDS):
+    """Window and file summaries of one recording.
+    values : array of shape (samples, channels)
+    Returns dict with `num_samples`, `window_starts` (sample numbers), `windows` (windows, channels, fields) and `summary` (channels, fields)."""
+    values = np.asarray(values, dtype=np.float64)
+    channels = list(channels)
+    window = max(int(round(window_seconds * sampling_rate)), 1)
+    window_starts = np.arange(0, max(len(values), 1), window)
+    if len(values) == 0:
+        return {"num_samples": 0, "window_starts": window_starts[:0], "windows": np.full((0, len(channels), len(FIELDS)), np.nan), "summary": np.full((len(channels), len(FIELDS)), np.nan)}
+    min_run = max(int(round(flat_seconds * sampling_rate)), 2)
+    flat = flat_mask(values, min_run)
+    finite = np.isfinite(values)
+    clipped = np.zeros(values.shape, dtype=bool)
+    for extremes in (np.where(finite, values, np.inf).min(axis=0), np.where(finite, values, -np.inf).max(axis=0)):
+        at_extreme = values == extremes
+        # every signal has its minimum and maximum, only a rail reached for at least `flat_seconds` in total is clipping
+        clipped |= at_extreme & (at_extreme.sum(axis=0) >= min_run)
+    # flat runs are already counted, a constant channel is not clipped as well
+    clipped &= ~flat
+    ecg_column = channels.index(ECG_CHANNEL) if ECG_CHANNEL in channels else None
+    ecg_quality = compute_ecg_quality(values[:, ecg_column], sampling_rate) if ecg_column is not None else None
+    return {
+        "num_samples": len(values),
+        "window_starts": window_starts,
+        "windows": summarize_windows(values, window_starts, flat, clipped, ecg_quality, ecg_column),
+        "summary": summarize_windows(values, np.zeros(1, dtype=np.intp), flat, clipped, ecg_quality, ecg_column)[0],
+    }
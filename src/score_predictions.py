@@ -1,13 +1,9 @@
 from pathlib import Path
-from benedict import benedict
-from sklearn.metrics import r2_score
-from src.scoring.EPICReader import EPICReader
-from tqdm import tqdm
-from functools import partial
-from src.scoring.scoring_utils import residuals_std, rmse, concordance_correlation_coefficient, compute_scores, compute_aggregated_scores, compute_averaged_results
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import argparse
 import re
 import ast
+from src import profiling
 
 
 """
@@ -15,126 +11,193 @@ An alternative code for scoring.
 The main difference to the original code is that this one does not contain safeguards against cheating.
 It is also simpler to use and modify than the original code.
 Computation logic is the same as in original scoring code, so RMSE values remain the same.
+Several prediction sets can be scored in one run (test annotations are loaded once), with `--reference` paired deltas
+of every team (set minus reference, e.g. real minus random physiology) are saved for every level as well:
+    python -m src.score_predictions --name competition_submissions noise_submissions --reference noise_submissions
+With `--format npz` scores are streamed, while they are computed, to compressed columnar scores.npz files instead of scores.json
+(`--format both` writes both), folds and scenarios levels are also kept in their small summary block (see scoring/ScoresWriter.py).
+With `--profile True` (or EPIC_PROFILE=1) time, bytes read and peak memory of every stage are recorded, also in workers (see src/profiling.py).
 """
 
 
+root = Path(__file__).parent.parent
+test_path = root / Path("data/competition/test_annotations/") # test data
+predictions_dir = root / "predictions"
+scores_dir = root / "scores"
+# per-file results, reused by later runs for files which did not change (hidden, so it is not taken for scores of a run)
+score_cache_dir = scores_dir / ".files_level_cache"
+# set by setup_scoring, once per process (every pool worker keeps its own test annotations cache)
+scorer = None
+# annotations are sampled every 50 ms
+annotations_sampling_rate = 20
+
+
 def get_group(path):
     fold_search = re.search(r"fold_\d", str(path))
     return fold_search.group() if fold_search is not None else None
 
 
-def score_results_dir(team_results_dir):
-    team_results_benedict = benedict()
-    for scenario_dir in team_results_dir.iterdir():
-        scenario = scenario_dir.name
-        # file-wise computations
-        for subvid_path_str, subvid_submission_annotations in epic_reader.iter_subvid_data(scenario_dir):
-            subvid_path = Path(subvid_path_str)
-            subvid_test_annotations = epic_reader.get_corresponding_test_data(subvid_path_str)
-            fold_num = epic_reader.extract_fold_num(subvid_path_str)
-            arousal_submission = subvid_submission_annotations['arousal'].to_numpy()
-            valence_submission = subvid_submission_annotations['valence'].to_numpy()
-            arousal_test = subvid_test_annotations['arousal'].to_numpy()
-            valence_test = subvid_test_annotations['valence'].to_numpy()
-            arousal_scores = compute_scores(arousal_test, arousal_submission, level_scoring_map["files"])
-            valence_scores = compute_scores(valence_test, valence_submission, level_scoring_map["files"])
-            if scenario == "scenario_1":
-                team_results_benedict["files_level", scenario, subvid_path.stem, "arousal"] = arousal_scores
-                team_results_benedict["files_level", scenario, subvid_path.stem, "valence"] = valence_scores
-                continue
-            team_results_benedict["files_level", scenario, fold_num, subvid_path.stem, "arousal"] = arousal_scores
-            team_results_benedict["files_level", scenario, fold_num, subvid_path.stem, "valence"] = valence_scores
-        # subject-wise computations
-        for subject_num, subject_data_dict in epic_reader.iter_subjects_data(scenario_dir):
-            arousal_scores, valence_scores = compute_aggregated_scores(epic_reader, subject_data_dict, level_scoring_map["subjects"])
-            team_results_benedict["subjects_level", scenario, f"sub_{subject_num}", "arousal"] = arousal_scores
-            team_results_benedict["subjects_level", scenario, f"sub_{subject_num}", "valence"] = valence_scores
-        # video-wise computations
-        for video_num, video_data_dict in epic_reader.iter_videos_data(scenario_dir):
-            arousal_scores, valence_scores = compute_aggregated_scores(epic_reader, video_data_dict, level_scoring_map["videos"])
-            team_results_benedict["videos_level", scenario, f"vid_{video_num}", "arousal"] = arousal_scores
-            team_results_benedict["videos_level", scenario, f"vid_{video_num}", "valence"] = valence_scores
-        # fold-wise average
-        team_results_benedict["folds_level", scenario] = compute_averaged_results(team_results_benedict["files_level", scenario])
-        # scenario-wise average
-        if scenario == "scenario_1":
-            team_results_benedict["scenarios_level", scenario] = team_results_benedict["folds_level", scenario]
+@profiling.profiled()
+def setup_scoring(test_dir, finite, cache_dir=None, max_memory=None, window=None, step=None):
+    # scoring modules (numpy, pandas, benedict) are imported on first use, so `--help` or wrong arguments return immediately
+    from src.scoring.Scorer import Scorer
+    global scorer
+    scorer = Scorer(test_dir, finite, cache_dir, max_memory, window, step)
+
+
+def parse_memory_size(size_str):
+    "Parse memory size like '512MB', '2G' or '1000000' (bytes) to number of bytes."
+    size_search = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*", size_str.lower())
+    if size_search is None:
+        raise argparse.ArgumentTypeError(f"Wrong memory size '{size_str}'")
+    number, unit = size_search.groups()
+    return int(float(number) * 1024 ** "bkmgt".index(unit or "b"))
+
+
+def iter_teams(submissions_path):
+    "Yield (team_name, team_results_dir) for every team in submissions directory."
+    for team_dir in sorted(submissions_path.iterdir()):
+        if team_dir.name == "tmp" or team_dir.name.startswith("."):
+            continue
+        if team_dir.name == "results":
+            yield ".", team_dir
         else:
-            team_results_benedict["scenarios_level", scenario] = compute_averaged_results(team_results_benedict["folds_level", scenario])
-        # compute scenario-wise subjects and videos average
-        team_results_benedict["scenarios_level-subjects", scenario] = compute_averaged_results(team_results_benedict['subjects_level', scenario])
-        team_results_benedict["scenarios_level-videos", scenario] = compute_averaged_results(team_results_benedict['videos_level', scenario])
-    return team_results_benedict
+            yield team_dir.name, team_dir / "results"
 
 
-parser = argparse.ArgumentParser(description='Score submissions.')
+def get_scoring_dir(name, finite):
+    if finite:
+        return scores_dir / (name + "-finite") # scores with forced finite ccc values
+    return scores_dir / name # just scores
 
-parser.add_argument(
-    "--finite", type=ast.literal_eval, default=True
-)
-parser.add_argument(
-    "--name", type=str, default="", required=True
-)
 
-args = vars(parser.parse_args())
-root = Path(__file__).parent.parent
-test_path = root / Path("data/competition/test_annotations/") # test data
-predictions_dir = root / "predictions"
-scores_dir = root / "scores"
-submissions_path = predictions_dir / args["name"]
-
-assert submissions_path in list(predictions_dir.iterdir()), f"""'{args["name"]}' not found in {predictions_dir}"""
-
-if args["finite"]:
-    new_scoring_dir = scores_dir / (args["name"] + "-finite") # scores with forced finite ccc values
-else:
-    new_scoring_dir = scores_dir / args["name"] # just scores
-
-epic_reader = EPICReader(test_path)
-
-level_scoring_map = {
-    'files': {
-        'ccc': partial(concordance_correlation_coefficient, force_finite=args["finite"]),
-        'r2_score': r2_score,
-        'rmse': rmse,
-        'residuals_std': residuals_std,
-    },
-    'subjects': {
-        'ccc': partial(concordance_correlation_coefficient, force_finite=args["finite"]),
-        'r2_score': r2_score,
-        'residuals_std': residuals_std,
-        'rmse': rmse,
-    },
-    'videos': {
-        'ccc': partial(concordance_correlation_coefficient, force_finite=args["finite"]),
-        'r2_score': r2_score,
-        'residuals_std': residuals_std,
-        'rmse': rmse,
-    },
-}
-
-subvid_to_fold = {
-    scenario_path.name: {file_path.stem: get_group(file_path) for file_path in scenario_path.glob("**/*.csv")}
-    for scenario_path in test_path.iterdir()
-    }
-
-folds_subvids = benedict()
-for scenario_path in test_path.iterdir():
-    folds_subvids.setdefault(scenario_path.name, dict())
-    for file_path in scenario_path.glob("**/*.csv"):
-        fold = get_group(file_path)
-        folds_subvids[scenario_path.name].setdefault(fold, list())
-        folds_subvids[scenario_path.name, fold].append(file_path.stem)
-
-for team_dir in tqdm(submissions_path.iterdir()):
-    if team_dir.name == "tmp":
-        continue
-    if team_dir.name == "results":
-        team_name = "."
-        team_results_dir = team_dir
-    else:
-        team_name = team_dir.name
-        team_results_dir = team_dir / "results"
-    team_results_benedict = score_results_dir(team_results_dir)
-    # save results
-    team_results_benedict.to_json(filepath=new_scoring_dir / team_name / "scores.json")
\ No newline at end of file
+def get_deltas_dir(name, reference_name, finite):
+    return get_scoring_dir(f"{name}-minus-{reference_name}", finite)
+
+
+def save_results_table(results_table, team_scoring_dir, output_format="json"):
+    if output_format in ("json", "both"):
+        results_table.save_json(team_scoring_dir / "scores.json")
+    if output_format in ("npz", "both"):
+        results_table.save_npz(team_scoring_dir / "scores.npz")
+
+
+@profiling.profiled()
+def score_team(team_name, team_results_dirs, scoring_dirs, reference_name=None, deltas_dirs=None, output_format="json"):
+    """Score results of one team in every prediction set (name -> results directory) and save them to `scoring_dirs[name]`.
+    If team has results in reference set, paired deltas of other sets (set minus reference) are saved to `deltas_dirs[name]`."""
+    from src.scoring.ResultsTable import ResultsTable
+    results_tables = dict()
+    for name, team_results_dir in team_results_dirs.items():
+        team_scoring_dir = scoring_dirs[name] / team_name
+        if output_format in ("npz", "both"):
+            # rows are written while scenarios are scored
+            with ResultsTable.open_npz(team_scoring_dir / "scores.npz") as writer:
+                results_tables[name] = score_results_dir(team_results_dir, team_name, writer)
+        else:
+            results_tables[name] = score_results_dir(team_results_dir, team_name)
+        # save results
+        if output_format in ("json", "both"):
+            results_tables[name].save_json(team_scoring_dir / "scores.json")
+    if reference_name in results_tables:
+        for name, results_table in results_tables.items():
+            if name != reference_name:
+                save_results_table(results_table.subtract(results_tables[reference_name]), deltas_dirs[name] / team_name, output_format)
+    # new cache entries are passed back to the main process, which owns the cache on disk
+    return team_name, scorer.score_cache.take_updates() if scorer.score_cache is not None else None
+
+
+def score_results_dir(team_results_dir, team_name=None, writer=None):
+    return scorer.score_results_dir(team_results_dir, team_name, writer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score submissions.')
+
+    parser.add_argument(
+        "--finite", type=ast.literal_eval, default=True
+    )
+    parser.add_argument(
+        "--name", type=str, nargs="+", required=True, help="Prediction sets (directories in predictions) to score."
+    )
+    parser.add_argument(
+        "--reference", type=str, default=None,
+        help="Prediction set whose scores are subtracted from scores of the same teams in other sets (scored as well if not in --name)."
+    )
+    parser.add_argument(
+        "--format", type=str, choices=("json", "npz", "both"), default="json",
+        help="Scores file of every team: scores.json, compressed columnar scores.npz (streamed while scoring, with summary block) or both."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of processes scoring teams in parallel (1 - score in this process)."
+    )
+    parser.add_argument(
+        "--cache", type=ast.literal_eval, default=True, help=f"Reuse per-file results of unchanged prediction and test files (cached in {score_cache_dir})."
+    )
+    parser.add_argument(
+        "--max-memory", type=parse_memory_size, default=None,
+        help="Budget for annotations kept in memory (e.g. 512MB, shared by workers). Test annotations are then read on demand and files are scored in chunks, scores do not change."
+    )
+
+    parser.add_argument(
+        "--window-seconds", type=float, default=None,
+        help="Also score every file in windows of this length (windows_level and scenarios_level-windows in scores.json)."
+    )
+    parser.add_argument(
+        "--step-seconds", type=float, default=None, help="Step between windows (sliding windows if shorter than window), defaults to window length."
+    )
+
+    parser.add_argument(
+        "--profile", type=ast.literal_eval, default=False, help="Record time, bytes read and peak memory of every stage, print summary table at the end."
+    )
+
+    args = vars(parser.parse_args())
+    if args["profile"]:
+        profiling.enable()
+    from tqdm import tqdm
+    from src.scoring.ScoreCache import ScoreCache
+    from src.scoring.scoring_utils import METRICS
+    names = list(dict.fromkeys(args["name"] + ([args["reference"]] if args["reference"] is not None else [])))
+    for name in names:
+        assert predictions_dir / name in list(predictions_dir.iterdir()), f"""'{name}' not found in {predictions_dir}"""
+    assert args["workers"] >= 1, "Number of workers has to be positive"
+    window = max(int(round(args["window_seconds"] * annotations_sampling_rate)), 1) if args["window_seconds"] is not None else None
+    step = max(int(round(args["step_seconds"] * annotations_sampling_rate)), 1) if args["step_seconds"] is not None else None
+    assert step is None or window is not None, "--step-seconds needs --window-seconds"
+
+    scoring_dirs = {name: get_scoring_dir(name, args["finite"]) for name in names}
+    deltas_dirs = {name: get_deltas_dir(name, args["reference"], args["finite"]) for name in names if name != args["reference"]}
+    # every team is scored in all sets by one task, so paired deltas are computed without reading scores back
+    teams_results_dirs = dict()
+    for name in names:
+        for team_name, team_results_dir in iter_teams(predictions_dir / name):
+            teams_results_dirs.setdefault(team_name, dict())[name] = team_results_dir
+    teams = sorted(teams_results_dirs.items())
+    cache_dir = score_cache_dir if args["cache"] else None
+    if args["workers"] == 1:
+        setup_scoring(test_path, args["finite"], cache_dir, args["max_memory"], window, step)
+        try:
+            for team_name, team_results_dirs in tqdm(teams):
+                score_team(team_name, team_results_dirs, scoring_dirs, args["reference"], deltas_dirs, args["format"])
+        finally:
+            if scorer.score_cache is not None:
+                scorer.score_cache.save()
+        return
+    # every team is scored independently by the same code, so output files are identical to serial run
+    worker_max_memory = args["max_memory"] // args["workers"] if args["max_memory"] is not None else None
+    main_score_cache = ScoreCache(cache_dir, METRICS, args["finite"]) if cache_dir is not None else None
+    try:
+        with ProcessPoolExecutor(max_workers=args["workers"], initializer=setup_scoring, initargs=(test_path, args["finite"], cache_dir, worker_max_memory, window, step)) as executor:
+            futures = [executor.submit(score_team, team_name, team_results_dirs, scoring_dirs, args["reference"], deltas_dirs, args["format"]) for team_name, team_results_dirs in teams]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                _, cache_updates = future.result()
+                if main_score_cache is not None:
+                    main_score_cache.apply_updates(cache_updates)
+    finally:
+        if main_score_cache is not None:
+            main_score_cache.save()
+
+
+if __name__ == "__main__":
+    main()
+    profiling.report()
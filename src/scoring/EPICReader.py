@@ -1,16 +1,27 @@
 from pathlib import Path
+from collections import OrderedDict
 from benedict import benedict
 import re
-import json
 import pandas as pd
+from .. import profiling
+from ..storage import BinaryStore
+from .IdsMap import IdsMap
 
 
 class EPICReader:
-    def __init__(self, test_dir) -> None:
+    def __init__(self, test_dir, use_binary_store=True, test_cache_bytes=None) -> None:
         self.root_dir_path = Path(__file__).parent.parent.parent
         self.test_dir = Path(test_dir)
+        # test annotations are read from binary store if it was created (see src/convert_to_binary.py)
+        self.test_store = BinaryStore(self.test_dir) if use_binary_store else None
         self.test_annotations = benedict(keypath_separator=">")
         self.test_paths = benedict(keypath_separator=">")
+        # all test annotations are loaded up front, unless memory is limited -
+        # then they are read on first use and kept in LRU cache of at most `test_cache_bytes`
+        self.test_cache_bytes = test_cache_bytes
+        self.test_cache = OrderedDict()
+        self.test_cache_nbytes = 0
+        self.file_indices = dict()
         self.ids_map_path = self.root_dir_path / "data" / "original_to_changed_ids_map.json"
         self.fold_search_re = re.compile(r"fold\_\d")
         self.scenario_search_re = re.compile(r"scenario\_\d")
@@ -23,27 +34,24 @@ class EPICReader:
         }
         self.OLD_NEW_IDS = None
         self.NEW_OLD_IDS = None
+        self.ids_map = None
         self.load_data()
 
+    @profiling.profiled()
     def load_data(self):
         # load ids maps
-        self.OLD_NEW_IDS, self.NEW_OLD_IDS = self.load_ids_maps(self.ids_map_path) 
+        self.ids_map = IdsMap.from_json(self.ids_map_path)
+        self.OLD_NEW_IDS, self.NEW_OLD_IDS = self.load_ids_maps(self.ids_map_path)
         # make path to read test data
         # iterate test data path and save test annotations and file path (for later scoring) 
-        for file_path in self.test_dir.glob(pattern=f"**/test/annotations/*.csv"):
-            # subvid_str = file_path.stem
-            self.test_annotations[str(file_path.relative_to(self.test_dir))] = self.read_annotations_file(file_path)
+        for relative_path_str, file_info in self.index_dir(self.test_dir, relative_to=self.test_dir).items():
+            if self.test_cache_bytes is None:
+                self.test_annotations[relative_path_str] = self.read_annotations_file(file_info["path"])
+            self.test_paths[relative_path_str] = file_info["path"]
 
     @staticmethod
     def load_ids_maps(path):
-        def _recurrent_dict_swap(ids_dict):
-            _, v = next(iter(ids_dict.items()))
-            if isinstance(v, int):
-                return {str(v): k for k, v in ids_dict.items()}
-            return {k: _recurrent_dict_swap(v) for k, v in ids_dict.items()}
-        with open(path, "r") as fp:
-            old_to_new_ids_map = json.load(fp)
-        new_to_old_ids_map = _recurrent_dict_swap(old_to_new_ids_map)
+        old_to_new_ids_map, new_to_old_ids_map = IdsMap.from_json(path).as_dicts()
         return benedict(old_to_new_ids_map), benedict(new_to_old_ids_map)
     
     def extract_fold_num(self, file_path):
@@ -78,14 +86,11 @@ class EPICReader:
         assert subject or video or subvid, "Specify at least one argument"
         ret = dict()
         if subject:
-            subject = self.OLD_NEW_IDS[scenario]['subjects'][str(subject)]
-            ret['subject'] = subject
+            ret['subject'] = int(self.ids_map.to_new(scenario, 'subjects', int(subject)))
         if video:
-            video = self.OLD_NEW_IDS[scenario]['videos'][str(video)]
-            ret['video'] = video
+            ret['video'] = int(self.ids_map.to_new(scenario, 'videos', int(video)))
         if subvid:
-            _, subject, _, video = subvid.split("_")
-            ret["subvid"] = f"sub_{self.OLD_NEW_IDS[scenario]['subjects'][str(subject)]}_vid_{self.OLD_NEW_IDS[scenario]['videos'][str(video)]}"
+            ret["subvid"] = self.ids_map.subvid_to_new(scenario, subvid)
         return ret
     
     def subvid_new_to_old(self, scenario, subject=None, video=None, subvid=None):
@@ -94,53 +99,125 @@ class EPICReader:
         assert subject or video or subvid, "Specify at least one argument"
         ret = dict()
         if subject:
-            subject = self.NEW_OLD_IDS[scenario]['subjects'][str(subject)]
-            ret['subject'] = subject
+            ret['subject'] = str(self.ids_map.to_old(scenario, 'subjects', int(subject)))
         if video:
-            video = self.NEW_OLD_IDS[scenario]['videos'][str(video)]
-            ret['video'] = video
+            ret['video'] = str(self.ids_map.to_old(scenario, 'videos', int(video)))
         if subvid:
-            _, subject, _, video = subvid.split("_")
-            ret["subvid"] = f"sub_{self.NEW_OLD_IDS[scenario]['subjects'][subject]}_vid_{self.NEW_OLD_IDS[scenario]['videos'][video]}"
+            ret["subvid"] = self.ids_map.subvid_to_old(scenario, subvid)
         return ret
 
+    @profiling.profiled()
     def read_annotations_file(self, file_path):
-        df = pd.read_csv(file_path)
+        if self.test_store is not None and self.test_store.exists():
+            df = self.test_store.read_frame(file_path)
+            if profiling.is_enabled():
+                profiling.add_bytes(df.memory_usage(index=False).sum())
+        else:
+            df = pd.read_csv(file_path)
+            profiling.add_file_bytes(file_path)
         if "time" in df.columns:
             df.drop(columns=["time"], inplace=True)
         return df
 
-    def get_subject_data(self, dir_path, subject_num):
-        annotations_dict = dict()
-        for file_path in dir_path.glob(pattern=f"**/test/annotations/sub_{subject_num}_*.csv"):
-            annotations_dict[str(file_path.relative_to(dir_path.parent))] = self.read_annotations_file(file_path)
-        return annotations_dict
+    def index_dir(self, dir_path, relative_to=None):
+        """Glob annotation files in `dir_path` once and map each relative path to its file info.
+        Index is cached, so later lookups (files, subjects, videos) do not walk the directory again."""
+        dir_path = Path(dir_path)
+        relative_to = dir_path.parent if relative_to is None else Path(relative_to)
+        index_key = (dir_path, relative_to)
+        if index_key not in self.file_indices:
+            file_index = dict()
+            with profiling.stage("EPICReader.index_dir"):
+                for file_path in sorted(dir_path.glob(pattern=f"**/test/annotations/*.csv")):
+                    file_index[str(file_path.relative_to(relative_to))] = self.get_file_info(file_path)
+            self.file_indices[index_key] = file_index
+        return self.file_indices[index_key]
+
+    def get_file_info(self, file_path):
+        return {
+            "path": file_path,
+            "scenario": self.extract_scenario_num(file_path),
+            "fold": self.extract_fold_num(file_path),
+            "subject": self.extract_subject_num(file_path),
+            "video": self.extract_video_num(file_path),
+        }
 
-    def get_video_data(self, dir_path, video_num):
+    def clear_index(self):
+        "Forget indexed directories (except test directory), e.g. before scoring re-uploaded predictions again."
+        self.file_indices = {index_key: file_index for index_key, file_index in self.file_indices.items() if index_key[0] == self.test_dir}
+
+    def read_dir_data(self, dir_path):
+        "Read every annotation file in `dir_path` exactly once."
+        return {relative_path_str: self.read_annotations_file(file_info["path"]) for relative_path_str, file_info in self.index_dir(dir_path).items()}
+
+    def _select_data(self, dir_path, key, value, data_dict=None):
         annotations_dict = dict()
-        for file_path in dir_path.glob(pattern=f"**/test/annotations/*vid_{video_num}.csv"):
-            annotations_dict[str(file_path.relative_to(dir_path.parent))] = self.read_annotations_file(file_path)
+        for relative_path_str, file_info in self.index_dir(dir_path).items():
+            if file_info[key] != value:
+                continue
+            if data_dict is not None:
+                annotations_dict[relative_path_str] = data_dict[relative_path_str]
+            else:
+                annotations_dict[relative_path_str] = self.read_annotations_file(file_info["path"])
         return annotations_dict
 
+    def _iter_grouped_data(self, dir_path, key, data_dict=None):
+        if data_dict is None:
+            data_dict = self.read_dir_data(dir_path)
+        grouped_data = dict()
+        for relative_path_str, file_info in self.index_dir(dir_path).items():
+            grouped_data.setdefault(file_info[key], dict())
+            grouped_data[file_info[key]][relative_path_str] = data_dict[relative_path_str]
+        for group_num in sorted(grouped_data, key=int):
+            yield (group_num, grouped_data[group_num])
+
+    def get_subject_data(self, dir_path, subject_num, data_dict=None):
+        return self._select_data(dir_path, "subject", str(subject_num), data_dict)
+
+    def get_video_data(self, dir_path, video_num, data_dict=None):
+        return self._select_data(dir_path, "video", str(video_num), data_dict)
+
     def get_corresponding_test_data(self, file_path):
         corr_re = self.relative_path_re.search(file_path)
         if corr_re is None:
             return None
-        return self.test_annotations[corr_re.group()]
+        if self.test_cache_bytes is None:
+            return self.test_annotations[corr_re.group()]
+        return self._get_cached_test_data(corr_re.group())
+
+    def _get_cached_test_data(self, relative_path_str):
+        "Get test annotations from LRU cache, reading them (and evicting least recently used ones) if needed."
+        if relative_path_str in self.test_cache:
+            self.test_cache.move_to_end(relative_path_str)
+            return self.test_cache[relative_path_str]
+        test_data = self.read_annotations_file(self.test_paths[relative_path_str])
+        self.test_cache[relative_path_str] = test_data
+        self.test_cache_nbytes += int(test_data.memory_usage(index=True).sum())
+        while self.test_cache_nbytes > self.test_cache_bytes and len(self.test_cache) > 1:
+            _, evicted_data = self.test_cache.popitem(last=False)
+            self.test_cache_nbytes -= int(evicted_data.memory_usage(index=True).sum())
+        return test_data
+
+    def get_corresponding_test_path(self, file_path):
+        corr_re = self.relative_path_re.search(file_path)
+        if corr_re is None:
+            return None
+        return self.test_paths[corr_re.group()]
     
     def get_num_folds(self, scenario):
         return self.scenarios_num_folds[scenario]
 
-    def iter_subjects_data(self, dir_path):
-        subjects = {self.extract_subject_num(file_path) for file_path in dir_path.glob(pattern=f"**/test/annotations/*.csv")}
-        for subject_num in subjects:
-            yield (subject_num, self.get_subject_data(dir_path, subject_num))
+    def iter_subjects_data(self, dir_path, data_dict=None):
+        "Yield (subject_num, annotations_dict) pairs. Pass `data_dict` from `read_dir_data` to reuse already parsed files."
+        yield from self._iter_grouped_data(dir_path, "subject", data_dict)
 
-    def iter_videos_data(self, dir_path):
-        videos = {self.extract_video_num(file_path) for file_path in dir_path.glob(pattern=f"**/test/annotations/*.csv")}
-        for video_num in videos:
-            yield (video_num, self.get_video_data(dir_path, video_num))
+    def iter_videos_data(self, dir_path, data_dict=None):
+        "Yield (video_num, annotations_dict) pairs. Pass `data_dict` from `read_dir_data` to reuse already parsed files."
+        yield from self._iter_grouped_data(dir_path, "video", data_dict)
 
-    def iter_subvid_data(self, dir_path):
-        for file_path in dir_path.glob(pattern=f"**/test/annotations/*.csv"):
-            yield (str(file_path.relative_to(dir_path.parent)), self.read_annotations_file(file_path))
+    def iter_subvid_data(self, dir_path, data_dict=None):
+        for relative_path_str, file_info in self.index_dir(dir_path).items():
+            if data_dict is not None:
+                yield (relative_path_str, data_dict[relative_path_str])
+            else:
+                yield (relative_path_str, self.read_annotations_file(file_info["path"]))
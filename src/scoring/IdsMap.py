@@ -0,0 +1,114 @@
+from functools import lru_cache
+from pathlib import Path
+import json
+import re
+import numpy as np
+
+
+class IdsMap:
+    """Bidirectional map between original and changed (as in test data file names) subject and video ids,
+    compiled from `data/original_to_changed_ids_map.json` into dense integer lookup arrays.
+    Lookup arrays have one row per scenario number and one column per id, missing ids are marked with -1,
+    so whole columns of ids (e.g. of all keypaths of scores) are remapped with one indexing operation."""
+
+    KINDS = ("subjects", "videos")
+    MISSING = -1
+    scenario_re = re.compile(r"scenario_(\d+)")
+    keypath_subvid_re = re.compile(r"scenario_(?P<scenario>\d).*?sub_(?P<subject>\d+)_vid_(?P<video>\d+)")
+
+    def __init__(self, old_to_new_ids_map: dict) -> None:
+        self.old_to_new_ids_map = old_to_new_ids_map
+        num_scenarios = max(self.scenario_num(scenario) for scenario in old_to_new_ids_map) + 1
+        self.lookups = dict()
+        for kind in self.KINDS:
+            max_old_id = max(int(old_id) for ids_dict in old_to_new_ids_map.values() for old_id in ids_dict[kind])
+            max_new_id = max(new_id for ids_dict in old_to_new_ids_map.values() for new_id in ids_dict[kind].values())
+            old_to_new = np.full((num_scenarios, max_old_id + 1), self.MISSING, dtype=np.int64)
+            new_to_old = np.full((num_scenarios, max_new_id + 1), self.MISSING, dtype=np.int64)
+            for scenario, ids_dict in old_to_new_ids_map.items():
+                old_ids = np.array([int(old_id) for old_id in ids_dict[kind]], dtype=np.int64)
+                new_ids = np.array(list(ids_dict[kind].values()), dtype=np.int64)
+                old_to_new[self.scenario_num(scenario), old_ids] = new_ids
+                new_to_old[self.scenario_num(scenario), new_ids] = old_ids
+            self.lookups[kind, "new"] = old_to_new
+            self.lookups[kind, "old"] = new_to_old
+
+    @classmethod
+    def from_json(cls, path):
+        "Compile map from json file (compiled once per path)."
+        return _load_ids_map(str(Path(path).resolve()))
+
+    @classmethod
+    def scenario_num(cls, scenario):
+        if isinstance(scenario, str):
+            return int(cls.scenario_re.fullmatch(scenario).group(1))
+        return scenario
+
+    def _translate(self, scenario, kind, ids, to):
+        lookup = self.lookups[kind, to]
+        scenario_nums = np.asarray(scenario)
+        if scenario_nums.dtype.kind not in "iu":
+            scenario_nums = np.vectorize(self.scenario_num, otypes=[np.int64])(scenario_nums)
+        ids = np.asarray(ids).astype(np.int64)
+        scenario_nums, ids = np.broadcast_arrays(scenario_nums, ids)
+        in_range = (scenario_nums >= 0) & (scenario_nums < lookup.shape[0]) & (ids >= 0) & (ids < lookup.shape[1])
+        translated = np.full(ids.shape, self.MISSING, dtype=np.int64)
+        translated[in_range] = lookup[scenario_nums[in_range], ids[in_range]]
+        if (translated == self.MISSING).any():
+            missing_num = np.flatnonzero((translated == self.MISSING).reshape(-1))[0]
+            raise KeyError(f"No {kind} id {ids.reshape(-1)[missing_num]} in scenario_{scenario_nums.reshape(-1)[missing_num]}")
+        return translated
+
+    def to_new(self, scenario, kind, ids):
+        "Translate original ids (scalar or array, with scalar or array of scenarios) to changed ones."
+        return self._translate(scenario, kind, ids, "new")
+
+    def to_old(self, scenario, kind, ids):
+        "Translate changed ids (scalar or array, with scalar or array of scenarios) to original ones."
+        return self._translate(scenario, kind, ids, "old")
+
+    def subvid_to_new(self, scenario, subvid):
+        _, subject, _, video = subvid.split("_")
+        return f"sub_{self.to_new(scenario, 'subjects', int(subject))}_vid_{self.to_new(scenario, 'videos', int(video))}"
+
+    def subvid_to_old(self, scenario, subvid):
+        _, subject, _, video = subvid.split("_")
+        return f"sub_{self.to_old(scenario, 'subjects', int(subject))}_vid_{self.to_old(scenario, 'videos', int(video))}"
+
+    def swap_keypaths(self, keypaths, to="old"):
+        """Swap subject and video ids of `sub_X_vid_Y` part of every keypath (scenario is taken from preceding part of keypath).
+        Keypaths are parsed once and all ids are translated in one vectorized lookup. Keypaths without subject and video are not changed."""
+        keypaths = list(keypaths)
+        matches = [self.keypath_subvid_re.search(keypath) for keypath in keypaths]
+        matched = [keypath_num for keypath_num, match in enumerate(matches) if match is not None]
+        if not matched:
+            return keypaths
+        scenario_nums, subjects, videos = np.array([
+            (int(matches[keypath_num]["scenario"]), int(matches[keypath_num]["subject"]), int(matches[keypath_num]["video"]))
+            for keypath_num in matched
+        ], dtype=np.int64).T
+        subjects = self._translate(scenario_nums, "subjects", subjects, to).tolist()
+        videos = self._translate(scenario_nums, "videos", videos, to).tolist()
+        swapped = list(keypaths)
+        for keypath_num, subject, video in zip(matched, subjects, videos):
+            keypath, match = keypaths[keypath_num], matches[keypath_num]
+            swapped[keypath_num] = f"{keypath[:match.start('subject')]}{subject}_vid_{video}{keypath[match.end('video'):]}"
+        return swapped
+
+    def as_dicts(self):
+        "Nested dicts as in json file: (original -> changed with int values, changed -> original with str values)."
+        old_to_new_ids_map = {
+            scenario: {kind: dict(ids_dict[kind]) for kind in self.KINDS}
+            for scenario, ids_dict in self.old_to_new_ids_map.items()
+        }
+        new_to_old_ids_map = {
+            scenario: {kind: {str(new_id): old_id for old_id, new_id in ids_dict[kind].items()} for kind in self.KINDS}
+            for scenario, ids_dict in self.old_to_new_ids_map.items()
+        }
+        return old_to_new_ids_map, new_to_old_ids_map
+
+
+@lru_cache(maxsize=None)
+def _load_ids_map(path):
+    with open(path, "r") as fp:
+        return IdsMap(json.load(fp))
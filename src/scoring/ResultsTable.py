@@ -0,0 +1,209 @@
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+try:
+    from .. import profiling
+except ImportError:
+    # scoring modules are also imported as top level package (from notebooks run in src directory, see io_utils.py)
+    import profiling
+from .ScoresWriter import ScoresWriter
+from .scoring_utils import DIMENSIONS, compute_grouped_mean_std, group_labels_to_ids
+
+
+class ResultsTable:
+    """Columnar store of scoring results, one row per (team, level, scenario, fold, subject, video, window, dimension, metric) value.
+    Rows are appended in array chunks; nested dict (scores.json layout) is built only when exporting.
+    If `writer` (ScoresWriter) is given, every chunk is also streamed to its compressed columnar file as soon as it is appended."""
+
+    COLUMNS = ("team", "level", "scenario", "fold", "subject", "video", "window", "dimension", "metric", "value")
+    KEY_COLUMNS = COLUMNS[:-1]
+
+    def __init__(self, team=None, writer=None) -> None:
+        self.team = team
+        self.writer = writer
+        self.chunks = list()
+        self._columns = None
+
+    def __len__(self):
+        return sum(len(chunk["value"]) for chunk in self.chunks)
+
+    def _append(self, columns_dict):
+        num_rows = len(columns_dict["value"])
+        chunk = dict()
+        for column in self.KEY_COLUMNS:
+            column_values = columns_dict.get(column)
+            if column_values is None or np.ndim(column_values) == 0:
+                column_values = np.full(num_rows, column_values, dtype=object)
+            chunk[column] = np.asarray(column_values, dtype=object)
+        chunk["value"] = np.asarray(columns_dict["value"], dtype=np.float64)
+        self.chunks.append(chunk)
+        self._columns = None
+        if self.writer is not None:
+            self.writer.write(chunk)
+
+    def add_scores(self, level, scenario, batch_scores: dict, metrics_to_use, folds=None, subjects=None, videos=None, dimensions=DIMENSIONS, windows=None):
+        """Add batched scores (metric -> array of shape (n_series, n_dims)), row order: series, dimension, metric.
+        folds, subjects, videos, windows : sequences with value for every series (or None if not applicable at given level)"""
+        values = np.stack([batch_scores[metric_name] for metric_name in metrics_to_use], axis=-1)
+        num_series, num_dims, num_metrics = values.shape
+        rows_per_series = num_dims * num_metrics
+
+        def _series_column(column_values):
+            if column_values is None:
+                return None
+            return np.repeat(np.asarray(column_values, dtype=object), rows_per_series)
+
+        self._append({
+            "team": self.team,
+            "level": level,
+            "scenario": scenario,
+            "fold": _series_column(folds),
+            "subject": _series_column(subjects),
+            "video": _series_column(videos),
+            "window": _series_column(windows),
+            "dimension": np.tile(np.repeat(np.asarray(dimensions, dtype=object), num_metrics), num_series),
+            "metric": np.tile(np.asarray(metrics_to_use, dtype=object), num_series * num_dims),
+            "value": values.reshape(-1),
+        })
+
+    def add_table(self, other):
+        for chunk in other.chunks:
+            self._append(chunk)
+
+    def get_columns(self):
+        "Get dict of column arrays (chunks are concatenated once and cached until next append)."
+        if self._columns is None:
+            if not self.chunks:
+                self._columns = {column: np.empty(0, dtype=np.float64 if column == "value" else object) for column in self.COLUMNS}
+            else:
+                self._columns = {column: np.concatenate([chunk[column] for chunk in self.chunks]) for column in self.COLUMNS}
+        return self._columns
+
+    def select(self, **conditions):
+        "Get boolean mask of rows where every given column equals given value."
+        columns = self.get_columns()
+        mask = np.ones(len(columns["value"]), dtype=bool)
+        for column, value in conditions.items():
+            mask &= columns[column] == value
+        return mask
+
+    @profiling.profiled()
+    def add_averaged(self, source_level, target_level, scenario, keep_fold=False, keep_window=False):
+        """Add mean and std of `source_level` scores of scenario as `target_level` rows, averaging over files, subjects, videos
+        (and folds if not `keep_fold`, windows if not `keep_window`). Already averaged metrics ('-mean') are averaged again, their '-std' is dropped."""
+        columns = self.get_columns()
+        mask = self.select(level=source_level, scenario=scenario)
+        mask[mask] = [not metric_name.endswith("-std") for metric_name in columns["metric"][mask]]
+        base_metrics = [metric_name[:-5] if metric_name.endswith("-mean") else metric_name for metric_name in columns["metric"][mask]]
+        folds = columns["fold"][mask] if keep_fold else [None] * len(base_metrics)
+        windows = columns["window"][mask] if keep_window else [None] * len(base_metrics)
+        group_keys = list(zip(folds, windows, columns["dimension"][mask], base_metrics))
+        if not group_keys:
+            return
+        group_labels, group_ids = group_labels_to_ids(group_keys, sort_key=lambda key: tuple(self._sort_value(k) for k in key))
+        means, stds = compute_grouped_mean_std(columns["value"][mask], group_ids, len(group_labels))
+        self._append({
+            "team": self.team,
+            "level": target_level,
+            "scenario": scenario,
+            "fold": np.repeat(np.array([fold for fold, _, _, _ in group_labels], dtype=object), 2),
+            "window": np.repeat(np.array([window for _, window, _, _ in group_labels], dtype=object), 2),
+            "dimension": np.repeat(np.array([dimension for _, _, dimension, _ in group_labels], dtype=object), 2),
+            "metric": np.array([f"{metric_name}-{stat}" for _, _, _, metric_name in group_labels for stat in ("mean", "std")], dtype=object),
+            "value": np.stack([means, stds], axis=-1).reshape(-1),
+        })
+
+    def copy_level(self, source_level, target_level, scenario):
+        columns = self.get_columns()
+        mask = self.select(level=source_level, scenario=scenario)
+        copied_columns = {column: columns[column][mask] for column in self.COLUMNS}
+        copied_columns["level"] = target_level
+        self._append(copied_columns)
+
+    def subtract(self, other, team=None):
+        """Paired differences with `other` table (e.g. scores of the same team on random physiology): rows with the same key
+        (except team) in both tables get value `self - other`, in row order of this table. Rows without pair are left out."""
+        columns, other_columns = self.get_columns(), other.get_columns()
+        key_columns = self.KEY_COLUMNS[1:]
+        other_rows = {key: row for row, key in enumerate(zip(*(other_columns[column] for column in key_columns)))}
+        rows = np.array([other_rows.get(key, -1) for key in zip(*(columns[column] for column in key_columns))], dtype=np.intp)
+        paired = rows >= 0
+        deltas_table = ResultsTable(team=self.team if team is None else team)
+        deltas_columns = {column: columns[column][paired] for column in key_columns}
+        deltas_columns.update({"team": deltas_table.team, "value": columns["value"][paired] - other_columns["value"][rows[paired]]})
+        deltas_table._append(deltas_columns)
+        return deltas_table
+
+    def to_dataframe(self):
+        columns = self.get_columns()
+        return pd.DataFrame({column: pd.Categorical(values) if column != "value" else values for column, values in columns.items()})
+
+    @staticmethod
+    def _sort_value(key):
+        "Sort windows (`win_<start>-<end>`) by position, other keys as strings."
+        if key is None:
+            return (0, "")
+        if isinstance(key, str) and key.startswith("win_"):
+            return (1, *map(int, key[4:].split("-")))
+        return (0, key)
+
+    @staticmethod
+    def _row_keypath(level, scenario, fold, subject, video, window, dimension, metric_name):
+        keypath = [level, scenario]
+        if fold is not None:
+            keypath.append(fold)
+        if subject is not None and video is not None:
+            keypath.append(f"sub_{subject}_vid_{video}")
+        elif subject is not None:
+            keypath.append(f"sub_{subject}")
+        elif video is not None:
+            keypath.append(f"vid_{video}")
+        if window is not None:
+            keypath.append(window)
+        keypath.extend((dimension, metric_name))
+        return keypath
+
+    def to_nested_dict(self, team=None):
+        "Export rows (of one team, if given) to nested dict in scores.json layout, keeping rows order."
+        columns = self.get_columns()
+        mask = self.select(team=team) if team is not None else np.ones(len(columns["value"]), dtype=bool)
+        nested_dict = dict()
+        key_columns = [columns[column][mask] for column in self.KEY_COLUMNS[1:]]
+        for *row_keys, value in zip(*key_columns, columns["value"][mask].tolist()):
+            *parent_keys, last_key = self._row_keypath(*row_keys)
+            node = nested_dict
+            for key in parent_keys:
+                node = node.setdefault(key, dict())
+            node[last_key] = value
+        return nested_dict
+
+    @profiling.profiled()
+    def save_json(self, filepath, team=None):
+        filepath = Path(filepath)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        with open(filepath, "w") as fp:
+            json.dump(self.to_nested_dict(team), fp)
+
+    @classmethod
+    def open_npz(cls, filepath) -> ScoresWriter:
+        "Writer streaming rows of tables created with it (`ResultsTable(writer=...)`) to compressed columnar file."
+        return ScoresWriter(filepath, cls.COLUMNS)
+
+    @profiling.profiled()
+    def save_npz(self, filepath):
+        "Save rows to compressed columnar file (see ScoresWriter), the compact alternative of `save_json`."
+        with self.open_npz(filepath) as writer:
+            for chunk in self.chunks:
+                writer.write(chunk)
+
+    @classmethod
+    @profiling.profiled()
+    def load_npz(cls, filepath, summary=False):
+        "Load table saved by ScoresWriter (all rows, or only folds and scenarios levels if `summary`), e.g. to export it with `save_json`."
+        columns = ScoresWriter.read(filepath, cls.COLUMNS, summary)
+        teams = [team for team in dict.fromkeys(columns["team"].tolist()) if team is not None]
+        results_table = cls(team=teams[0] if len(teams) == 1 else None)
+        if len(columns["value"]):
+            results_table._append(columns)
+        return results_table
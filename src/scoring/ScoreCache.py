@@ -0,0 +1,149 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import numpy as np
+from .scoring_utils import DIMENSIONS, METRICS, STATISTICS
+
+
+class ScoreCache:
+    """Content-addressed cache of per-file scoring results (sufficient statistics and metrics).
+    Entry key is a hash of (prediction file content, test annotations file content, metric set, force_finite),
+    so a file is scored again only if any of them changed, no matter which team or scoring run it comes from.
+    Cache is kept in memory and written to `cache_dir` by `save`, file hashes are memoized by (path, mtime, size)."""
+
+    VERSION = 1
+    KEYS_FILENAME = "keys.npy"
+    VALUES_FILENAME = "values.npy"
+    HASHES_FILENAME = "file_hashes.json"
+    MANIFEST_FILENAME = "manifest.json"
+
+    def __init__(self, cache_dir, metrics=METRICS, force_finite=False, dimensions=DIMENSIONS) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.metrics = tuple(metrics)
+        self.dimensions = tuple(dimensions)
+        self.force_finite = bool(force_finite)
+        self.fields = STATISTICS + self.metrics
+        self.settings_hash = hashlib.sha256(
+            json.dumps({"version": self.VERSION, "metrics": self.metrics, "dimensions": self.dimensions, "force_finite": self.force_finite}).encode()
+        ).hexdigest()
+        self.keys = dict()
+        self.values = np.empty((0, len(self.fields), len(self.dimensions)), dtype=np.float64)
+        self.file_hashes = dict()
+        # entries added since last `take_updates` (to be sent from worker processes to the main one)
+        self.new_values = dict()
+        self.new_file_hashes = dict()
+        self.changed = False
+        self.load()
+
+    def _manifest(self) -> dict:
+        return {"version": self.VERSION, "fields": list(self.fields), "dimensions": list(self.dimensions)}
+
+    def load(self) -> None:
+        "Read cache from disk, missing or incompatible cache is started from scratch."
+        manifest_path = self.cache_dir / self.MANIFEST_FILENAME
+        if not manifest_path.exists():
+            return
+        try:
+            with open(manifest_path, "r") as fp:
+                manifest = json.load(fp)
+            if manifest != self._manifest():
+                return
+            keys = np.load(self.cache_dir / self.KEYS_FILENAME)
+            values = np.load(self.cache_dir / self.VALUES_FILENAME)
+            with open(self.cache_dir / self.HASHES_FILENAME, "r") as fp:
+                file_hashes = json.load(fp)
+        except (OSError, ValueError):
+            return
+        if len(keys) != len(values):
+            return
+        self.keys = {key.decode(): row for row, key in enumerate(keys.tolist())}
+        self.values = values
+        self.file_hashes = file_hashes
+
+    def save(self) -> None:
+        "Write cache to disk (atomically, every file is replaced only after it was fully written)."
+        if not self.changed:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        keys = np.array(list(self.keys), dtype="S64")
+        for filename, save_fn in (
+            (self.KEYS_FILENAME, lambda fp: np.save(fp, keys)),
+            (self.VALUES_FILENAME, lambda fp: np.save(fp, self.values)),
+            (self.HASHES_FILENAME, lambda fp: fp.write(json.dumps(self.file_hashes).encode())),
+            (self.MANIFEST_FILENAME, lambda fp: fp.write(json.dumps(self._manifest()).encode())),
+        ):
+            tmp_path = self.cache_dir / (filename + ".tmp")
+            with open(tmp_path, "wb") as fp:
+                save_fn(fp)
+            os.replace(tmp_path, self.cache_dir / filename)
+        self.changed = False
+
+    def file_hash(self, file_path) -> str:
+        "sha256 of file content, recomputed only if file's mtime or size changed."
+        file_path = Path(file_path).resolve()
+        stat = file_path.stat()
+        memo = self.file_hashes.get(str(file_path))
+        if memo is not None and memo[:2] == [stat.st_mtime_ns, stat.st_size]:
+            return memo[2]
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b""):
+                file_hash.update(chunk)
+        memo = [stat.st_mtime_ns, stat.st_size, file_hash.hexdigest()]
+        self.file_hashes[str(file_path)] = memo
+        self.new_file_hashes[str(file_path)] = memo
+        self.changed = True
+        return memo[2]
+
+    def make_key(self, prediction_path, test_path) -> str:
+        return hashlib.sha256(f"{self.file_hash(prediction_path)}:{self.file_hash(test_path)}:{self.settings_hash}".encode()).hexdigest()
+
+    def get_many(self, keys):
+        "Get cached values of `keys`. Returns (found mask, values of found entries with shape (num_found, fields, dimensions))."
+        rows = np.array([self.keys.get(key, -1) for key in keys], dtype=np.intp)
+        found = rows >= 0
+        return found, self.values[rows[found]]
+
+    def put_many(self, keys, values) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        assert len(keys) == len(values), "Number of keys and values does not match"
+        # first occurrence of every key not cached yet
+        new_rows = dict()
+        for row, key in enumerate(keys):
+            if key not in self.keys and key not in new_rows:
+                new_rows[key] = row
+        if not new_rows:
+            return
+        new_keys = list(new_rows)
+        new_values = values[list(new_rows.values())]
+        for row, key in enumerate(new_keys, start=len(self.values)):
+            self.keys[key] = row
+        self.values = np.concatenate([self.values, new_values])
+        self.new_values.update(zip(new_keys, new_values))
+        self.changed = True
+
+    def take_updates(self) -> tuple:
+        "Return entries and file hashes added since last call (to merge them into the cache of other process)."
+        updates = (self.new_values, self.new_file_hashes)
+        self.new_values, self.new_file_hashes = dict(), dict()
+        return updates
+
+    def apply_updates(self, updates) -> None:
+        new_values, new_file_hashes = updates
+        if new_values:
+            self.put_many(list(new_values), np.stack(list(new_values.values())))
+        if new_file_hashes:
+            self.file_hashes.update(new_file_hashes)
+            self.new_file_hashes.update(new_file_hashes)
+            self.changed = True
+
+    def pack(self, statistics: dict, scores: dict) -> np.ndarray:
+        "Stack per-file statistics and scores into cache values with shape (num_files, fields, dimensions)."
+        return np.stack([statistics[name] for name in STATISTICS] + [scores[name] for name in self.metrics], axis=1)
+
+    def unpack(self, values) -> tuple:
+        "Split cache values into (statistics, scores) dicts."
+        statistics = {name: values[:, field_num] for field_num, name in enumerate(STATISTICS)}
+        scores = {name: values[:, field_num] for field_num, name in enumerate(self.metrics, start=len(STATISTICS))}
+        return statistics, scores
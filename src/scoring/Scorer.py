@@ -0,0 +1,200 @@
+from pathlib import Path
+import numpy as np
+from .. import profiling
+from .EPICReader import EPICReader
+from .ResultsTable import ResultsTable
+from .ScoreCache import ScoreCache
+from .scoring_utils import DIMENSIONS, METRICS, STATISTICS, concatenate_series, compute_sufficient_statistics, compute_scores_from_statistics, compute_window_statistics, merge_sufficient_statistics, group_labels_to_ids
+
+
+# metrics saved at every level (in saved order), all computed by one batched kernel
+level_scoring_map = {
+    'files': ('ccc', 'r2_score', 'rmse', 'residuals_std'),
+    'subjects': ('ccc', 'r2_score', 'residuals_std', 'rmse'),
+    'videos': ('ccc', 'r2_score', 'residuals_std', 'rmse'),
+    'windows': ('ccc', 'rmse', 'residuals_std'),
+}
+
+
+class Scorer:
+    """Scores predictions against test annotations, which are loaded only once (when scorer is created).
+    Predictions are either a results directory (`<scenario>/[<fold>/]test/annotations/*.csv`, as submitted by teams)
+    or in-memory arrays keyed by the same relative paths. Both give `ResultsTable` with every level of scores.json."""
+
+    # submission and test series, their concatenated copies and temporaries of the kernel
+    KERNEL_COPIES = 8
+
+    def __init__(self, test_dir, force_finite=True, cache_dir=None, max_memory=None, window=None, step=None) -> None:
+        """max_memory : int, optional
+            Bytes of annotations kept in memory. If set, test annotations are read on demand into LRU cache (half of the budget)
+            and files are scored in chunks (the other half), instead of loading all test annotations and whole scenarios at once.
+            Files are always visited in the same order and per-file results do not depend on chunks, so scores are identical.
+        window, step : int, optional
+            If window is set, every file is also scored in windows of `window` samples starting every `step` samples (tumbling windows
+            by default), as `windows_level` (with its mean over files as `scenarios_level-windows`). Window scores are not cached."""
+        self.epic_reader = EPICReader(test_dir, test_cache_bytes=max_memory // 2 if max_memory is not None else None)
+        self.chunk_bytes = max_memory // 2 if max_memory is not None else None
+        self.force_finite = force_finite
+        self.window = window
+        self.step = step if step is not None else window
+        # per-file results of prediction files, reused for files which did not change (see ScoreCache)
+        self.score_cache = ScoreCache(cache_dir, METRICS, force_finite) if cache_dir is not None else None
+
+    def compute_files(self, subvid_paths, submission_series):
+        "Compute sufficient statistics and scores of prediction series (arrays with DIMENSIONS columns) in one batch."
+        test_series = list()
+        for subvid_path_str, subvid_submission in zip(subvid_paths, submission_series):
+            subvid_test_annotations = self.epic_reader.get_corresponding_test_data(subvid_path_str)
+            test_series.append(subvid_test_annotations[list(DIMENSIONS)].to_numpy())
+            if len(subvid_submission) != len(test_series[-1]):
+                raise ValueError(f"Found inconsistent numbers of samples in {subvid_path_str}: {len(test_series[-1])} (test), {len(subvid_submission)} (submission)")
+            if not np.isfinite(subvid_submission).all():
+                raise ValueError(f"Found NaN or infinite values in {subvid_path_str} (submission)")
+        y_test, offsets = concatenate_series(test_series)
+        y_submission, _ = concatenate_series(submission_series)
+        statistics = compute_sufficient_statistics(y_test, y_submission, offsets)
+        return statistics, compute_scores_from_statistics(statistics, force_finite=self.force_finite)
+
+    @profiling.profiled()
+    def score_files(self, scenario_dir):
+        """Compute sufficient statistics and scores of every file in `scenario_dir` (in index order).
+        Files found in score cache are not read at all, the rest is scored in one batch."""
+        scenario_index = self.epic_reader.index_dir(scenario_dir)
+        subvid_paths = list(scenario_index)
+        statistics = {name: np.empty((len(subvid_paths), len(DIMENSIONS))) for name in STATISTICS}
+        scores = {name: np.empty((len(subvid_paths), len(DIMENSIONS))) for name in METRICS}
+        found = np.zeros(len(subvid_paths), dtype=bool)
+        if self.score_cache is not None:
+            cache_keys = [
+                self.score_cache.make_key(scenario_index[subvid_path_str]["path"], self.epic_reader.get_corresponding_test_path(subvid_path_str))
+                for subvid_path_str in subvid_paths
+            ]
+            found, cached_values = self.score_cache.get_many(cache_keys)
+            cached_statistics, cached_scores = self.score_cache.unpack(cached_values)
+            for results, cached_results in ((statistics, cached_statistics), (scores, cached_scores)):
+                for name in results:
+                    results[name][found] = cached_results[name]
+        missing = np.flatnonzero(~found)
+        chunk_start = 0
+        for chunk_paths, submission_series in self.iter_submission_chunks(scenario_index, [subvid_paths[file_num] for file_num in missing]):
+            chunk = missing[chunk_start:chunk_start + len(chunk_paths)]
+            chunk_start += len(chunk_paths)
+            chunk_statistics, chunk_scores = self.compute_files(chunk_paths, submission_series)
+            for results, chunk_results in ((statistics, chunk_statistics), (scores, chunk_scores)):
+                for name in results:
+                    results[name][chunk] = chunk_results[name]
+            if self.score_cache is not None:
+                self.score_cache.put_many([cache_keys[file_num] for file_num in chunk], self.score_cache.pack(chunk_statistics, chunk_scores))
+        return subvid_paths, statistics, scores
+
+    def iter_submission_chunks(self, scenario_index, subvid_paths):
+        "Read submission files in given order. Yields (paths, series) chunks, all files in one chunk if memory is not limited."
+        chunk_paths, chunk_series, chunk_nbytes = list(), list(), 0
+        for subvid_path_str in subvid_paths:
+            subvid_submission = self.epic_reader.read_annotations_file(scenario_index[subvid_path_str]["path"])[list(DIMENSIONS)].to_numpy()
+            subvid_nbytes = self.KERNEL_COPIES * subvid_submission.nbytes
+            if self.chunk_bytes is not None and chunk_paths and chunk_nbytes + subvid_nbytes > self.chunk_bytes:
+                yield chunk_paths, chunk_series
+                chunk_paths, chunk_series, chunk_nbytes = list(), list(), 0
+            chunk_paths.append(subvid_path_str)
+            chunk_series.append(subvid_submission)
+            chunk_nbytes += subvid_nbytes
+        if chunk_paths:
+            yield chunk_paths, chunk_series
+
+    def compute_window_scores(self, subvid_paths, submission_series):
+        "Scores of windows of prediction series (all windows at once, from prefix sums). Returns (file numbers, window starts, window ends, scores)."
+        test_series = [self.epic_reader.get_corresponding_test_data(subvid_path_str)[list(DIMENSIONS)].to_numpy() for subvid_path_str in subvid_paths]
+        y_test, offsets = concatenate_series(test_series)
+        y_submission, _ = concatenate_series(submission_series)
+        file_nums, starts, ends, statistics = compute_window_statistics(y_test, y_submission, offsets, self.window, self.step)
+        return file_nums, starts, ends, compute_scores_from_statistics(statistics, force_finite=self.force_finite)
+
+    @profiling.profiled()
+    def add_window_scores(self, results_table, scenario, files_info, subvid_paths, submission_series):
+        "Add `windows_level` scores of files (windows are labeled `win_<start>-<end>` with sample numbers)."
+        file_nums, starts, ends, scores = self.compute_window_scores(subvid_paths, submission_series)
+        results_table.add_scores(
+            "windows_level", scenario, scores, level_scoring_map["windows"],
+            folds=[files_info[file_num]["fold"] if scenario != "scenario_1" else None for file_num in file_nums],
+            subjects=[files_info[file_num]["subject"] for file_num in file_nums],
+            videos=[files_info[file_num]["video"] for file_num in file_nums],
+            windows=[f"win_{start}-{end}" for start, end in zip(starts.tolist(), ends.tolist())],
+        )
+
+    @profiling.profiled()
+    def add_scenario_scores(self, results_table, scenario, files_info, files_statistics, files_scores):
+        "Add files level scores of one scenario and every level aggregated from them to `results_table`."
+        results_table.add_scores(
+            "files_level", scenario, files_scores, level_scoring_map["files"],
+            folds=[file_info["fold"] if scenario != "scenario_1" else None for file_info in files_info],
+            subjects=[file_info["subject"] for file_info in files_info],
+            videos=[file_info["video"] for file_info in files_info],
+        )
+        # subject-wise and video-wise computations, per-file sufficient statistics are merged within groups
+        for level, group_key in (("subjects", "subject"), ("videos", "video")):
+            group_labels, group_ids = group_labels_to_ids([file_info[group_key] for file_info in files_info], sort_key=int)
+            groups_statistics = merge_sufficient_statistics(files_statistics, group_ids, len(group_labels))
+            results_table.add_scores(
+                f"{level}_level", scenario, compute_scores_from_statistics(groups_statistics, force_finite=self.force_finite), level_scoring_map[level],
+                **{level: group_labels}
+            )
+        # fold-wise average
+        results_table.add_averaged("files_level", "folds_level", scenario, keep_fold=True)
+        # scenario-wise average
+        if scenario == "scenario_1":
+            results_table.copy_level("folds_level", "scenarios_level", scenario)
+        else:
+            results_table.add_averaged("folds_level", "scenarios_level", scenario)
+        # compute scenario-wise subjects and videos average
+        results_table.add_averaged("subjects_level", "scenarios_level-subjects", scenario)
+        results_table.add_averaged("videos_level", "scenarios_level-videos", scenario)
+
+    def score_results_dir(self, team_results_dir, team_name=None, writer=None) -> ResultsTable:
+        "Score every scenario directory in `team_results_dir`. Rows are streamed to `writer` (ScoresWriter) while scenarios are scored, if given."
+        results_table = ResultsTable(team=team_name, writer=writer)
+        for scenario_dir in sorted(Path(team_results_dir).iterdir()):
+            scenario_index = self.epic_reader.index_dir(scenario_dir)
+            subvid_paths, files_statistics, files_scores = self.score_files(scenario_dir)
+            if not subvid_paths:
+                continue
+            files_info = [scenario_index[subvid_path_str] for subvid_path_str in subvid_paths]
+            self.add_scenario_scores(results_table, scenario_dir.name, files_info, files_statistics, files_scores)
+            if self.window is not None:
+                # raw series are needed again (cached files were not read), windows are scored chunk by chunk
+                chunk_start = 0
+                for chunk_paths, submission_series in self.iter_submission_chunks(scenario_index, subvid_paths):
+                    self.add_window_scores(results_table, scenario_dir.name, files_info[chunk_start:chunk_start + len(chunk_paths)], chunk_paths, submission_series)
+                    chunk_start += len(chunk_paths)
+                results_table.add_averaged("windows_level", "scenarios_level-windows", scenario_dir.name, keep_window=True)
+        return results_table
+
+    def score_arrays(self, predictions: dict, team_name=None, writer=None) -> ResultsTable:
+        """Score in-memory predictions.
+        predictions : dict, relative path (e.g. `scenario_2/fold_0/test/annotations/sub_0_vid_2.csv`) -> array of shape (n_samples, len(DIMENSIONS)),
+            DataFrame with DIMENSIONS columns or dict of DIMENSIONS sequences
+        writer : ScoresWriter, optional, rows are streamed to it while scenarios are scored"""
+        scenarios_paths = dict()
+        for subvid_path_str in sorted(predictions):
+            scenario = self.epic_reader.extract_scenario_num(subvid_path_str)
+            if scenario is None:
+                raise ValueError(f"Found no scenario in {subvid_path_str}")
+            scenarios_paths.setdefault(scenario, list()).append(subvid_path_str)
+        results_table = ResultsTable(team=team_name, writer=writer)
+        for scenario in sorted(scenarios_paths):
+            subvid_paths = scenarios_paths[scenario]
+            submission_series = list()
+            for subvid_path_str in subvid_paths:
+                subvid_submission = predictions[subvid_path_str]
+                if hasattr(subvid_submission, "columns"):
+                    subvid_submission = subvid_submission[list(DIMENSIONS)]
+                elif isinstance(subvid_submission, dict):
+                    subvid_submission = np.column_stack([subvid_submission[dimension] for dimension in DIMENSIONS])
+                submission_series.append(np.asarray(subvid_submission, dtype=np.float64).reshape(-1, len(DIMENSIONS)))
+            files_statistics, files_scores = self.compute_files(subvid_paths, submission_series)
+            files_info = [self.epic_reader.get_file_info(subvid_path_str) for subvid_path_str in subvid_paths]
+            self.add_scenario_scores(results_table, scenario, files_info, files_statistics, files_scores)
+            if self.window is not None:
+                self.add_window_scores(results_table, scenario, files_info, subvid_paths, submission_series)
+                results_table.add_averaged("windows_level", "scenarios_level-windows", scenario, keep_window=True)
+        return results_table
@@ -0,0 +1,123 @@
+from pathlib import Path
+import os
+import zipfile
+import numpy as np
+
+
+def encode_column(values):
+    "Encode key column (strings or None) as (int32 codes, unicode categories), None is code -1."
+    values = np.asarray(values, dtype=object)
+    present = np.array([value is not None for value in values.tolist()], dtype=bool)
+    codes = np.full(len(values), -1, dtype=np.int32)
+    categories, present_codes = np.unique(values[present].astype(str), return_inverse=True)
+    codes[present] = present_codes
+    return codes, categories.astype(str)
+
+
+def decode_column(codes, categories):
+    "Inverse of `encode_column`, key column as object array."
+    categories = np.append(np.asarray(categories, dtype=object), None)
+    # code -1 picks the appended None
+    return categories[codes]
+
+
+class ScoresWriter:
+    """Streams rows of `ResultsTable` to a compressed columnar file (.npz) while they are added, instead of building scores.json tree at the end.
+    Rows are buffered and written in blocks of at least `block_rows` rows, every key column as category codes and categories.
+    Closing the writer adds a `summary` block with folds and scenarios levels (small, read alone for leaderboards).
+    File is written under temporary name and renamed on close, so readers never see half-written scores."""
+
+    VERSION = 1
+    # levels saved in summary block (all levels starting with these names, e.g. scenarios_level-subjects)
+    SUMMARY_LEVELS = ("folds_level", "scenarios_level")
+    SUMMARY_BLOCK = "summary"
+
+    def __init__(self, filepath, columns, block_rows=1 << 16) -> None:
+        self.filepath = Path(filepath)
+        self.columns = tuple(columns)
+        self.block_rows = block_rows
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_path = self.filepath.with_suffix(".tmp")
+        self.zip_file = zipfile.ZipFile(self.tmp_path, "w", compression=zipfile.ZIP_DEFLATED)
+        self.num_blocks = 0
+        self.buffer, self.buffer_rows = list(), 0
+        self.summary_chunks = list()
+        self._write_array("version", np.array(self.VERSION))
+
+    @classmethod
+    def is_summary_level(cls, level) -> bool:
+        return level.startswith(cls.SUMMARY_LEVELS)
+
+    def _write_array(self, name, array):
+        with self.zip_file.open(f"{name}.npy", "w", force_zip64=True) as fp:
+            np.lib.format.write_array(fp, np.ascontiguousarray(array), allow_pickle=False)
+
+    def _write_block(self, block_name, chunks):
+        for column in self.columns:
+            column_values = np.concatenate([chunk[column] for chunk in chunks]) if chunks else np.empty(0)
+            if column == "value":
+                self._write_array(f"{block_name}/value", column_values.astype(np.float64))
+            else:
+                codes, categories = encode_column(column_values)
+                self._write_array(f"{block_name}/{column}-codes", codes)
+                self._write_array(f"{block_name}/{column}-categories", categories)
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        self._write_block(f"block_{self.num_blocks:06d}", self.buffer)
+        self.num_blocks += 1
+        self.buffer, self.buffer_rows = list(), 0
+
+    def write(self, chunk) -> None:
+        "Add chunk of rows (column -> array), written out once `block_rows` rows are buffered."
+        num_rows = len(chunk["value"])
+        if not num_rows:
+            return
+        self.buffer.append(chunk)
+        self.buffer_rows += num_rows
+        summary_mask = np.array([self.is_summary_level(level) for level in chunk["level"].tolist()], dtype=bool)
+        if summary_mask.any():
+            self.summary_chunks.append({column: chunk[column][summary_mask] for column in self.columns})
+        if self.buffer_rows >= self.block_rows:
+            self.flush()
+
+    def close(self) -> None:
+        if self.zip_file is None:
+            return
+        self.flush()
+        self._write_block(self.SUMMARY_BLOCK, self.summary_chunks)
+        self.zip_file.close()
+        self.zip_file = None
+        os.replace(self.tmp_path, self.filepath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # scoring failed, no partial scores file is left behind
+            self.zip_file.close()
+            self.zip_file = None
+            self.tmp_path.unlink(missing_ok=True)
+
+    @classmethod
+    def read(cls, filepath, columns, summary=False) -> dict:
+        """Read columns (column -> array, key columns as object arrays) of all blocks in written order,
+        or only of summary block (only the members of that block are decompressed)."""
+        with np.load(filepath) as npz:
+            if int(npz["version"]) != cls.VERSION:
+                raise ValueError(f"Unsupported scores file version {int(npz['version'])} of {filepath}")
+            block_names = [cls.SUMMARY_BLOCK] if summary else sorted({name.split("/")[0] for name in npz.files if name.startswith("block_")})
+            blocks = list()
+            for block_name in block_names:
+                blocks.append({
+                    column: npz[f"{block_name}/value"] if column == "value" else decode_column(npz[f"{block_name}/{column}-codes"], npz[f"{block_name}/{column}-categories"])
+                    for column in columns
+                })
+        return {
+            column: np.concatenate([block[column] for block in blocks]) if blocks else np.empty(0, dtype=np.float64 if column == "value" else object)
+            for column in columns
+        }
@@ -1,6 +1,9 @@
 import numpy as np
-from benedict import benedict
-from sklearn.metrics import mean_squared_error
+try:
+    from .. import profiling
+except ImportError:
+    # scoring modules are also imported as top level package (from notebooks run in src directory, see io_utils.py)
+    import profiling
 
 
 def residuals_std(y_true, y_pred):
@@ -8,6 +11,8 @@ def residuals_std(y_true, y_pred):
 
 
 def rmse(y_true, y_pred):
+    # sklearn is imported on first use, it is not needed by the batched kernel
+    from sklearn.metrics import mean_squared_error
     return np.sqrt(mean_squared_error(y_true, y_pred))
 
 
@@ -59,6 +64,257 @@ def concordance_correlation_coefficient(y_true, y_pred, force_finite=False):
     # return numerator/denominator
 
 
+DIMENSIONS = ("arousal", "valence")
+METRICS = ("ccc", "r2_score", "rmse", "residuals_std")
+# names of sufficient statistics returned by `compute_sufficient_statistics`
+STATISTICS = (
+    "n", "mean_true", "mean_pred", "m2_true", "m2_pred", "comoment", "mean_residuals", "m2_residuals",
+    "min_true", "max_true", "min_pred", "max_pred", "max_abs_residuals",
+)
+
+
+def concatenate_series(series_list):
+    "Store ragged batch of series as one concatenated array and offsets (series i is `data[offsets[i]:offsets[i+1]]`)."
+    offsets = np.zeros(len(series_list) + 1, dtype=np.intp)
+    offsets[1:] = np.cumsum([len(series) for series in series_list])
+    return np.concatenate(series_list), offsets
+
+
+@profiling.profiled()
+def compute_sufficient_statistics(y_true, y_pred, offsets):
+    """Per-series sufficient statistics of a ragged batch of (y_true, y_pred) series.
+    y_true, y_pred : arrays of shape (n_samples,) or (n_samples, n_dims) holding concatenated series
+    offsets : array of n_series + 1 series boundaries (see `concatenate_series`)
+    Returns dict of arrays of shape (n_series,) or (n_series, n_dims): sample counts, means, centered
+    second moments (m2), true-pred comoment, residuals mean and m2, and value ranges used to detect
+    constant series exactly."""
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    if y_true.shape != y_pred.shape:
+        raise ValueError(f"Found input variables with inconsistent shapes: {y_true.shape}, {y_pred.shape}")
+    if offsets[0] != 0 or offsets[-1] != len(y_true):
+        raise ValueError("Offsets have to start at 0 and end at number of samples")
+    counts = np.diff(offsets)
+    if np.any(counts <= 0):
+        raise ValueError("Every series has to contain at least one sample")
+    starts = offsets[:-1]
+    n = counts.reshape((-1,) + (1,) * (y_true.ndim - 1)).astype(np.float64)
+    residuals = y_true - y_pred
+    mean_true = np.add.reduceat(y_true, starts, axis=0) / n
+    mean_pred = np.add.reduceat(y_pred, starts, axis=0) / n
+    mean_residuals = np.add.reduceat(residuals, starts, axis=0) / n
+    centered_true = y_true - np.repeat(mean_true, counts, axis=0)
+    centered_pred = y_pred - np.repeat(mean_pred, counts, axis=0)
+    centered_residuals = residuals - np.repeat(mean_residuals, counts, axis=0)
+    statistics = {
+        "n": np.broadcast_to(n, mean_true.shape).copy(),
+        "mean_true": mean_true,
+        "mean_pred": mean_pred,
+        "m2_true": np.add.reduceat(centered_true ** 2, starts, axis=0),
+        "m2_pred": np.add.reduceat(centered_pred ** 2, starts, axis=0),
+        "comoment": np.add.reduceat(centered_true * centered_pred, starts, axis=0),
+        "mean_residuals": mean_residuals,
+        "m2_residuals": np.add.reduceat(centered_residuals ** 2, starts, axis=0),
+        "min_true": np.minimum.reduceat(y_true, starts, axis=0),
+        "max_true": np.maximum.reduceat(y_true, starts, axis=0),
+        "min_pred": np.minimum.reduceat(y_pred, starts, axis=0),
+        "max_pred": np.maximum.reduceat(y_pred, starts, axis=0),
+        "max_abs_residuals": np.maximum.reduceat(np.abs(residuals), starts, axis=0),
+    }
+    return statistics
+
+
+def make_windows(lengths, window, step):
+    """Windows of `window` samples starting every `step` samples (sliding if step < window, tumbling if step == window) of every series.
+    Only full windows are made, a series shorter than `window` gets one window of its whole length.
+    Returns (series numbers, window starts, window ends), starts and ends are sample numbers within series (end is exclusive)."""
+    lengths = np.asarray(lengths, dtype=np.intp)
+    num_windows = np.where(lengths >= window, (lengths - window) // step + 1, 1)
+    series_nums = np.repeat(np.arange(len(lengths)), num_windows)
+    # window number within its series
+    window_nums = np.arange(num_windows.sum()) - np.repeat(np.cumsum(num_windows) - num_windows, num_windows)
+    starts = window_nums * step
+    ends = np.minimum(starts + window, lengths[series_nums])
+    return series_nums, starts, ends
+
+
+def _prefix_sums(values, offsets):
+    """Prefix sums of every series separately (so they do not depend on other series in batch), with leading zero.
+    Sum of samples [first, last) of series i (global sample numbers) is `prefix_sums[last + i] - prefix_sums[first + i]`."""
+    prefix_sums = np.zeros((len(values) + len(offsets) - 1,) + values.shape[1:], dtype=np.float64)
+    for series_num, (start, end) in enumerate(zip(offsets[:-1].tolist(), offsets[1:].tolist())):
+        np.cumsum(values[start:end], axis=0, out=prefix_sums[start + series_num + 1:end + series_num + 1])
+    return prefix_sums
+
+
+@profiling.profiled()
+def compute_window_statistics(y_true, y_pred, offsets, window, step):
+    """Sufficient statistics of windows (see `make_windows`) of every series of a ragged batch, from prefix sums,
+    so every sample is visited once no matter how much windows overlap. Series are centered at their means first,
+    so differences of prefix sums do not lose precision. Instead of value ranges, statistics hold exact masks
+    of constant true and predicted windows and of perfect predictions (from prefix counts of changed and non-zero values).
+    Returns (series numbers, window starts, window ends, statistics), statistics can be passed to `compute_scores_from_statistics`."""
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    counts = np.diff(offsets)
+    series_nums, starts, ends = make_windows(counts, window, step)
+    # window bounds in prefix sums of series (see `_prefix_sums`)
+    first, last = offsets[series_nums] + series_nums + starts, offsets[series_nums] + series_nums + ends
+    series_statistics = compute_sufficient_statistics(y_true, y_pred, offsets)
+    residuals = y_true - y_pred
+    n = (ends - starts).reshape((-1,) + (1,) * (y_true.ndim - 1)).astype(np.float64)
+    window_sums = dict()
+    centered = dict()
+    for name, values in (("true", y_true), ("pred", y_pred), ("residuals", residuals)):
+        centered[name] = values - np.repeat(series_statistics[f"mean_{name}"], counts, axis=0)
+        prefix_sums = _prefix_sums(centered[name], offsets)
+        window_sums[name] = prefix_sums[last] - prefix_sums[first]
+    products = {"m2_true": ("true", "true"), "m2_pred": ("pred", "pred"), "comoment": ("true", "pred"), "m2_residuals": ("residuals", "residuals")}
+    statistics = {"n": np.broadcast_to(n, window_sums["true"].shape).copy()}
+    for name in ("true", "pred", "residuals"):
+        statistics[f"mean_{name}"] = series_statistics[f"mean_{name}"][series_nums] + window_sums[name] / n
+    for statistic_name, (first_name, second_name) in products.items():
+        prefix_sums = _prefix_sums(centered[first_name] * centered[second_name], offsets)
+        # centered sums of products of window, clipped at 0 against rounding of the difference of prefix sums
+        statistics[statistic_name] = prefix_sums[last] - prefix_sums[first] - window_sums[first_name] * window_sums[second_name] / n
+        if first_name == second_name:
+            statistics[statistic_name] = np.maximum(statistics[statistic_name], 0.0)
+    # value changes inside window (between its first and last sample) and non-zero residuals
+    constant = dict()
+    for name, values in (("true", y_true), ("pred", y_pred), ("residuals", residuals)):
+        changed = np.zeros(values.shape, dtype=bool)
+        changed[1:] = values[1:] != values[:-1]
+        # the first sample of series is never a change
+        changed[offsets[:-1][counts > 0]] = False
+        prefix_counts = _prefix_sums(changed, offsets)
+        constant[name] = prefix_counts[last] - prefix_counts[first + 1] == 0
+    # constant windows have exactly zero moments (differences of prefix sums leave rounding errors)
+    statistics["m2_true"] = np.where(constant["true"], 0.0, statistics["m2_true"])
+    statistics["m2_pred"] = np.where(constant["pred"], 0.0, statistics["m2_pred"])
+    statistics["comoment"] = np.where(constant["true"] | constant["pred"], 0.0, statistics["comoment"])
+    statistics["m2_residuals"] = np.where(constant["residuals"], 0.0, statistics["m2_residuals"])
+    statistics["constant_true"], statistics["constant_pred"] = constant["true"], constant["pred"]
+    prefix_counts = _prefix_sums(residuals != 0, offsets)
+    statistics["perfect"] = prefix_counts[last] - prefix_counts[first] == 0
+    return series_nums, starts, ends, statistics
+
+
+@profiling.profiled()
+def compute_scores_from_statistics(statistics: dict, force_finite=False):
+    """Compute ccc, r2_score, rmse and residuals_std from sufficient statistics (see `compute_sufficient_statistics`).
+    Degenerate cases follow the single-series functions: ccc is NaN if any of the series is constant
+    (forced to 1.0 for perfect predictions and 0.0 otherwise if `force_finite`), r2_score follows
+    sklearn `r2_score` defaults (forced finite)."""
+    n = statistics["n"]
+    if "constant_true" in statistics:
+        # window statistics (see `compute_window_statistics`) carry degenerate cases instead of value ranges
+        constant_true, constant_pred, perfect = statistics["constant_true"], statistics["constant_pred"], statistics["perfect"]
+    else:
+        constant_true = statistics["min_true"] == statistics["max_true"]
+        constant_pred = statistics["min_pred"] == statistics["max_pred"]
+        perfect = statistics["max_abs_residuals"] == 0
+    # constant series have exactly zero variance
+    m2_true = np.where(constant_true, 0.0, statistics["m2_true"])
+    m2_pred = np.where(constant_pred, 0.0, statistics["m2_pred"])
+    comoment = np.where(constant_true | constant_pred, 0.0, statistics["comoment"])
+    m2_residuals = np.where(perfect, 0.0, statistics["m2_residuals"])
+    sum_squared_errors = m2_residuals + n * statistics["mean_residuals"] ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # correlation is undefined for constant series, as in np.corrcoef
+        ccc = np.where(
+            constant_true | constant_pred,
+            np.nan,
+            2 * comoment / (m2_true + m2_pred + n * (statistics["mean_true"] - statistics["mean_pred"]) ** 2)
+        )
+        r2 = np.where(m2_true != 0, 1 - sum_squared_errors / m2_true, np.where(perfect, 1.0, 0.0))
+    r2 = np.where(perfect, 1.0, r2)
+    if force_finite:
+        ccc = np.where(np.isfinite(ccc), ccc, np.where(perfect, 1.0, 0.0))
+    return {
+        "ccc": ccc,
+        "r2_score": r2,
+        "rmse": np.sqrt(sum_squared_errors / n),
+        "residuals_std": np.sqrt(m2_residuals / n),
+    }
+
+
+def _group_sum(values, group_ids, num_groups):
+    summed = np.zeros((num_groups,) + values.shape[1:], dtype=values.dtype)
+    np.add.at(summed, group_ids, values)
+    return summed
+
+
+def _group_extreme(ufunc, values, group_ids, num_groups, initial):
+    extremes = np.full((num_groups,) + values.shape[1:], initial, dtype=values.dtype)
+    ufunc.at(extremes, group_ids, values)
+    return extremes
+
+
+@profiling.profiled()
+def merge_sufficient_statistics(statistics: dict, group_ids, num_groups=None):
+    """Merge per-series sufficient statistics into statistics of series groups, as if series in every group were concatenated.
+    Uses pairwise (Chan et al.) update of means and centered moments, so no sample is visited again.
+    group_ids : array of shape (n_series,) with group number (0...num_groups-1) of every series"""
+    group_ids = np.asarray(group_ids, dtype=np.intp)
+    if num_groups is None:
+        num_groups = group_ids.max() + 1 if len(group_ids) else 0
+    n_series = statistics["n"]
+    n = _group_sum(n_series, group_ids, num_groups)
+    merged = {"n": n}
+    deltas = dict()
+    for name in ("true", "pred", "residuals"):
+        mean_name = f"mean_{name}"
+        merged[mean_name] = _group_sum(n_series * statistics[mean_name], group_ids, num_groups) / n
+        deltas[name] = statistics[mean_name] - merged[mean_name][group_ids]
+        merged[f"m2_{name}"] = _group_sum(statistics[f"m2_{name}"] + n_series * deltas[name] ** 2, group_ids, num_groups)
+    merged["comoment"] = _group_sum(statistics["comoment"] + n_series * deltas["true"] * deltas["pred"], group_ids, num_groups)
+    for name in ("min_true", "min_pred"):
+        merged[name] = _group_extreme(np.minimum, statistics[name], group_ids, num_groups, np.inf)
+    for name in ("max_true", "max_pred", "max_abs_residuals"):
+        merged[name] = _group_extreme(np.maximum, statistics[name], group_ids, num_groups, -np.inf)
+    return merged
+
+
+def group_labels_to_ids(group_labels, sort_key=None):
+    "Map series group labels to group numbers. Returns (sorted unique labels, group ids)."
+    unique_labels = sorted(set(group_labels), key=sort_key)
+    label_to_id = {label: group_id for group_id, label in enumerate(unique_labels)}
+    return unique_labels, np.array([label_to_id[label] for label in group_labels], dtype=np.intp)
+
+
+@profiling.profiled()
+def compute_grouped_mean_std(values, group_ids, num_groups=None):
+    "Mean and (population) std of values in every group. NaN values propagate, as in np.mean and np.std."
+    values = np.asarray(values, dtype=np.float64)
+    group_ids = np.asarray(group_ids, dtype=np.intp)
+    if num_groups is None:
+        num_groups = group_ids.max() + 1 if len(group_ids) else 0
+    counts = np.bincount(group_ids, minlength=num_groups).astype(np.float64).reshape((-1,) + (1,) * (values.ndim - 1))
+    means = _group_sum(values, group_ids, num_groups) / counts
+    stds = np.sqrt(_group_sum((values - means[group_ids]) ** 2, group_ids, num_groups) / counts)
+    return means, stds
+
+
+def compute_batch_scores(y_true, y_pred, offsets, force_finite=False):
+    "Compute all METRICS for every series in a ragged batch at once. Returns dict of metric -> array of shape (n_series,) or (n_series, n_dims)."
+    return compute_scores_from_statistics(compute_sufficient_statistics(y_true, y_pred, offsets), force_finite=force_finite)
+
+
+def batch_scores_to_dicts(batch_scores: dict, metrics_to_use=METRICS, dimensions=DIMENSIONS):
+    "Split batched scores of (n_series, n_dims) arrays into {dimension: {metric: value}} dict per series."
+    num_series = len(next(iter(batch_scores.values())))
+    return [
+        {
+            dimension: {metric_name: batch_scores[metric_name][series_num, dim_num].item() for metric_name in metrics_to_use}
+            for dim_num, dimension in enumerate(dimensions)
+        }
+        for series_num in range(num_series)
+    ]
+
+
+@profiling.profiled()
 def compute_scores(y_true, y_pred, metrics_to_use_dict: dict):
     # assert level_scoring_map.get(level, None), "No metrics specified for given level."
     results_dict = dict()
@@ -67,25 +323,25 @@ def compute_scores(y_true, y_pred, metrics_to_use_dict: dict):
     return results_dict
 
 
-def compute_aggregated_scores(epic_reader, data_dict, metrics_to_use_dict: dict):
-    store_data_dict = {"arousal_submission": list(), "valence_submission": list(), "arousal_test": list(), "valence_test": list()}
+@profiling.profiled()
+def compute_aggregated_scores(epic_reader, data_dict, metrics_to_use=METRICS, force_finite=False):
+    test_series, submission_series = list(), list()
     for subvid_path_str, subvid_submission_annotations in data_dict.items():
         subvid_test_annotations = epic_reader.get_corresponding_test_data(subvid_path_str)
-        store_data_dict['arousal_submission'].append(subvid_submission_annotations['arousal'].to_numpy())
-        store_data_dict['valence_submission'].append(subvid_submission_annotations['valence'].to_numpy())
-        store_data_dict['arousal_test'].append(subvid_test_annotations['arousal'].to_numpy())
-        store_data_dict['valence_test'].append(subvid_test_annotations['valence'].to_numpy())
-    store_data_dict['arousal_submission'] = np.concatenate(store_data_dict['arousal_submission'])
-    store_data_dict['valence_submission'] = np.concatenate(store_data_dict['valence_submission'])
-    store_data_dict['arousal_test'] = np.concatenate(store_data_dict['arousal_test'])
-    store_data_dict['valence_test'] = np.concatenate(store_data_dict['valence_test'])
-    arousal_scores = compute_scores(store_data_dict['arousal_test'], store_data_dict['arousal_submission'], metrics_to_use_dict)
-    valence_scores = compute_scores(store_data_dict['valence_test'], store_data_dict['valence_submission'], metrics_to_use_dict)
-    return arousal_scores, valence_scores
-
-
-def compute_averaged_results(results_benedict: benedict, keypath_separator: str = "."):
+        submission_series.append(subvid_submission_annotations[list(DIMENSIONS)].to_numpy())
+        test_series.append(subvid_test_annotations[list(DIMENSIONS)].to_numpy())
+    y_test, offsets = concatenate_series(test_series)
+    y_submission, _ = concatenate_series(submission_series)
+    # merge statistics of every file instead of computing metrics on concatenated series
+    statistics = merge_sufficient_statistics(compute_sufficient_statistics(y_test, y_submission, offsets), np.zeros(len(test_series), dtype=np.intp))
+    scores_dict = batch_scores_to_dicts(compute_scores_from_statistics(statistics, force_finite=force_finite), metrics_to_use)[0]
+    return scores_dict["arousal"], scores_dict["valence"]
+
+
+@profiling.profiled()
+def compute_averaged_results(results_benedict: "benedict", keypath_separator: str = "."):
     "Compute average score at second to last level (dict key). Assumes last level is arousal/valence."
+    from benedict import benedict
     tmp_benedict = benedict(keypath_separator=keypath_separator)
     # compute max keypath len and check if level is 'folds' - so later when averaging folds we don't average scenario 1
     for keypath in results_benedict.keypaths():
@@ -0,0 +1,107 @@
+import warnings
+import numpy as np
+from .scoring_utils import METRICS, compute_grouped_mean_std, compute_scores_from_statistics, group_labels_to_ids, merge_sufficient_statistics
+
+
+"""
+Bootstrap confidence intervals and paired permutation tests of scores over subjects, videos and folds.
+Units (subjects, videos or folds of a scenario) are scored once from per-file sufficient statistics (see Scorer.score_files),
+resampling only reweights unit scores: every batch of resamples is a count matrix (resamples x units) multiplied by unit scores,
+so raw series are never touched again and there is no Python loop over resamples.
+"""
+
+UNIT_KINDS = ("subjects", "videos", "folds")
+
+
+def compute_unit_scores(files_info, files_statistics, files_scores, force_finite=False, metrics=METRICS):
+    """Scores of every unit kind of one scenario: kind -> (unit labels, scores array of shape (units, dims, metrics)).
+    Subject and video scores are computed from merged statistics (as subjects_level and videos_level),
+    fold scores are means of file scores (as folds_level). Folds are skipped if scenario has no folds."""
+    unit_scores = dict()
+    for kind, key in (("subjects", "subject"), ("videos", "video")):
+        labels, group_ids = group_labels_to_ids([file_info[key] for file_info in files_info], sort_key=int)
+        scores = compute_scores_from_statistics(merge_sufficient_statistics(files_statistics, group_ids, len(labels)), force_finite=force_finite)
+        unit_scores[kind] = (labels, np.stack([scores[metric_name] for metric_name in metrics], axis=-1))
+    folds = [file_info["fold"] for file_info in files_info]
+    if all(fold is not None for fold in folds):
+        labels, group_ids = group_labels_to_ids(folds)
+        means, _ = compute_grouped_mean_std(np.stack([files_scores[metric_name] for metric_name in metrics], axis=-1), group_ids, len(labels))
+        unit_scores["folds"] = (labels, means)
+    return unit_scores
+
+
+def _resample_counts(rng, num_resamples, num_units):
+    "Count matrix (resamples x units) of bootstrap resamples drawn with replacement."
+    indices = rng.integers(0, num_units, size=(num_resamples, num_units))
+    flat_indices = (np.arange(num_resamples)[:, None] * num_units + indices).reshape(-1)
+    return np.bincount(flat_indices, minlength=num_resamples * num_units).reshape(num_resamples, num_units).astype(np.float64)
+
+
+def _weighted_means(weights, values):
+    "Means of `values` (units x ...) for every row of `weights` (rows x units), NaN values are left out (as np.nanmean)."
+    flat_values = values.reshape(len(values), -1)
+    finite = np.isfinite(flat_values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = (weights @ np.where(finite, flat_values, 0.0)) / (weights @ finite.astype(np.float64))
+    return means.reshape((len(weights),) + values.shape[1:])
+
+
+def bootstrap_means(values, num_resamples, rng, chunk_size=1000):
+    "Bootstrap distribution of unit means, shape (num_resamples,) + values.shape[1:]. Units are resampled in chunks of count matrices."
+    values = np.asarray(values, dtype=np.float64)
+    chunks = list()
+    for chunk_start in range(0, num_resamples, chunk_size):
+        counts = _resample_counts(rng, min(chunk_size, num_resamples - chunk_start), len(values))
+        chunks.append(_weighted_means(counts, values))
+    return np.concatenate(chunks)
+
+
+def paired_permutation_test(differences, num_permutations, rng, chunk_size=1000):
+    """Two-sided p-value of paired sign-flip permutation test (null hypothesis: mean of paired differences is 0).
+    differences : array of shape (units, ...), p-value is computed for every other index."""
+    differences = np.asarray(differences, dtype=np.float64)
+    flat_differences = differences.reshape(len(differences), -1)
+    finite = np.isfinite(flat_differences)
+    flat_differences = np.where(finite, flat_differences, 0.0)
+    num_finite = finite.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        observed = np.abs(flat_differences.sum(axis=0) / num_finite)
+        num_extreme = np.zeros(observed.shape)
+        for chunk_start in range(0, num_permutations, chunk_size):
+            signs = rng.choice(np.array([-1.0, 1.0]), size=(min(chunk_size, num_permutations - chunk_start), len(differences)))
+            permuted = np.abs(signs @ flat_differences / num_finite)
+            # permuted means are compared with tolerance, so exact ties (e.g. all signs flipped) count as extreme
+            num_extreme += (permuted >= observed - 1e-12 * np.maximum(observed, 1.0)).sum(axis=0)
+    p_values = np.where(num_finite > 0, (num_extreme + 1) / (num_permutations + 1), np.nan)
+    return p_values.reshape(differences.shape[1:])
+
+
+def compare_unit_scores(scores, reference_scores, num_resamples, num_permutations, rng, confidence=0.95, chunk_size=1000):
+    """Compare unit scores of a team with paired unit scores of a reference (e.g. the same team on random physiology, or a baseline).
+    Team, reference and difference means get percentile bootstrap intervals from the same resampled units,
+    difference gets p-value of paired permutation test. Returns dict of arrays with shape scores.shape[1:]."""
+    scores = np.asarray(scores, dtype=np.float64)
+    reference_scores = np.asarray(reference_scores, dtype=np.float64)
+    assert scores.shape == reference_scores.shape, "Scores and reference scores are not paired"
+    differences = scores - reference_scores
+    # the same resampled units for team, reference and differences (paired bootstrap)
+    stacked = np.stack([scores, reference_scores, differences], axis=1)
+    bootstrap = bootstrap_means(stacked, num_resamples, rng, chunk_size)
+    alpha = (1 - confidence) / 2
+    with warnings.catch_warnings():
+        # units with undefined scores only (e.g. ccc of constant predictions) give NaN intervals
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low, high = np.nanquantile(bootstrap, [alpha, 1 - alpha], axis=0) if num_resamples else np.full((2,) + stacked.shape[1:], np.nan)
+    means = _weighted_means(np.ones((1, len(stacked))), stacked)[0]
+    return {
+        "mean": means[0],
+        "ci_low": low[0],
+        "ci_high": high[0],
+        "reference_mean": means[1],
+        "reference_ci_low": low[1],
+        "reference_ci_high": high[1],
+        "difference": means[2],
+        "difference_ci_low": low[2],
+        "difference_ci_high": high[2],
+        "p_value": paired_permutation_test(differences, num_permutations, rng, chunk_size),
+    }
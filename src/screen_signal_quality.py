@@ -0,0 +1,78 @@
+from pathlib import Path
+import argparse
+import os
+
+
+"""
+Screen signal quality of physiology files of all scenarios and folds (see src/quality/signal_quality.py for measures).
+Files are screened in parallel, results are kept in an index next to data directory (<data dir>.quality), keyed on file content,
+so later runs (and notebooks, through src.quality.QualityIndex) reuse them instead of running NeuroKit2 again.
+Saves per-file summaries (one row per file and channel) to <index dir>/summary.csv and, with `--best N`,
+N windows with the highest quality to <index dir>/best_windows.csv, e.g. to pick examples or stratify tests:
+    python -m src.screen_signal_quality --pattern "scenario_1/test/physiology/*.csv" --best 10 --channel ecg --by ecg_quality
+"""
+
+root_dir = Path(__file__).parent.parent
+competition_data_path = root_dir / "data" / "competition" / "competition_data"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Screen signal quality of physiology files.')
+    parser.add_argument(
+        "--data-dir", type=Path, default=competition_data_path, help="Directory with physiology files."
+    )
+    parser.add_argument(
+        "--pattern", type=str, default="**/physiology/*.csv", help="Glob pattern of screened files (relative to data directory)."
+    )
+    parser.add_argument(
+        "--index-dir", type=Path, default=None, help="Directory of quality index, defaults to <data dir>.quality"
+    )
+    parser.add_argument(
+        "--sampling-rate", type=float, default=1000
+    )
+    parser.add_argument(
+        "--window-seconds", type=float, default=10.0, help="Length of summarized windows."
+    )
+    parser.add_argument(
+        "--flat-seconds", type=float, default=1.0, help="Minimal length of constant run counted as flat line."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Number of processes screening files."
+    )
+    parser.add_argument(
+        "--best", type=int, default=0, help="Number of best windows to save."
+    )
+    parser.add_argument(
+        "--channel", type=str, default="ecg", help="Channel of best windows."
+    )
+    parser.add_argument(
+        "--by", type=str, default="ecg_quality", help="Summary field ranking best windows (e.g. ecg_quality, quality)."
+    )
+    args = parser.parse_args()
+    from tqdm import tqdm
+    from .quality import FIELDS, QualityIndex, get_neurokit
+    from .storage import BinaryStore
+
+    assert args.data_dir.is_dir(), f"{args.data_dir} does not exist"
+    assert args.by in FIELDS, f"--by has to be one of {', '.join(FIELDS)}"
+    if get_neurokit() is None:
+        print("neurokit2 is not installed, ecg_quality is not computed")
+    index_dir = args.index_dir if args.index_dir is not None else args.data_dir.with_name(args.data_dir.name + ".quality")
+    store = BinaryStore(args.data_dir)
+    store = store if store.exists() else None
+    quality_index = QualityIndex(index_dir, args.sampling_rate, args.window_seconds, args.flat_seconds)
+    file_paths = sorted(args.data_dir.glob(args.pattern))
+    if not file_paths:
+        exit(f"No files match {args.pattern} in {args.data_dir}")
+    with tqdm(total=len(file_paths)) as progress_bar:
+        entries = quality_index.compute(file_paths, args.workers, store, progress_bar)
+    summary_df = QualityIndex.summary_frame(entries, relative_to=args.data_dir)
+    summary_df.to_csv(index_dir / "summary.csv", index=False)
+    print(f"Saved summaries of {len(entries)} files to {index_dir / 'summary.csv'}")
+    if args.best > 0:
+        best_df = QualityIndex.best_windows(entries, args.best, args.channel, args.by, relative_to=args.data_dir)
+        if best_df.empty:
+            print(f"No {args.channel} windows with known {args.by}, no best windows saved")
+        else:
+            best_df.to_csv(index_dir / "best_windows.csv", index=False)
+            print(best_df.to_string(index=False))
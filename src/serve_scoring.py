@@ -0,0 +1,102 @@
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+import argparse
+import ast
+import json
+import time
+
+
+"""
+Long-lived scoring service: test annotations are loaded once and kept in memory, so every request only reads and scores predictions.
+Endpoints (JSON in and out):
+    GET  /health - {"status": "ok", "test_files": <number of test files>}
+    POST /score  - {"results_dir": "<path to results directory>", "team": "<optional team name>"}
+                   or {"predictions": {"<scenario>/[<fold>/]test/annotations/sub_X_vid_Y.csv": {"arousal": [...], "valence": [...]}}, "team": ...}
+                   returns {"scores": <scores.json content>, "seconds": <scoring time>}
+Example:
+    python -m src.serve_scoring --port 8000
+    curl -X POST localhost:8000/score -d '{"results_dir": "predictions/subs/team_0/results"}'
+"""
+
+root = Path(__file__).parent.parent
+test_path = root / Path("data/competition/test_annotations/") # test data
+score_cache_dir = root / "scores" / ".files_level_cache"
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    # set by make_server
+    scorer = None
+    scorer_lock = None
+
+    def _send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        epic_reader = self.scorer.epic_reader
+        self._send_json(200, {"status": "ok", "test_files": len(epic_reader.index_dir(epic_reader.test_dir, relative_to=epic_reader.test_dir))})
+
+    def do_POST(self):
+        if self.path != "/score":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            start_time = time.perf_counter()
+            # scorer (its directory indices and score cache) is not thread-safe
+            with self.scorer_lock:
+                if "results_dir" in request:
+                    # results directory may have been re-uploaded since last request
+                    self.scorer.epic_reader.clear_index()
+                    results_table = self.scorer.score_results_dir(Path(request["results_dir"]), request.get("team"))
+                elif "predictions" in request:
+                    results_table = self.scorer.score_arrays(request["predictions"], request.get("team"))
+                else:
+                    raise ValueError("Request has to contain 'results_dir' or 'predictions'")
+            scores = results_table.to_nested_dict()
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            self._send_json(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._send_json(200, {"scores": scores, "seconds": time.perf_counter() - start_time})
+
+
+def make_server(scorer, host="127.0.0.1", port=8000):
+    handler_class = type("BoundScoringRequestHandler", (ScoringRequestHandler,), {"scorer": scorer, "scorer_lock": Lock()})
+    return ThreadingHTTPServer((host, port), handler_class)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve scoring of predictions over HTTP, with test annotations kept in memory.')
+    parser.add_argument(
+        "--finite", type=ast.literal_eval, default=True
+    )
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1"
+    )
+    parser.add_argument(
+        "--port", type=int, default=8000
+    )
+    parser.add_argument(
+        "--cache", type=ast.literal_eval, default=True, help=f"Reuse per-file results of unchanged prediction files (cached in {score_cache_dir})."
+    )
+    args = parser.parse_args()
+    from src.scoring.Scorer import Scorer
+    scorer = Scorer(test_path, args.finite, score_cache_dir if args.cache else None)
+    server = make_server(scorer, args.host, args.port)
+    print(f"Scoring service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if scorer.score_cache is not None:
+            scorer.score_cache.save()
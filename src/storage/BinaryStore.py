@@ -0,0 +1,149 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+class BinaryStore:
+    """Binary copy of a tree of .csv files (e.g. data/competition/competition_data), one memory-mappable .npy file per column.
+    Store lives next to source directory (`<source_dir>.npystore`) and has one manifest per scenario (first level directory),
+    recording source file mtime and size, so stale entries are detected and read from .csv instead.
+    Reads which fall back to .csv are counted in `num_fallbacks` (the first one of a process is reported)."""
+
+    MANIFEST_NAME = "manifest.json"
+    STORE_SUFFIX = ".npystore"
+
+    def __init__(self, source_dir, store_dir=None) -> None:
+        self.source_dir = Path(source_dir)
+        self.store_dir = Path(store_dir) if store_dir is not None else self.source_dir.with_name(self.source_dir.name + self.STORE_SUFFIX)
+        self.manifests = dict()
+        self.num_fallbacks = 0
+
+    def exists(self) -> bool:
+        return self.store_dir.is_dir()
+
+    @staticmethod
+    def _group(relative_path):
+        return relative_path.parts[0] if len(relative_path.parts) > 1 else "."
+
+    def _relative_path(self, file_path):
+        # absolute paths first (cheap, keeps symlinked files inside source directory), then fully resolved ones
+        for resolve in (os.path.abspath, os.path.realpath):
+            try:
+                return Path(resolve(file_path)).relative_to(resolve(self.source_dir))
+            except ValueError:
+                pass
+        return None
+
+    def _manifest_path(self, group):
+        return self.store_dir / group / self.MANIFEST_NAME
+
+    def load_manifest(self, group) -> dict:
+        "Load manifest of one scenario (cached after first read)."
+        if group not in self.manifests:
+            manifest_path = self._manifest_path(group)
+            if manifest_path.exists():
+                with open(manifest_path, "r") as fp:
+                    self.manifests[group] = json.load(fp)
+            else:
+                self.manifests[group] = dict()
+        return self.manifests[group]
+
+    def _save_manifest(self, group, manifest) -> None:
+        manifest_path = self._manifest_path(group)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(manifest, fp)
+        os.replace(tmp_path, manifest_path)
+        self.manifests[group] = manifest
+
+    def _get_entry(self, file_path):
+        "Get manifest entry of file if it is fresh (source did not change since conversion), None otherwise."
+        relative_path = self._relative_path(file_path)
+        if relative_path is None or not self.exists():
+            return None
+        entry = self.load_manifest(self._group(relative_path)).get(relative_path.as_posix())
+        if entry is None:
+            return None
+        stat = Path(file_path).stat()
+        if (entry["source_mtime_ns"], entry["source_size"]) != (stat.st_mtime_ns, stat.st_size):
+            return None
+        return entry
+
+    def is_fresh(self, file_path) -> bool:
+        return self._get_entry(file_path) is not None
+
+    def convert_file(self, file_path) -> dict:
+        "Parse .csv file once and write every column to its own .npy file. Returns manifest entry."
+        file_path = Path(file_path)
+        relative_path = self._relative_path(file_path)
+        stat = file_path.stat()
+        df = pd.read_csv(file_path)
+        arrays_dir = self.store_dir / relative_path.with_suffix("")
+        arrays_dir.mkdir(parents=True, exist_ok=True)
+        for column in df.columns:
+            np.save(arrays_dir / f"{column}.npy", df[column].to_numpy())
+        return {
+            "columns": list(df.columns),
+            "num_rows": len(df),
+            "arrays_dir": arrays_dir.relative_to(self.store_dir).as_posix(),
+            "source_mtime_ns": stat.st_mtime_ns,
+            "source_size": stat.st_size,
+        }
+
+    def convert(self, pattern="**/*.csv", workers=1, force=False) -> int:
+        "Convert (new or changed) source .csv files matching pattern. Returns number of converted files."
+        files_by_group = dict()
+        for file_path in sorted(self.source_dir.glob(pattern)):
+            if force or not self.is_fresh(file_path):
+                files_by_group.setdefault(self._group(self._relative_path(file_path)), list()).append(file_path)
+        num_converted = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for group, file_paths in files_by_group.items():
+                manifest = dict(self.load_manifest(group))
+                for file_path, entry in zip(file_paths, executor.map(self.convert_file, file_paths, chunksize=16)):
+                    manifest[self._relative_path(file_path).as_posix()] = entry
+                self._save_manifest(group, manifest)
+                num_converted += len(file_paths)
+        return num_converted
+
+    def _fallback(self, file_path) -> None:
+        if not self.num_fallbacks:
+            print(f"{file_path} has no fresh entry in binary store {self.store_dir}, reading .csv files instead (see src/convert_to_binary.py)")
+        self.num_fallbacks += 1
+
+    def read_arrays(self, file_path, columns=None):
+        "Memory-map column arrays of file (zero-copy). Returns dict column -> array, or None if file is not in store or is stale."
+        entry = self._get_entry(file_path)
+        if entry is None:
+            self._fallback(file_path)
+            return None
+        arrays_dir = self.store_dir / entry["arrays_dir"]
+        columns = entry["columns"] if columns is None else columns
+        return {column: np.load(arrays_dir / f"{column}.npy", mmap_mode="r") for column in columns}
+
+    def read_frame(self, file_path, columns=None) -> pd.DataFrame:
+        """Read file as DataFrame from store, falling back to .csv if store entry is missing or stale.
+        DataFrame copies memory-mapped columns (it is still much faster than parsing .csv), use `read_columns_cached` for plain arrays."""
+        arrays = self.read_arrays(file_path, columns)
+        if arrays is None:
+            return pd.read_csv(file_path, usecols=columns)
+        return pd.DataFrame(arrays)
+
+
+def read_csv_cached(file_path, columns=None, store=None) -> pd.DataFrame:
+    "Read .csv file through binary `store` if given (and fresh), with plain pd.read_csv otherwise."
+    if store is None:
+        return pd.read_csv(file_path, usecols=columns)
+    return store.read_frame(file_path, columns)
+
+
+def read_columns_cached(file_path, columns, store=None) -> np.ndarray:
+    "Array of `columns` of .csv file, shape (n_rows, len(columns)). Columns are stacked straight from memory-mapped store if given (and fresh)."
+    arrays = store.read_arrays(file_path, list(columns)) if store is not None else None
+    if arrays is None:
+        return pd.read_csv(file_path, usecols=list(columns))[list(columns)].to_numpy()
+    return np.column_stack([arrays[column] for column in columns])
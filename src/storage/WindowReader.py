@@ -0,0 +1,169 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import numpy as np
+import pandas as pd
+
+
+class WindowReader:
+    """Random access to sample or time windows of long .csv recordings (e.g. physiology files), reading only the bytes of the window.
+    Every file gets a sparse row index: byte offset and time of every `checkpoint_rows`-th row, built by one scan for newlines
+    (no parsing) and kept in memory, or saved to `index_dir` if given. A window is read from the checkpoint before its first row
+    to the checkpoint after its last row. Files with a fresh entry in binary `store` are sliced from memory-mapped columns instead.
+    Time windows assume that time column is sorted."""
+
+    SCAN_CHUNK_BYTES = 1 << 24
+
+    def __init__(self, store=None, checkpoint_rows=1024, index_dir=None, time_column="time") -> None:
+        self.store = store
+        self.checkpoint_rows = checkpoint_rows
+        self.index_dir = Path(index_dir) if index_dir is not None else None
+        self.time_column = time_column
+        self.indices = dict()
+
+    def _index_path(self, file_path):
+        return self.index_dir / (Path(file_path).resolve().as_posix().lstrip("/").replace("/", "__") + ".npz")
+
+    def build_index(self, file_path) -> dict:
+        "Scan file for line starts once. Returns index with `columns`, `num_rows`, checkpoint `offsets` and `times`, `header_bytes` and file stat."
+        file_path = Path(file_path)
+        stat = file_path.stat()
+        with open(file_path, "rb") as fp:
+            header = fp.readline()
+            columns = header.decode().strip().split(",")
+            offsets, num_rows, chunk_start = list(), 0, len(header)
+            # rows start after every newline (and at the end of header), so only every checkpoint_rows-th newline is kept
+            row_start = chunk_start
+            while chunk := fp.read(self.SCAN_CHUNK_BYTES):
+                line_ends = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n")) + chunk_start
+                row_starts = np.concatenate([[row_start], line_ends[:-1] + 1]) if len(line_ends) else np.empty(0, dtype=np.int64)
+                first_checkpoint = (-num_rows) % self.checkpoint_rows
+                offsets.append(row_starts[first_checkpoint::self.checkpoint_rows])
+                num_rows += len(line_ends)
+                if len(line_ends):
+                    row_start = line_ends[-1] + 1
+                chunk_start += len(chunk)
+            if row_start < stat.st_size:
+                # last line without newline
+                if num_rows % self.checkpoint_rows == 0:
+                    offsets.append(np.array([row_start]))
+                num_rows += 1
+            offsets = np.concatenate(offsets).astype(np.int64) if offsets else np.empty(0, dtype=np.int64)
+            times = np.full(len(offsets), np.nan)
+            if self.time_column in columns:
+                time_column_num = columns.index(self.time_column)
+                for checkpoint_num, offset in enumerate(offsets.tolist()):
+                    fp.seek(offset)
+                    times[checkpoint_num] = float(fp.readline().split(b",")[time_column_num])
+        return {
+            "columns": np.array(columns), "num_rows": num_rows, "offsets": offsets, "times": times,
+            "file_size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "checkpoint_rows": self.checkpoint_rows,
+        }
+
+    def _is_fresh(self, index, stat):
+        return (int(index["mtime_ns"]), int(index["file_size"]), int(index["checkpoint_rows"])) == (stat.st_mtime_ns, stat.st_size, self.checkpoint_rows)
+
+    def get_index(self, file_path) -> dict:
+        "Row index of file, rebuilt if file changed since it was built."
+        file_path = Path(file_path)
+        stat = file_path.stat()
+        index = self.indices.get(file_path)
+        if index is not None and self._is_fresh(index, stat):
+            return index
+        index = None
+        if self.index_dir is not None and self._index_path(file_path).exists():
+            with np.load(self._index_path(file_path)) as npz:
+                index = {name: npz[name] for name in npz.files}
+            if not self._is_fresh(index, stat):
+                index = None
+        if index is None:
+            index = self.build_index(file_path)
+            if self.index_dir is not None:
+                self.index_dir.mkdir(parents=True, exist_ok=True)
+                tmp_path = self._index_path(file_path).with_suffix(".tmp")
+                with open(tmp_path, "wb") as fp:
+                    np.savez(fp, **index)
+                os.replace(tmp_path, self._index_path(file_path))
+        self.indices[file_path] = index
+        return index
+
+    def _time_to_rows(self, index, file_path, start, end):
+        "Rows range [first, last) of checkpoint blocks covering times [start, end). Rows are narrowed down after reading."
+        times, checkpoint_rows = index["times"], int(index["checkpoint_rows"])
+        if np.isnan(times).all() and len(times):
+            raise ValueError(f"No '{self.time_column}' column in {file_path}")
+        first_checkpoint = max(np.searchsorted(times, start, side="right") - 1, 0)
+        last_checkpoint = np.searchsorted(times, end, side="left")
+        return first_checkpoint * checkpoint_rows, min(last_checkpoint * checkpoint_rows, int(index["num_rows"]))
+
+    def _read_rows(self, file_path, fp, index, first_row, last_row, columns):
+        "Parse rows [first_row, last_row) from checkpoint blocks. Returns DataFrame indexed by row (sample) number."
+        num_rows, checkpoint_rows, offsets = int(index["num_rows"]), int(index["checkpoint_rows"]), index["offsets"]
+        first_row, last_row = max(first_row, 0), min(last_row, num_rows)
+        all_columns = index["columns"].tolist()
+        if first_row >= last_row:
+            return pd.DataFrame(columns=columns, index=pd.RangeIndex(first_row, first_row))
+        first_checkpoint = first_row // checkpoint_rows
+        last_checkpoint = -(-last_row // checkpoint_rows)
+        start_byte = int(offsets[first_checkpoint])
+        end_byte = int(offsets[last_checkpoint]) if last_checkpoint < len(offsets) else int(index["file_size"])
+        fp.seek(start_byte)
+        block = pd.read_csv(io.BytesIO(fp.read(end_byte - start_byte)), header=None, names=all_columns, usecols=columns)[columns]
+        block.index = pd.RangeIndex(first_checkpoint * checkpoint_rows, first_checkpoint * checkpoint_rows + len(block))
+        return block.loc[first_row:last_row - 1]
+
+    def _read_file_windows(self, file_path, windows, channels, by):
+        "Read windows [(start, end), ...] of one file, opening it once."
+        file_path = Path(file_path)
+        arrays = self.store.read_arrays(file_path) if self.store is not None else None
+        if arrays is not None:
+            columns = list(arrays) if channels is None else ([self.time_column] if self.time_column in arrays else []) + [channel for channel in channels if channel != self.time_column]
+            frames = list()
+            for start, end in windows:
+                if by == "time":
+                    start, end = np.searchsorted(arrays[self.time_column], [start, end], side="left")
+                start, end = max(int(start), 0), max(int(end), 0)
+                frame = pd.DataFrame({column: np.array(arrays[column][start:end]) for column in columns})
+                frame.index = pd.RangeIndex(start, start + len(frame))
+                frames.append(frame)
+            return frames
+        index = self.get_index(file_path)
+        all_columns = index["columns"].tolist()
+        if channels is None:
+            columns = all_columns
+        else:
+            columns = ([self.time_column] if self.time_column in all_columns else []) + [channel for channel in channels if channel != self.time_column]
+        frames = list()
+        with open(file_path, "rb") as fp:
+            for start, end in windows:
+                if by == "time":
+                    first_row, last_row = self._time_to_rows(index, file_path, start, end)
+                    frame = self._read_rows(file_path, fp, index, first_row, last_row, columns)
+                    frames.append(frame[(frame[self.time_column] >= start) & (frame[self.time_column] < end)])
+                else:
+                    frames.append(self._read_rows(file_path, fp, index, int(start), int(end), columns))
+        return frames
+
+    def read_window(self, file_path, start, end, channels=None, by="sample") -> pd.DataFrame:
+        """Rows of file with sample numbers (`by="sample"`) or times (`by="time"`) in [start, end), as DataFrame indexed by sample number.
+        channels : list of columns to read (time column is always included), all columns if None"""
+        return self._read_file_windows(file_path, [(start, end)], channels, by)[0]
+
+    def read_windows(self, requests, channels=None, by="sample", workers=1) -> list:
+        """Read many windows at once: requests are (file_path, start, end) tuples, e.g. the same window of a recording and its noise copy.
+        Every file is opened once, files are read by `workers` threads. Returns DataFrames in order of requests."""
+        windows_by_file = dict()
+        for request_num, (file_path, start, end) in enumerate(requests):
+            windows_by_file.setdefault(Path(file_path), list()).append((request_num, (start, end)))
+        frames = [None] * len(requests)
+
+        def read_file(file_path):
+            file_windows = windows_by_file[file_path]
+            return file_windows, self._read_file_windows(file_path, [window for _, window in file_windows], channels, by)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for file_windows, file_frames in executor.map(read_file, list(windows_by_file)):
+                for (request_num, _), frame in zip(file_windows, file_frames):
+                    frames[request_num] = frame
+        return frames
@@ -0,0 +1,2 @@
+from .BinaryStore import BinaryStore, read_columns_cached, read_csv_cached
+from .WindowReader import WindowReader